@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Specialty, Doctor, DoctorReview, DoctorAvailability, Appointment, Prescription, PrescriptionItem, VirtualSession, TestRequest
+from .models import Specialty, Doctor, DoctorReview, DoctorRatingAggregate, DoctorAvailability, Appointment, Prescription, PrescriptionItem, VirtualSession, TestRequest
 
 @admin.register(Specialty)
 class SpecialtyAdmin(admin.ModelAdmin):
@@ -14,6 +14,19 @@ class DoctorAdmin(admin.ModelAdmin):
     ordering = ('-created_at',)
     readonly_fields = ('created_at', 'updated_at', 'submitted_at', 'reviewed_at')
     filter_horizontal = ('specialties',)
+
+    def get_search_results(self, request, queryset, search_term):
+        """Use the ranked directory index instead of chained icontains scans."""
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if '@' in search_term:
+            return queryset.filter(user__email__iexact=search_term), False
+        by_license = queryset.filter(license_number=search_term)
+        if by_license.exists():
+            return by_license, False
+        from .search import search_doctors
+        return search_doctors(queryset, search_term), False
     
     fieldsets = (
         ('Basic Information', {
@@ -64,6 +77,16 @@ class DoctorReviewAdmin(admin.ModelAdmin):
         }),
     )
 
+@admin.register(DoctorRatingAggregate)
+class DoctorRatingAggregateAdmin(admin.ModelAdmin):
+    list_display = ('doctor', 'average_rating', 'review_count', 'rating_5_count', 'rating_1_count', 'updated_at')
+    search_fields = ('doctor__first_name', 'doctor__last_name')
+    ordering = ('-average_rating',)
+    readonly_fields = (
+        'doctor', 'review_count', 'rating_sum', 'rating_1_count', 'rating_2_count',
+        'rating_3_count', 'rating_4_count', 'rating_5_count', 'average_rating', 'updated_at'
+    )
+
 @admin.register(DoctorAvailability)
 class DoctorAvailabilityAdmin(admin.ModelAdmin):
     list_display = ('doctor', 'day_of_week', 'start_time', 'end_time', 'is_available')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from doctors.models import DoctorRatingAggregate
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized doctor rating aggregates from DoctorReview rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor-id', type=int, action='append', dest='doctor_ids', help='Only rebuild the given doctor (repeatable)')
+
+    def handle(self, *args, **options):
+        doctor_ids = options.get('doctor_ids')
+        written = DoctorRatingAggregate.rebuild(doctor_ids=doctor_ids)
+        scope = f"{len(doctor_ids)} doctor(s)" if doctor_ids else "all doctors"
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} rating aggregate(s) for {scope}.'))
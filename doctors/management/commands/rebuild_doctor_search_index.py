@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from doctors.models import Doctor
+from doctors.search import refresh_doctor_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text/trigram search index for every doctor.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Doctors refreshed per batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        doctor_ids = list(Doctor.objects.order_by('id').values_list('id', flat=True))
+        updated = 0
+        for offset in range(0, len(doctor_ids), batch_size):
+            updated += refresh_doctor_search_index(doctor_ids[offset:offset + batch_size])
+        self.stdout.write(self.style.SUCCESS(f'Refreshed search index for {updated} doctor(s).'))
@@ -1,6 +1,10 @@
 # doctors/models.py
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.utils import timezone
 from decimal import Decimal
 import uuid
@@ -16,6 +20,14 @@ class Specialty(models.Model):
     class Meta:
         verbose_name_plural = "Specialties"
 
+class DoctorQuerySet(models.QuerySet):
+    def with_rating_stats(self):
+        """Annotate each doctor with the denormalized rating aggregate (one join, no per-row queries)."""
+        return self.annotate(
+            rating_average=Coalesce(F('rating_aggregate__average_rating'), Value(0.0)),
+            rating_count=Coalesce(F('rating_aggregate__review_count'), Value(0)),
+        )
+
 class Doctor(models.Model):
     GENDER_CHOICES = (
         ('M', 'Male'),
@@ -131,8 +143,14 @@ class Doctor(models.Model):
         help_text="Reason for rejection if application was rejected"
     )
     
+    # Directory search index, maintained by doctors.search.refresh_doctor_search_index
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+    search_document = models.TextField(blank=True, default='', editable=False)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = DoctorQuerySet.as_manager()
     
     def __str__(self):
         return f"Dr. {self.first_name} {self.last_name}"
@@ -143,10 +161,24 @@ class Doctor(models.Model):
     
     @property
     def average_rating(self):
-        ratings = self.reviews.all()
-        if ratings:
-            return sum(r.rating for r in ratings) / len(ratings)
-        return 0
+        # List/detail querysets annotate this via DoctorQuerySet.with_rating_stats()
+        if hasattr(self, 'rating_average'):
+            return self.rating_average or 0
+        average = DoctorRatingAggregate.objects.filter(doctor_id=self.pk).values_list('average_rating', flat=True).first()
+        return average or 0
+
+    @property
+    def review_count(self):
+        if hasattr(self, 'rating_count'):
+            return self.rating_count or 0
+        count = DoctorRatingAggregate.objects.filter(doctor_id=self.pk).values_list('review_count', flat=True).first()
+        return count or 0
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='doctor_search_vector_gin'),
+            GinIndex(fields=['search_document'], name='doctor_search_doc_trgm', opclasses=['gin_trgm_ops']),
+        ]
 
 class DoctorReview(models.Model):
     doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='reviews')
@@ -162,6 +194,102 @@ class DoctorReview(models.Model):
     class Meta:
         unique_together = ('doctor', 'user')
 
+class DoctorRatingAggregate(models.Model):
+    """
+    Denormalized review statistics for a doctor (count, sum and 1-5 star histogram).
+    Kept current by the DoctorReview signals in doctors/signals.py and rebuilt from
+    scratch by the `rebuild_doctor_ratings` management command.
+    """
+    doctor = models.OneToOneField(Doctor, on_delete=models.CASCADE, related_name='rating_aggregate', primary_key=True)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+    average_rating = models.FloatField(default=0, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.doctor.full_name} - {self.average_rating:.2f} ({self.review_count} reviews)"
+
+    @property
+    def histogram(self):
+        return {star: getattr(self, f'rating_{star}_count') for star in range(1, 6)}
+
+    def _bucket_field(self, rating):
+        if 1 <= rating <= 5:
+            return f'rating_{rating}_count'
+        return None
+
+    def _recalculate_average(self):
+        self.average_rating = self.rating_sum / self.review_count if self.review_count else 0
+
+    @classmethod
+    def record_change(cls, doctor_id, added=None, removed=None):
+        """
+        Apply a single review change to the doctor's aggregate.
+        `added` / `removed` are ratings; an edited review passes both.
+        """
+        with transaction.atomic():
+            aggregate, _ = cls.objects.select_for_update().get_or_create(doctor_id=doctor_id)
+            if removed is not None:
+                aggregate.review_count = max(aggregate.review_count - 1, 0)
+                aggregate.rating_sum = max(aggregate.rating_sum - removed, 0)
+                bucket = aggregate._bucket_field(removed)
+                if bucket:
+                    setattr(aggregate, bucket, max(getattr(aggregate, bucket) - 1, 0))
+            if added is not None:
+                aggregate.review_count += 1
+                aggregate.rating_sum += added
+                bucket = aggregate._bucket_field(added)
+                if bucket:
+                    setattr(aggregate, bucket, getattr(aggregate, bucket) + 1)
+            aggregate._recalculate_average()
+            aggregate.save()
+        return aggregate
+
+    @classmethod
+    def rebuild(cls, doctor_ids=None):
+        """
+        Recompute aggregates from DoctorReview with one grouped query and upsert them.
+        Returns the number of aggregates written.
+        """
+        reviews = DoctorReview.objects.all()
+        if doctor_ids is not None:
+            reviews = reviews.filter(doctor_id__in=doctor_ids)
+        buckets = {f'rating_{star}_count': Count('id', filter=Q(rating=star)) for star in range(1, 6)}
+        rows = reviews.values('doctor_id').annotate(
+            review_count=Count('id'),
+            rating_sum=Sum('rating'),
+            **buckets,
+        )
+
+        aggregates = []
+        for row in rows:
+            aggregate = cls(**row)
+            aggregate._recalculate_average()
+            aggregates.append(aggregate)
+
+        with transaction.atomic():
+            stale = cls.objects.exclude(doctor_id__in=[a.doctor_id for a in aggregates])
+            if doctor_ids is not None:
+                stale = stale.filter(doctor_id__in=doctor_ids)
+            stale.delete()
+            cls.objects.bulk_create(
+                aggregates,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['doctor'],
+                update_fields=['review_count', 'rating_sum', *buckets.keys(), 'average_rating', 'updated_at'],
+            )
+        return len(aggregates)
+
+    class Meta:
+        verbose_name = "Doctor Rating Aggregate"
+        verbose_name_plural = "Doctor Rating Aggregates"
+
 class DoctorAvailability(models.Model):
     DAY_CHOICES = (
         (0, 'Monday'),
@@ -255,6 +383,12 @@ class Appointment(models.Model):
     def __str__(self):
         return f"{self.user.email} - {self.doctor.full_name} - {self.date} {self.start_time}"
 
+    class Meta:
+        indexes = [
+            # Overlap checks and slot computation scan one doctor's day
+            models.Index(fields=['doctor', 'date', 'start_time']),
+        ]
+
 
 class Prescription(models.Model):
     appointment = models.ForeignKey(Appointment, on_delete=models.CASCADE, related_name='prescriptions')
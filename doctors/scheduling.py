@@ -0,0 +1,163 @@
+# doctors/scheduling.py
+"""
+Bookable-slot engine.
+
+Weekly DoctorAvailability windows are expanded over a date range and the
+existing Appointment intervals are subtracted from them. Everything is loaded
+with two queries (availability + appointments) for any number of doctors and
+days, then resolved in memory with sorted, merged interval lists expressed in
+minutes since midnight.
+"""
+from collections import defaultdict
+from datetime import timedelta, time
+
+from django.utils import timezone
+
+from .models import DoctorAvailability, Appointment
+
+# Appointments in these states occupy the doctor's calendar
+BLOCKING_STATUSES = [
+    Appointment.StatusChoices.SCHEDULED,
+    Appointment.StatusChoices.CONFIRMED,
+]
+
+DEFAULT_SLOT_MINUTES = 30
+MAX_RANGE_DAYS = 31
+MAX_DOCTORS_PER_REQUEST = 50
+
+
+def _to_minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _to_time(minutes):
+    # 24:00 is represented as 23:59 so it still fits in a TimeField
+    minutes = min(minutes, 24 * 60 - 1)
+    return time(minutes // 60, minutes % 60)
+
+
+def merge_intervals(intervals):
+    """Merge overlapping/adjacent (start, end) minute intervals. Returns a sorted list."""
+    merged = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_intervals(windows, busy):
+    """
+    Subtract sorted, merged `busy` intervals from sorted, merged `windows`
+    with a single two-pointer sweep.
+    """
+    free = []
+    j = 0
+    for start, end in windows:
+        cursor = start
+        # Skip busy intervals that end before this window starts
+        while j < len(busy) and busy[j][1] <= cursor:
+            j += 1
+        k = j
+        while k < len(busy) and busy[k][0] < end:
+            busy_start, busy_end = busy[k]
+            if busy_start > cursor:
+                free.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+            if cursor >= end:
+                break
+            k += 1
+        if cursor < end:
+            free.append((cursor, end))
+    return free
+
+
+def split_into_slots(free_intervals, slot_minutes, not_before=None):
+    slots = []
+    for start, end in free_intervals:
+        cursor = start
+        if not_before is not None and cursor < not_before:
+            # Align to the slot grid of this free interval
+            steps = -(-(not_before - cursor) // slot_minutes)
+            cursor += steps * slot_minutes
+        while cursor + slot_minutes <= end:
+            slots.append((cursor, cursor + slot_minutes))
+            cursor += slot_minutes
+    return slots
+
+
+def get_bookable_slots(doctor_ids, start_date, end_date, slot_minutes=DEFAULT_SLOT_MINUTES, now=None):
+    """
+    Return {doctor_id: {date: [(start_time, end_time), ...]}} of free slots
+    for every doctor in `doctor_ids` between start_date and end_date (inclusive).
+    """
+    doctor_ids = list(doctor_ids)
+    now = timezone.localtime(now or timezone.now())
+    today = now.date()
+    current_minute = _to_minutes(now.time())
+
+    weekly_windows = defaultdict(list)
+    for doctor_id, day_of_week, start, end in DoctorAvailability.objects.filter(
+        doctor_id__in=doctor_ids, is_available=True
+    ).values_list('doctor_id', 'day_of_week', 'start_time', 'end_time'):
+        weekly_windows[(doctor_id, day_of_week)].append((_to_minutes(start), _to_minutes(end)))
+    weekly_windows = {key: merge_intervals(value) for key, value in weekly_windows.items()}
+
+    busy = defaultdict(list)
+    for doctor_id, day, start, end in Appointment.objects.filter(
+        doctor_id__in=doctor_ids,
+        date__range=(start_date, end_date),
+        status__in=BLOCKING_STATUSES,
+    ).values_list('doctor_id', 'date', 'start_time', 'end_time'):
+        busy[(doctor_id, day)].append((_to_minutes(start), _to_minutes(end)))
+    busy = {key: merge_intervals(value) for key, value in busy.items()}
+
+    days = []
+    day = max(start_date, today)
+    while day <= end_date:
+        days.append(day)
+        day += timedelta(days=1)
+
+    result = {}
+    for doctor_id in doctor_ids:
+        per_day = {}
+        for day in days:
+            windows = weekly_windows.get((doctor_id, day.weekday()))
+            if not windows:
+                continue
+            free = subtract_intervals(windows, busy.get((doctor_id, day), []))
+            not_before = current_minute if day == today else None
+            slots = split_into_slots(free, slot_minutes, not_before=not_before)
+            if slots:
+                per_day[day] = [(_to_time(s), _to_time(e)) for s, e in slots]
+        result[doctor_id] = per_day
+    return result
+
+
+
+def lock_doctor_schedule(doctor_id):
+    """
+    Serialize writes to one doctor's calendar by locking the Doctor row.
+    Must be called inside transaction.atomic(); concurrent bookings for the
+    same doctor queue behind the lock, other doctors are unaffected.
+    """
+    from .models import Doctor
+    Doctor.objects.select_for_update().only('id').get(pk=doctor_id)
+
+
+def find_conflicting_appointment(doctor_id, date, start_time, end_time, exclude_id=None):
+    """Return the first blocking appointment overlapping [start_time, end_time) on that date, or None."""
+    conflicts = Appointment.objects.filter(
+        doctor_id=doctor_id,
+        date=date,
+        status__in=BLOCKING_STATUSES,
+        start_time__lt=end_time,
+        end_time__gt=start_time,
+    )
+    if exclude_id is not None:
+        conflicts = conflicts.exclude(pk=exclude_id)
+    return conflicts.only('id', 'start_time', 'end_time').first()
@@ -0,0 +1,100 @@
+# doctors/search.py
+"""
+Ranked directory search for doctors.
+
+Each Doctor carries a weighted `search_vector` (PostgreSQL full-text) and a flat
+`search_document` (trigram-indexed for typo tolerance). Both are rebuilt by
+`refresh_doctor_search_index` whenever a doctor or one of its specialties
+changes (see doctors/signals.py) and can be backfilled with the
+`rebuild_doctor_search_index` management command.
+"""
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db.models import F, Func, OuterRef, Q, Subquery, TextField, Value
+from django.db.models.functions import Coalesce, Concat, Greatest, NullIf
+
+SEARCH_CONFIG = 'english'
+TRIGRAM_WEIGHT = 0.5
+
+# Fields on Doctor that feed the index; saves touching none of them skip the refresh
+INDEXED_DOCTOR_FIELDS = {'first_name', 'last_name', 'bio', 'languages_spoken', 'hospital_name'}
+
+
+def ensure_search_extensions(sender=None, using='default', **kwargs):
+    """pre_migrate hook: trigram indexes need pg_trgm before tables are created."""
+    from django.db import connections
+    conn = connections[using]
+    if conn.vendor != 'postgresql':
+        return
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+
+
+class ConcatWS(Func):
+    """CONCAT_WS: joins its arguments after the separator, skipping NULLs."""
+    function = 'CONCAT_WS'
+    output_field = TextField()
+
+
+def _specialty_names():
+    from .models import Doctor
+    return Coalesce(
+        Subquery(
+            Doctor.specialties.through.objects.filter(doctor_id=OuterRef('pk'))
+            .values('doctor_id')
+            .annotate(names=StringAgg('specialty__name', ' ', order_by='specialty__name'))
+            .values('names')
+        ),
+        Value(''),
+        output_field=TextField(),
+    )
+
+
+def _weighted_parts():
+    return [
+        (Concat(F('first_name'), Value(' '), F('last_name'), output_field=TextField()), 'A'),
+        (_specialty_names(), 'A'),
+        (F('hospital_name'), 'B'),
+        (F('languages_spoken'), 'C'),
+        (F('bio'), 'D'),
+    ]
+
+
+def refresh_doctor_search_index(doctor_ids):
+    """
+    Recompute search_vector/search_document for the given doctors (ids or a
+    queryset of them) in one UPDATE, however many a specialty change touches.
+    """
+    from .models import Doctor
+
+    parts = _weighted_parts()
+    vector = None
+    for expression, weight in parts:
+        part = SearchVector(expression, weight=weight, config=SEARCH_CONFIG)
+        vector = part if vector is None else vector + part
+    document = ConcatWS(Value(' '), *(NullIf(expression, Value('')) for expression, _ in parts))
+    # queryset.update() bypasses save() so the post_save hook does not recurse
+    return Doctor.objects.filter(pk__in=doctor_ids).update(search_document=document, search_vector=vector)
+
+
+def search_doctors(queryset, term):
+    """
+    Filter and rank `queryset` by `term`.
+
+    Full-text matches (websearch syntax, stemmed) and trigram word-similarity
+    matches (typos, partial names) are both served from GIN indexes; the result
+    is annotated with `search_rank` and ordered best-first.
+    """
+    term = (term or '').strip()
+    if not term:
+        return queryset
+
+    query = SearchQuery(term, search_type='websearch', config=SEARCH_CONFIG)
+    return queryset.annotate(
+        search_rank=Greatest(
+            SearchRank(F('search_vector'), query),
+            TrigramWordSimilarity(term, 'search_document') * TRIGRAM_WEIGHT,
+        ),
+    ).filter(
+        Q(search_vector=query) | Q(search_document__trigram_word_similar=term)
+    ).order_by('-search_rank', 'id')
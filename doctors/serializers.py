@@ -1,7 +1,11 @@
 # doctors/serializers.py
 from rest_framework import serializers
-from .models import Specialty, Doctor, DoctorReview, DoctorAvailability, Appointment, Prescription, PrescriptionItem
+from django.db.models import Count
+from django.db.models.functions import Lower
+from .models import Specialty, Doctor, DoctorReview, DoctorAvailability, Appointment, Prescription, PrescriptionItem, TestRequest
 from pharmacy.models import Medication
+from pharmacy.medication_search import clear_autocomplete_cache
+from vitanips.core.batching import BatchLoadingMixin, BatchedListSerializer
 # from pharmacy.serializers import MedicationSerializer
 
 class SpecialtySerializer(serializers.ModelSerializer):
@@ -91,6 +95,7 @@ class DoctorApplicationSerializer(serializers.ModelSerializer):
 class DoctorSerializer(serializers.ModelSerializer):
     specialties = SpecialtySerializer(many=True, read_only=True)
     average_rating = serializers.ReadOnlyField()
+    review_count = serializers.ReadOnlyField()
     user = DoctorUserSerializer(read_only=True)
     reviewed_by_name = serializers.SerializerMethodField()
 
@@ -100,14 +105,14 @@ class DoctorSerializer(serializers.ModelSerializer):
             'id', 'user', 'first_name', 'last_name', 'full_name', 'specialties',
             'profile_picture', 'gender', 'years_of_experience', 'education',
             'bio', 'languages_spoken', 'consultation_fee', 'is_available_for_virtual',
-            'is_verified', 'average_rating', 'application_status', 'license_number',
+            'is_verified', 'average_rating', 'review_count', 'application_status', 'license_number',
             'license_issuing_authority', 'license_expiry_date', 'hospital_name',
             'hospital_address', 'hospital_phone', 'hospital_email', 'hospital_contact_person',
             'submitted_at', 'reviewed_at', 'reviewed_by', 'reviewed_by_name', 'review_notes', 'rejection_reason',
             'created_at', 'updated_at'
         ]
         read_only_fields = [
-            'created_at', 'updated_at', 'full_name', 'average_rating',
+            'created_at', 'updated_at', 'full_name', 'average_rating', 'review_count',
             'reviewed_at', 'reviewed_by', 'is_verified', 'reviewed_by_name'
         ]
 
@@ -207,7 +212,9 @@ class DoctorAvailabilitySerializer(serializers.ModelSerializer):
         
         return data
 
-class AppointmentSerializer(serializers.ModelSerializer):
+class AppointmentSerializer(BatchLoadingMixin, serializers.ModelSerializer):
+    batch_loaders = ('followup_test_request', 'test_result_documents')
+
     patient_name = serializers.SerializerMethodField(read_only=True)
     patient_email = serializers.EmailField(source='user.email', read_only=True)
     doctor_name = serializers.SerializerMethodField(read_only=True)
@@ -264,6 +271,7 @@ class AppointmentSerializer(serializers.ModelSerializer):
             'is_followup', 'original_appointment', 'followup_discount_percentage',
             'created_at', 'updated_at'
         ]
+        list_serializer_class = BatchedListSerializer
     
     def validate_user_insurance_id(self, value):
         """Validate that the insurance belongs to the requesting user."""
@@ -314,161 +322,77 @@ class AppointmentSerializer(serializers.ModelSerializer):
         except (AttributeError, TypeError):
             return None
 
+    def load_followup_test_request(self, instances):
+        """Latest TestRequest per follow-up appointment, one query for the page."""
+        followup_ids = [a.pk for a in instances if a.is_followup or a.original_appointment_id]
+        if not followup_ids:
+            return {}
+        test_requests = {}
+        for test_request in TestRequest.objects.filter(
+            followup_appointment_id__in=followup_ids
+        ).order_by('followup_appointment_id', '-requested_at'):
+            test_requests.setdefault(test_request.followup_appointment_id, test_request)
+        return test_requests
+
+    def load_test_result_documents(self, instances):
+        """Result documents for every linked test request, one query for the page."""
+        from health.models import MedicalDocument
+
+        by_test_request = {}
+        for appointment in instances:
+            test_request = self.get_batched('followup_test_request', appointment)
+            if test_request:
+                by_test_request[test_request.pk] = appointment.pk
+        if not by_test_request:
+            return {}
+        documents = {}
+        for doc in MedicalDocument.objects.filter(
+            test_request_id__in=by_test_request.keys()
+        ).only('id', 'test_request_id', 'file', 'description', 'document_type', 'uploaded_at').order_by('-uploaded_at'):
+            documents.setdefault(by_test_request[doc.test_request_id], []).append(doc)
+        return documents
+
     def get_linked_test_request(self, obj):
         """Get test request linked to this follow-up appointment"""
-        # Early return if not a follow-up - check multiple ways to be safe
-        try:
-            # Check is_followup field
-            is_followup = False
-            if hasattr(obj, 'is_followup'):
-                is_followup = bool(obj.is_followup)
-            # Also check original_appointment as fallback
-            if not is_followup and hasattr(obj, 'original_appointment'):
-                try:
-                    is_followup = obj.original_appointment is not None
-                except Exception:
-                    pass
-            
-            if not is_followup:
-                return None
-        except Exception:
+        test_request = self.get_batched('followup_test_request', obj)
+        if not test_request:
             return None
-            
-        try:
-            from .models import TestRequest
-            from health.models import MedicalDocument
-            
-            # Use get() with a try-except to avoid errors if no test request exists
-            try:
-                test_request = TestRequest.objects.filter(followup_appointment=obj).select_related('doctor', 'patient', 'appointment').first()
-                if not test_request:
-                    return None
-            except Exception:
-                return None
-                
-            # Count test results directly to avoid related manager issues
-            try:
-                results_count = MedicalDocument.objects.filter(test_request=test_request).count()
-            except Exception:
-                results_count = 0
-            
-            # Return minimal data to avoid circular serialization issues
-            return {
-                'id': test_request.id,
-                'test_name': getattr(test_request, 'test_name', ''),
-                'test_description': getattr(test_request, 'test_description', None),
-                'instructions': getattr(test_request, 'instructions', None),
-                'status': getattr(test_request, 'status', 'pending'),
-                'has_test_results': results_count > 0,
-                'test_results_count': results_count,
-            }
-        except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f"Error getting linked test request for appointment {getattr(obj, 'id', 'unknown')}: {e}", exc_info=True)
-        return None
+        results_count = len(self.get_batched('test_result_documents', obj, default=[]))
+        # Return minimal data to avoid circular serialization issues
+        return {
+            'id': test_request.id,
+            'test_name': test_request.test_name,
+            'test_description': test_request.test_description,
+            'instructions': test_request.instructions,
+            'status': test_request.status,
+            'has_test_results': results_count > 0,
+            'test_results_count': results_count,
+        }
 
     def get_test_results(self, obj):
         """Get test results (documents) for this follow-up appointment's test request"""
-        # Return empty list immediately if any error occurs - be very defensive
-        try:
-            # Check if this is a follow-up appointment - multiple checks
-            is_followup = False
-            try:
-                if hasattr(obj, 'is_followup'):
-                    is_followup = bool(obj.is_followup)
-            except (AttributeError, TypeError):
-                pass
-            
-            # Fallback check
-            if not is_followup:
-                try:
-                    if hasattr(obj, 'original_appointment_id') and obj.original_appointment_id:
-                        is_followup = True
-                    elif hasattr(obj, 'original_appointment') and obj.original_appointment:
-                        is_followup = True
-                except (AttributeError, TypeError):
-                    pass
-            
-            if not is_followup:
-                return []
-            
-            # Only proceed if it's a follow-up
-            from .models import TestRequest
-            from health.models import MedicalDocument
-            
-            # Get test request - use try-except for safety
-            test_request = None
-            try:
-                test_request = TestRequest.objects.filter(followup_appointment_id=obj.id).first()
-            except Exception:
-                try:
-                    test_request = TestRequest.objects.filter(followup_appointment=obj).first()
-                except Exception:
-                    return []
-            
-            if not test_request:
-                return []
-            
-            # Get documents
-            documents = []
-            try:
-                documents = list(MedicalDocument.objects.filter(test_request_id=test_request.id).order_by('-uploaded_at')[:10])  # Limit to 10
-            except Exception:
-                return []
-                
-            # Return minimal data
-            results = []
-            request = self.context.get('request') if self.context else None
-            
-            for doc in documents:
+        documents = self.get_batched('test_result_documents', obj, default=[])[:10]  # Limit to 10
+        request = self.context.get('request') if self.context else None
+
+        results = []
+        for doc in documents:
+            file_url = None
+            filename = None
+            if doc.file:
                 try:
-                    file_url = None
-                    if hasattr(doc, 'file') and doc.file:
-                        try:
-                            if request:
-                                file_url = request.build_absolute_uri(doc.file.url)
-                            else:
-                                file_url = doc.file.url
-                        except Exception:
-                            pass
-                    
-                    filename = None
-                    if hasattr(doc, 'file') and doc.file:
-                        try:
-                            filename = doc.file.name.split('/')[-1]
-                        except Exception:
-                            try:
-                                filename = str(doc.file)
-                            except Exception:
-                                filename = None
-                    
-                    uploaded_at = None
-                    if hasattr(doc, 'uploaded_at') and doc.uploaded_at:
-                        try:
-                            uploaded_at = doc.uploaded_at.isoformat()
-                        except Exception:
-                            pass
-                    
-                    results.append({
-                        'id': getattr(doc, 'id', None),
-                        'file_url': file_url,
-                        'filename': filename,
-                        'description': getattr(doc, 'description', None),
-                        'document_type': getattr(doc, 'document_type', None),
-                        'uploaded_at': uploaded_at,
-                    })
+                    file_url = request.build_absolute_uri(doc.file.url) if request else doc.file.url
                 except Exception:
-                    # Skip this document if there's an error
-                    continue
-                    
-            return results
-        except Exception as e:
-            # Log but don't fail - return empty list to allow serialization to continue
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f"Error in get_test_results for appointment {getattr(obj, 'id', 'unknown')}: {e}", exc_info=True)
-            return []
+                    pass
+                filename = doc.file.name.split('/')[-1]
+            results.append({
+                'id': doc.id,
+                'file_url': file_url,
+                'filename': filename,
+                'description': doc.description,
+                'document_type': doc.document_type,
+                'uploaded_at': doc.uploaded_at.isoformat() if doc.uploaded_at else None,
+            })
+        return results
 
     def validate(self, data):
         instance = getattr(self, 'instance', None)
@@ -570,25 +494,17 @@ class DoctorPrescriptionCreateSerializer(serializers.ModelSerializer):
                 **validated_data  # Now only contains diagnosis and notes
             )
 
+            medications = self._resolve_medications(items_data)
+            items = []
             for item_data in items_data:
                 medication_name = item_data.pop('medication_name_input')
-                # Try to find existing medication with case-insensitive match
-                medication_obj = Medication.objects.filter(name__iexact=medication_name).first()
-                if not medication_obj:
-                    # Create new medication if not found
-                    medication_obj = Medication.objects.create(
-                        name=medication_name,
-                        description=f'Medication: {medication_name}',
-                        dosage_form='To be specified',
-                        strength=item_data.get('dosage', 'To be specified'),
-                        requires_prescription=True,
-                    )
-                PrescriptionItem.objects.create(
-                    prescription=prescription, 
-                    medication=medication_obj, 
-                    medication_name=medication_name, 
+                items.append(PrescriptionItem(
+                    prescription=prescription,
+                    medication=medications[Medication.normalize_name(medication_name)],
+                    medication_name=medication_name,
                     **item_data
-                )
+                ))
+            PrescriptionItem.objects.bulk_create(items)
             return prescription
         except Exception as e:
             import traceback
@@ -596,6 +512,40 @@ class DoctorPrescriptionCreateSerializer(serializers.ModelSerializer):
             print(traceback.format_exc())
             raise serializers.ValidationError(f"Failed to create prescription: {str(e)}")
 
+    def _resolve_medications(self, items_data):
+        """
+        Map each normalized medication name in the items to a Medication,
+        using one case-insensitive lookup and one bulk insert for names
+        that do not exist yet.
+        """
+        first_items = {}
+        for item_data in items_data:
+            first_items.setdefault(Medication.normalize_name(item_data['medication_name_input']), item_data)
+
+        medications = {}
+        existing = Medication.objects.annotate(name_lower=Lower('name')).filter(
+            name_lower__in=first_items
+        ).order_by('id')
+        for medication in existing:
+            medications.setdefault(medication.name_lower, medication)
+
+        missing = [
+            Medication(
+                name=item_data['medication_name_input'].strip(),
+                description=f"Medication: {item_data['medication_name_input'].strip()}",
+                dosage_form='To be specified',
+                strength=item_data.get('dosage', 'To be specified'),
+                requires_prescription=True,
+            )
+            for key, item_data in first_items.items() if key not in medications
+        ]
+        if missing:
+            for medication in Medication.objects.bulk_create(missing):
+                medications[Medication.normalize_name(medication.name)] = medication
+            # Cached autocomplete results predate these names and would not offer them
+            clear_autocomplete_cache()
+        return medications
+
 class DoctorPrescriptionListDetailSerializer(serializers.ModelSerializer):
     items = DoctorPrescriptionItemDisplaySerializer(many=True, read_only=True)
     patient_email = serializers.EmailField(source='user.email', read_only=True)
@@ -617,7 +567,9 @@ class DoctorPrescriptionListDetailSerializer(serializers.ModelSerializer):
             return f"{obj.user.first_name} {obj.user.last_name}".strip() or obj.user.username
         return "N/A"
 
-class DoctorEligibleAppointmentSerializer(serializers.ModelSerializer):
+class DoctorEligibleAppointmentSerializer(BatchLoadingMixin, serializers.ModelSerializer):
+    batch_loaders = ('has_prescription', 'patient_vitals_summary')
+
     patient_email = serializers.EmailField(source='user.email', read_only=True)
     patient_name = serializers.SerializerMethodField(read_only=True)
     has_existing_prescription = serializers.SerializerMethodField(read_only=True)
@@ -630,19 +582,30 @@ class DoctorEligibleAppointmentSerializer(serializers.ModelSerializer):
             'user', 'patient_email', 'patient_name',
             'has_existing_prescription', 'patient_vitals_summary'
         ]
+        list_serializer_class = BatchedListSerializer
 
     def get_patient_name(self, obj):
         if obj.user:
             return f"{obj.user.first_name} {obj.user.last_name}".strip() or obj.user.username
         return "N/A"
 
+    def load_has_prescription(self, instances):
+        appointment_ids = Prescription.objects.filter(
+            appointment_id__in=[a.pk for a in instances]
+        ).values_list('appointment_id', flat=True)
+        return {appointment_id: True for appointment_id in appointment_ids}
+
     def get_has_existing_prescription(self, obj):
-        return Prescription.objects.filter(appointment=obj).exists()
+        return self.get_batched('has_prescription', obj, default=False)
     
+    def load_patient_vitals_summary(self, instances):
+        """Summary of each patient's recent vitals (last 7 days), all patients on the page at once"""
+        from health.vitals_utils import get_vitals_summaries
+        summaries = get_vitals_summaries({a.user_id for a in instances}, days=7)
+        return {a.pk: summaries[a.user_id] for a in instances}
+
     def get_patient_vitals_summary(self, obj):
-        """Get summary of patient's recent vitals (last 7 days)"""
-        from health.vitals_utils import get_vitals_summary
-        return get_vitals_summary(obj.user.id, days=7)
+        return self.get_batched('patient_vitals_summary', obj)
 
 class PrescriptionItemSerializer(serializers.ModelSerializer):
     # Move the medication serializer import inside the to_representation method
@@ -715,8 +678,10 @@ class VirtualSessionSerializer(serializers.ModelSerializer):
         return None
 
 
-class TestRequestSerializer(serializers.ModelSerializer):
+class TestRequestSerializer(BatchLoadingMixin, serializers.ModelSerializer):
     """Serializer for TestRequest model"""
+    batch_loaders = ('test_results_count',)
+
     patient_name = serializers.SerializerMethodField(read_only=True)
     patient_email = serializers.EmailField(source='patient.email', read_only=True)
     doctor_name = serializers.SerializerMethodField(read_only=True)
@@ -741,6 +706,7 @@ class TestRequestSerializer(serializers.ModelSerializer):
             'has_test_results', 'test_results_count',
             'created_at', 'updated_at'
         ]
+        list_serializer_class = BatchedListSerializer
     
     def get_patient_name(self, obj):
         if obj.patient:
@@ -752,13 +718,20 @@ class TestRequestSerializer(serializers.ModelSerializer):
             return obj.doctor.full_name
         return "N/A"
     
+    def load_test_results_count(self, instances):
+        from health.models import MedicalDocument
+        counts = MedicalDocument.objects.filter(
+            test_request_id__in=[t.pk for t in instances]
+        ).values('test_request_id').annotate(total=Count('id')).values_list('test_request_id', 'total')
+        return dict(counts)
+
     def get_has_test_results(self, obj):
         """Check if test results have been uploaded"""
-        return obj.test_results.exists() if hasattr(obj, 'test_results') else False
+        return self.get_batched('test_results_count', obj, default=0) > 0
     
     def get_test_results_count(self, obj):
         """Get count of uploaded test results"""
-        return obj.test_results.count() if hasattr(obj, 'test_results') else 0
+        return self.get_batched('test_results_count', obj, default=0)
 
 
 class TestRequestCreateSerializer(serializers.ModelSerializer):
@@ -0,0 +1,72 @@
+# doctors/signals.py
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Doctor, Specialty, DoctorReview, DoctorRatingAggregate
+from .search import INDEXED_DOCTOR_FIELDS, refresh_doctor_search_index
+
+
+@receiver(pre_save, sender=DoctorReview)
+def remember_previous_review_rating(sender, instance, **kwargs):
+    """Stash the stored rating/doctor so post_save can apply an exact delta on edits."""
+    instance._previous_rating = None
+    if instance.pk:
+        previous = DoctorReview.objects.filter(pk=instance.pk).values('doctor_id', 'rating').first()
+        if previous:
+            instance._previous_rating = (previous['doctor_id'], previous['rating'])
+
+
+@receiver(post_save, sender=DoctorReview)
+def update_rating_aggregate_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    if created or previous is None:
+        DoctorRatingAggregate.record_change(instance.doctor_id, added=instance.rating)
+        return
+
+    previous_doctor_id, previous_rating = previous
+    if previous_doctor_id != instance.doctor_id:
+        DoctorRatingAggregate.record_change(previous_doctor_id, removed=previous_rating)
+        DoctorRatingAggregate.record_change(instance.doctor_id, added=instance.rating)
+    elif previous_rating != instance.rating:
+        DoctorRatingAggregate.record_change(instance.doctor_id, added=instance.rating, removed=previous_rating)
+
+
+@receiver(post_delete, sender=DoctorReview)
+def update_rating_aggregate_on_delete(sender, instance, **kwargs):
+    # The doctor itself may be going away in the same cascade
+    if not DoctorRatingAggregate.objects.filter(doctor_id=instance.doctor_id).exists():
+        return
+    DoctorRatingAggregate.record_change(instance.doctor_id, removed=instance.rating)
+
+
+@receiver(post_save, sender=Doctor)
+def refresh_search_on_doctor_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not INDEXED_DOCTOR_FIELDS.intersection(update_fields):
+        return
+    refresh_doctor_search_index([instance.pk])
+
+
+@receiver(m2m_changed, sender=Doctor.specialties.through)
+def refresh_search_on_specialties_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # After a clear the specialty no longer knows its doctors, so capture them now
+        instance._search_doctor_ids = list(instance.doctors.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # instance is a Specialty; pk_set holds doctor ids (None on clear)
+        doctor_ids = pk_set if pk_set is not None else getattr(instance, '_search_doctor_ids', [])
+    else:
+        doctor_ids = [instance.pk]
+    refresh_doctor_search_index(doctor_ids)
+
+
+@receiver(post_save, sender=Specialty)
+def refresh_search_on_specialty_rename(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    refresh_doctor_search_index(instance.doctors.values_list('pk', flat=True))
@@ -2,7 +2,7 @@
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from decimal import Decimal
-from .models import Specialty, Doctor, DoctorReview, DoctorAvailability, Appointment, Prescription, PrescriptionItem, VirtualSession
+from .models import Specialty, Doctor, DoctorReview, DoctorRatingAggregate, DoctorAvailability, Appointment, Prescription, PrescriptionItem, VirtualSession
 from pharmacy.models import Medication
 
 User = get_user_model()
@@ -44,6 +44,39 @@ class DoctorModelsTest(TestCase):
         DoctorReview.objects.create(doctor=self.doctor, user=another_user, rating=3)
         self.assertEqual(self.doctor.average_rating, 4)
 
+    def test_rating_aggregate_tracks_review_changes(self):
+        another_user = User.objects.create_user(username='rater', email='rater@example.com', password='password')
+        first = DoctorReview.objects.create(doctor=self.doctor, user=self.user, rating=5)
+        DoctorReview.objects.create(doctor=self.doctor, user=another_user, rating=2)
+
+        aggregate = DoctorRatingAggregate.objects.get(doctor=self.doctor)
+        self.assertEqual(aggregate.review_count, 2)
+        self.assertEqual(aggregate.rating_sum, 7)
+        self.assertEqual(aggregate.histogram, {1: 0, 2: 1, 3: 0, 4: 0, 5: 1})
+        self.assertEqual(aggregate.average_rating, 3.5)
+
+        first.rating = 3
+        first.save()
+        aggregate.refresh_from_db()
+        self.assertEqual(aggregate.rating_sum, 5)
+        self.assertEqual(aggregate.histogram[5], 0)
+        self.assertEqual(aggregate.histogram[3], 1)
+
+        first.delete()
+        aggregate.refresh_from_db()
+        self.assertEqual(aggregate.review_count, 1)
+        self.assertEqual(aggregate.average_rating, 2)
+
+    def test_rating_aggregate_rebuild(self):
+        DoctorReview.objects.create(doctor=self.doctor, user=self.user, rating=4)
+        DoctorRatingAggregate.objects.filter(doctor=self.doctor).update(review_count=0, rating_sum=0, average_rating=0)
+
+        self.assertEqual(DoctorRatingAggregate.rebuild(), 1)
+        aggregate = DoctorRatingAggregate.objects.get(doctor=self.doctor)
+        self.assertEqual(aggregate.review_count, 1)
+        self.assertEqual(aggregate.rating_4_count, 1)
+        self.assertEqual(aggregate.average_rating, 4)
+
     def test_doctor_review_creation(self):
         review = DoctorReview.objects.create(doctor=self.doctor, user=self.user, rating=4, comment='Good doctor.')
         self.assertEqual(str(review), f"{self.user.email} - {self.doctor.full_name} - 4")
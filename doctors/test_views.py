@@ -1,9 +1,13 @@
 
 from django.urls import reverse
+from django.test import override_settings
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 from django.contrib.auth import get_user_model
-from .models import Doctor, Specialty, Appointment, DoctorReview
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from .models import Doctor, Specialty, Appointment, DoctorReview, TestRequest
 from decimal import Decimal
 
 User = get_user_model()
@@ -11,6 +15,8 @@ User = get_user_model()
 class DoctorAPITests(APITestCase):
 
     def setUp(self):
+        # Booking counters are cached per user id, and ids repeat across tests
+        cache.clear()
         self.client = APIClient()
         self.user = User.objects.create_user(username='testuser', email='testuser@example.com', password='password123')
         self.doctor_user = User.objects.create_user(username='testdoctor', email='testdoctor@example.com', password='password123', first_name="Doc", last_name="Test")
@@ -46,6 +52,53 @@ class DoctorAPITests(APITestCase):
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['full_name'], 'Dr. Doc Test')
 
+    def test_list_doctors_filtered_and_ordered_by_rating(self):
+        other_doctor = Doctor.objects.create(
+            first_name='Low', last_name='Rated', gender='F', education='MD',
+            bio='Another doctor.', languages_spoken='English', is_verified=True
+        )
+        DoctorReview.objects.create(doctor=self.doctor, user=self.user, rating=5)
+        DoctorReview.objects.create(doctor=other_doctor, user=self.user, rating=2)
+
+        url = reverse('doctor-list')
+        response = self.client.get(url, {'min_rating': 4})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([d['id'] for d in response.data['results']], [self.doctor.id])
+        self.assertEqual(response.data['results'][0]['average_rating'], 5)
+        self.assertEqual(response.data['results'][0]['review_count'], 1)
+
+        response = self.client.get(url, {'ordering': 'rating_average'})
+        self.assertEqual([d['id'] for d in response.data['results']], [other_doctor.id, self.doctor.id])
+
+        for bad in ('nan', 'inf', '-1', '5.5', 'four'):
+            response = self.client.get(url, {'min_rating': bad})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, bad)
+
+    def test_search_doctors_ranked_and_typo_tolerant(self):
+        other_doctor = Doctor.objects.create(
+            first_name='Ada', last_name='Okafor', gender='F', education='MD',
+            bio='Paediatric care.', languages_spoken='Igbo, English', is_verified=True
+        )
+        url = reverse('doctor-list')
+
+        response = self.client.get(url, {'search': 'Testing'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([d['id'] for d in response.data['results']], [self.doctor.id])
+
+        # Typo in the surname still matches through trigram similarity
+        response = self.client.get(url, {'search': 'Okafr'})
+        self.assertEqual([d['id'] for d in response.data['results']], [other_doctor.id])
+
+        # Specialty renames flow into the index, in one UPDATE however many doctors share it
+        other_doctor.specialties.add(self.specialty)
+        self.specialty.name = 'Cardiology'
+        with CaptureQueriesContext(connection) as queries:
+            self.specialty.save()
+        doctor_updates = [q for q in queries if q['sql'].startswith(f'UPDATE "{Doctor._meta.db_table}"')]
+        self.assertEqual(len(doctor_updates), 1)
+        response = self.client.get(url, {'search': 'cardiology'})
+        self.assertEqual({d['id'] for d in response.data['results']}, {self.doctor.id, other_doctor.id})
+
     def test_retrieve_doctor(self):
         url = reverse('doctor-detail', kwargs={'pk': self.doctor.pk})
         response = self.client.get(url)
@@ -74,6 +127,24 @@ class DoctorAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Appointment.objects.count(), 2)
 
+    @override_settings(FREEMIUM_APPOINTMENT_LIMIT=2)
+    def test_free_tier_booking_limit_uses_cached_counters(self):
+        self.client.force_authenticate(user=self.user)
+        url = reverse('appointment-list-create')
+        data = {'doctor': self.doctor.pk, 'date': '2025-11-12', 'start_time': '15:00:00',
+                'end_time': '15:30:00', 'reason': 'Second visit'}
+
+        # setUp booked one appointment; the second fits the free allowance
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        data['start_time'], data['end_time'] = '16:00:00', '16:30:00'
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['current_count'], 2)
+        self.assertEqual(response.data['limit'], 2)
+
     def test_doctor_cannot_book_for_self(self):
         self.client.force_authenticate(user=self.doctor_user)
         url = reverse('appointment-list-create')
@@ -108,6 +179,100 @@ class DoctorAPITests(APITestCase):
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['id'], self.appointment.id)
 
+    def test_list_appointments_query_count_independent_of_followups(self):
+        self.client.force_authenticate(user=self.user)
+        url = reverse('appointment-list-create')
+
+        def add_followup(day):
+            followup = Appointment.objects.create(
+                user=self.user, doctor=self.doctor, date=f'2025-12-{day:02d}',
+                start_time='10:00:00', end_time='10:30:00', reason='Follow-up',
+                is_followup=True, original_appointment=self.appointment
+            )
+            TestRequest.objects.create(
+                appointment=self.appointment, doctor=self.doctor, patient=self.user,
+                test_name=f'Panel {day}', followup_appointment=followup
+            )
+
+        add_followup(1)
+        with CaptureQueriesContext(connection) as baseline:
+            self.client.get(url)
+        for day in range(2, 8):
+            add_followup(day)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(many), len(baseline))
+        followups = [a for a in response.data['results'] if a['is_followup']]
+        self.assertEqual(len(followups), 7)
+        self.assertTrue(all(a['linked_test_request'] for a in followups))
+
+    def test_eligible_appointments_vitals_summary_query_count_independent_of_patients(self):
+        from django.utils import timezone
+        from health.models import VitalSign
+        self.client.force_authenticate(user=self.doctor_user)
+        url = reverse('doctor-eligible-appointments')
+
+        def add_patient(n):
+            patient = User.objects.create_user(username=f'patient{n}', email=f'patient{n}@example.com', password='password123')
+            Appointment.objects.create(
+                user=patient, doctor=self.doctor, date='2025-11-12', start_time='09:00:00', end_time='09:30:00',
+                reason='Checkup', status=Appointment.StatusChoices.COMPLETED
+            )
+            VitalSign.objects.create(user=patient, date_recorded=timezone.now(), heart_rate=130, systolic_pressure=120)
+            return patient
+
+        first = add_patient(1)
+        with CaptureQueriesContext(connection) as baseline:
+            self.client.get(url)
+        for n in range(2, 6):
+            add_patient(n)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(many), len(baseline))
+        rows = response.data['results'] if isinstance(response.data, dict) else response.data
+        self.assertEqual(len(rows), 5)
+        summary = next(row['patient_vitals_summary'] for row in rows if row['user'] == first.id)
+        self.assertEqual(summary['vitals_count'], 1)
+        self.assertEqual(summary['average_values'], {'heart_rate': 130.0, 'systolic_pressure': 120.0})
+        self.assertEqual([alert['type'] for alert in summary['alerts']], ['high_hr'])
+
+    def test_create_prescription_query_count_independent_of_items(self):
+        from pharmacy.models import Medication
+        Medication.objects.create(name='Amoxicillin', description='Antibiotic', dosage_form='Capsule', strength='500mg')
+        self.client.force_authenticate(user=self.doctor_user)
+        url = reverse('doctor-portal-prescriptions-list')
+
+        def prescribe(day, names):
+            appointment = Appointment.objects.create(
+                user=self.user, doctor=self.doctor, date=f'2025-10-{day:02d}',
+                start_time='09:00:00', end_time='09:30:00', reason='Consultation',
+                status=Appointment.StatusChoices.COMPLETED,
+            )
+            data = {
+                'appointment_id': appointment.pk,
+                'diagnosis': 'Infection',
+                'items': [
+                    {'medication_name_input': name, 'dosage': '1 tab', 'frequency': 'Daily', 'duration': '5 days'}
+                    for name in names
+                ],
+            }
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        baseline = prescribe(1, ['amoxicillin', 'Paracetamol'])
+        many = prescribe(2, ['AMOXICILLIN', 'Paracetamol', 'Ibuprofen', 'Cetirizine', 'Omeprazole', 'ibuprofen'])
+
+        self.assertEqual(many, baseline)
+        self.assertEqual(Medication.objects.filter(name__iexact='amoxicillin').count(), 1)
+        self.assertEqual(Medication.objects.filter(name__iexact='ibuprofen').count(), 1)
+        self.assertEqual(Medication.objects.count(), 5)
+
     def test_create_review(self):
         self.client.force_authenticate(user=self.user)
         url = reverse('doctor-review-list-create', kwargs={'doctor_id': self.doctor.pk})
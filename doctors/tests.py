@@ -1,14 +1,18 @@
 # doctors/tests.py
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth import get_user_model
+from django.core import mail
 from django.utils import timezone
 from datetime import datetime, timedelta, time
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
-from unittest.mock import patch, MagicMock
 
 from .models import Doctor, Specialty, DoctorAvailability, Appointment, DoctorReview
 from .tasks import send_appointment_reminders_task
+from notifications.models import Notification, AppointmentReminderJob
 
 User = get_user_model()
 
@@ -134,6 +138,8 @@ class AppointmentAPITest(APITestCase):
     """Test Appointment API endpoints"""
     
     def setUp(self):
+        # Booking counters are cached per user id, and ids repeat across tests
+        cache.clear()
         self.client = APIClient()
         self.user = User.objects.create_user(
             username='patient',
@@ -229,6 +235,25 @@ class AppointmentAPITest(APITestCase):
         appointment.refresh_from_db()
         self.assertEqual(appointment.status, Appointment.StatusChoices.CANCELLED)
     
+    def test_reactivating_cancelled_appointment_checks_for_overlap(self):
+        """A cancelled appointment cannot be set back to scheduled over a slot booked meanwhile"""
+        tomorrow = (timezone.now() + timedelta(days=1)).date()
+        slot = dict(doctor=self.doctor, date=tomorrow, start_time=time(10, 0), end_time=time(11, 0),
+                    appointment_type=Appointment.TypeChoices.IN_PERSON, reason="Test appointment")
+        cancelled = Appointment.objects.create(user=self.user, status=Appointment.StatusChoices.CANCELLED, **slot)
+        other = User.objects.create_user(username='other', email='other@test.com', password='testpass123')
+        Appointment.objects.create(user=other, status=Appointment.StatusChoices.SCHEDULED, **slot)
+
+        url = f'/api/doctors/appointments/{cancelled.id}/'
+        response = self.client.patch(url, {'status': 'scheduled'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        cancelled.refresh_from_db()
+        self.assertEqual(cancelled.status, Appointment.StatusChoices.CANCELLED)
+
+        # Moved to a free slot at the same time it is fine
+        response = self.client.patch(url, {'status': 'scheduled', 'start_time': '11:00', 'end_time': '12:00'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
     def test_cannot_create_past_appointment(self):
         """Test that appointments cannot be created in the past"""
         yesterday = timezone.now() - timedelta(days=1)
@@ -342,13 +367,11 @@ class AppointmentReminderTaskTest(TestCase):
             languages_spoken="English"
         )
     
-    @patch('doctors.tasks.create_notification')
-    @patch('doctors.tasks.send_app_email')
-    def test_send_reminders_for_upcoming_appointments(self, mock_send_app_email, mock_create_notification):
+    def test_send_reminders_for_upcoming_appointments(self):
         """Test that reminders are sent for appointments in the next 24 hours"""
         # Create appointment ~58 minutes from now (within 1-hour reminder window)
         future_time = timezone.now() + timedelta(minutes=58)
-        Appointment.objects.create(
+        appointment = Appointment.objects.create(
             user=self.user,
             doctor=self.doctor,
             date=future_time.date(),
@@ -359,19 +382,19 @@ class AppointmentReminderTaskTest(TestCase):
             reason="Test appointment"
         )
         
-        # Mock successful sends
-        mock_send_app_email.return_value = True
-        mock_create_notification.return_value = MagicMock()
-        
         # Run the task
         send_appointment_reminders_task()
         
-        # Verify email and in-app notification were called
-        self.assertTrue(mock_send_app_email.called)
-        self.assertTrue(mock_create_notification.called)
+        # Verify email and in-app notification were sent, and the job marked done
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertTrue(Notification.objects.filter(recipient=self.user, category='appointment').exists())
+        self.assertEqual(AppointmentReminderJob.objects.get(appointment=appointment, reminder_type='1h').status, 'sent')
+
+        # A second run must not send the same reminder again
+        send_appointment_reminders_task()
+        self.assertEqual(len(mail.outbox), 1)
     
-    @patch('doctors.tasks.send_app_email')
-    def test_no_reminders_for_distant_appointments(self, mock_send_email):
+    def test_no_reminders_for_distant_appointments(self):
         """Test that reminders are not sent for appointments more than 24 hours away"""
         # Create appointment 3 days from now
         future_time = timezone.now() + timedelta(days=3)
@@ -390,7 +413,7 @@ class AppointmentReminderTaskTest(TestCase):
         send_appointment_reminders_task()
         
         # Email should not be sent (no appointment falls in 24h/1h window)
-        self.assertFalse(mock_send_email.called)
+        self.assertEqual(len(mail.outbox), 0)
 
 
 class DoctorAvailabilityTest(TestCase):
@@ -432,3 +455,153 @@ class DoctorAvailabilityTest(TestCase):
         expected = f"{self.doctor.full_name} - Monday (09:00:00 - 17:00:00)"
         self.assertEqual(str(availability), expected)
 
+
+
+class BookableSlotEngineTest(TestCase):
+    """Test the interval-based slot engine in doctors/scheduling.py"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='slot_patient',
+            email='slot.patient@test.com',
+            password='testpass123'
+        )
+        self.doctor = Doctor.objects.create(
+            first_name="Sam",
+            last_name="Slots",
+            gender="M",
+            education="MD",
+            bio="Always booked",
+            languages_spoken="English",
+            is_verified=True
+        )
+        self.day = (timezone.now() + timedelta(days=2)).date()
+        DoctorAvailability.objects.create(
+            doctor=self.doctor,
+            day_of_week=self.day.weekday(),
+            start_time=time(9, 0),
+            end_time=time(11, 0)
+        )
+
+    def test_subtract_intervals(self):
+        from .scheduling import subtract_intervals, merge_intervals
+        windows = merge_intervals([(540, 600), (590, 720)])
+        self.assertEqual(windows, [(540, 720)])
+        self.assertEqual(subtract_intervals(windows, [(560, 580), (700, 800)]), [(540, 560), (580, 700)])
+
+    def test_booked_appointments_are_removed_from_slots(self):
+        from .scheduling import get_bookable_slots
+        Appointment.objects.create(
+            user=self.user, doctor=self.doctor, date=self.day,
+            start_time=time(9, 30), end_time=time(10, 0), reason="Booked"
+        )
+        Appointment.objects.create(
+            user=self.user, doctor=self.doctor, date=self.day,
+            start_time=time(10, 0), end_time=time(10, 30), reason="Cancelled",
+            status=Appointment.StatusChoices.CANCELLED
+        )
+
+        slots = get_bookable_slots([self.doctor.id], self.day, self.day)[self.doctor.id][self.day]
+        self.assertEqual(slots, [
+            (time(9, 0), time(9, 30)),
+            (time(10, 0), time(10, 30)),
+            (time(10, 30), time(11, 0)),
+        ])
+
+    def test_slots_endpoint_batches_doctors(self):
+        url = '/api/doctors/slots/'
+        response = self.client.get(url, {
+            'doctor_ids': str(self.doctor.id),
+            'start_date': self.day.isoformat(),
+            'end_date': (self.day + timedelta(days=6)).isoformat(),
+            'slot_minutes': 60,
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        doctor_slots = response.data['doctors'][0]
+        self.assertEqual(doctor_slots['doctor_id'], self.doctor.id)
+        self.assertEqual(
+            doctor_slots['slots'][self.day.isoformat()],
+            [{'start_time': '09:00', 'end_time': '10:00'}, {'start_time': '10:00', 'end_time': '11:00'}]
+        )
+
+    def test_slots_endpoint_rejects_long_ranges(self):
+        response = self.client.get('/api/doctors/slots/', {
+            'doctor_ids': str(self.doctor.id),
+            'start_date': self.day.isoformat(),
+            'end_date': (self.day + timedelta(days=60)).isoformat(),
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_slots_endpoint_rejects_bad_specialty_and_too_many_doctors(self):
+        from .scheduling import MAX_DOCTORS_PER_REQUEST
+        base = {'start_date': self.day.isoformat()}
+        response = self.client.get('/api/doctors/slots/', {**base, 'specialty': 'cardiology'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        too_many = ','.join(str(i) for i in range(1, MAX_DOCTORS_PER_REQUEST + 2))
+        response = self.client.get('/api/doctors/slots/', {**base, 'doctor_ids': too_many})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get('/api/doctors/slots/', {**base, 'doctor_ids': str(self.doctor.id)})
+        self.assertFalse(response.data['has_more'])
+
+
+class ConcurrentBookingTest(TransactionTestCase):
+    """Hammer one slot with concurrent bookings; exactly one may win."""
+
+    ATTEMPTS = 200
+    WORKERS = 20
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = Doctor.objects.create(
+            first_name="Rush",
+            last_name="Hour",
+            gender="F",
+            education="MD",
+            bio="Popular",
+            languages_spoken="English",
+            is_verified=True
+        )
+        User.objects.bulk_create([
+            User(username=f'racer{i}', email=f'racer{i}@test.com')
+            for i in range(self.ATTEMPTS)
+        ])
+        self.patients = list(User.objects.filter(username__startswith='racer'))
+        self.day = (timezone.now() + timedelta(days=3)).date()
+
+    def _book(self, patient):
+        client = APIClient()
+        client.force_authenticate(user=patient)
+        try:
+            response = client.post('/api/doctors/appointments/', {
+                'doctor': self.doctor.id,
+                'date': self.day.isoformat(),
+                'start_time': '10:00',
+                'end_time': '10:30',
+                'reason': 'Race',
+            }, format='json')
+            return response.status_code
+        finally:
+            connection.close()
+
+    def test_exactly_one_concurrent_booking_succeeds(self):
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+            results = list(pool.map(self._book, self.patients))
+
+        self.assertEqual(results.count(status.HTTP_201_CREATED), 1)
+        self.assertEqual(results.count(status.HTTP_409_CONFLICT), self.ATTEMPTS - 1)
+        self.assertEqual(Appointment.objects.filter(doctor=self.doctor, date=self.day).count(), 1)
+
+    def test_overlapping_booking_rejected(self):
+        self.assertEqual(self._book(self.patients[0]), status.HTTP_201_CREATED)
+        client = APIClient()
+        client.force_authenticate(user=self.patients[1])
+        response = client.post('/api/doctors/appointments/', {
+            'doctor': self.doctor.id,
+            'date': self.day.isoformat(),
+            'start_time': '10:15',
+            'end_time': '10:45',
+            'reason': 'Overlap',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
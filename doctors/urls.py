@@ -4,7 +4,7 @@ from rest_framework.routers import DefaultRouter
 from django.conf.urls import include
 from .views import (
     SpecialtyListView, DoctorListView, DoctorDetailView,
-    DoctorReviewListCreateView, DoctorAvailabilityListView,
+    DoctorReviewListCreateView, DoctorAvailabilityListView, DoctorSlotsView,
     DoctorAvailabilityManageViewSet,
     AppointmentListCreateView, AppointmentDetailView,
     PrescriptionListView, PrescriptionDetailView, ForwardPrescriptionView,
@@ -28,6 +28,7 @@ urlpatterns = [
     path('<int:pk>/', DoctorDetailView.as_view(), name='doctor-detail'),
     path('<int:doctor_id>/reviews/', DoctorReviewListCreateView.as_view(), name='doctor-review-list-create'),
     path('<int:doctor_id>/availability/', DoctorAvailabilityListView.as_view(), name='doctor-availability'),
+    path('slots/', DoctorSlotsView.as_view(), name='doctor-slots'),
     path('appointments/', AppointmentListCreateView.as_view(), name='appointment-list-create'),
     path('appointments/<int:pk>/', AppointmentDetailView.as_view(), name='appointment-detail'),
     path('appointments/<int:appointment_id>/token/', GetTwilioTokenView.as_view(), name='get-twilio-token'),
@@ -4,6 +4,8 @@ import logging
 from django.conf import settings
 from rest_framework import viewsets, generics, permissions, filters, views, status
 from rest_framework import serializers
+from rest_framework.exceptions import APIException
+from django.db import transaction
 from django.urls import reverse
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
@@ -19,24 +21,52 @@ from .serializers import (
     DoctorEligibleAppointmentSerializer, DoctorApplicationSerializer,
     TestRequestSerializer, TestRequestCreateSerializer
 )
+from .scheduling import BLOCKING_STATUSES, lock_doctor_schedule, find_conflicting_appointment
 
 logger = logging.getLogger(__name__)
 
+class AppointmentSlotConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'This time slot is no longer available for the selected doctor.'
+    default_code = 'slot_conflict'
+
 class SpecialtyListView(generics.ListAPIView):
     queryset = Specialty.objects.all()
     serializer_class = SpecialtySerializer
     permission_classes = [permissions.AllowAny]
 
 class DoctorListView(generics.ListAPIView):
-    queryset = Doctor.objects.filter(is_verified=True)
     serializer_class = DoctorSerializer
     permission_classes = [permissions.AllowAny]
-    filter_backends = [filters.SearchFilter]
+    filter_backends = [filters.OrderingFilter]
     filterset_fields = ['specialties', 'is_available_for_virtual']
-    search_fields = ['first_name', 'last_name', 'bio']
+    ordering_fields = ['rating_average', 'rating_count', 'years_of_experience', 'consultation_fee']
+
+    def get_queryset(self):
+        queryset = Doctor.objects.filter(is_verified=True).with_rating_stats()
+
+        # Rating filter reads the denormalized aggregate, e.g. ?min_rating=4
+        min_rating = self.request.query_params.get('min_rating')
+        if min_rating is not None:
+            try:
+                min_rating = float(min_rating)
+                # NaN fails every comparison, so it is caught here along with inf
+                if not 0 <= min_rating <= 5:
+                    raise ValueError
+            except (TypeError, ValueError):
+                raise serializers.ValidationError({'min_rating': 'min_rating must be a number between 0 and 5.'})
+            queryset = queryset.filter(rating_average__gte=min_rating)
+
+        # Ranked full-text + trigram search over name, bio, languages, hospital and specialties
+        search = self.request.query_params.get('search')
+        if search:
+            from .search import search_doctors
+            return search_doctors(queryset, search)
+
+        return queryset.order_by('id')
 
 class DoctorDetailView(generics.RetrieveAPIView):
-    queryset = Doctor.objects.filter(is_verified=True)
+    queryset = Doctor.objects.filter(is_verified=True).with_rating_stats()
     serializer_class = DoctorSerializer
     permission_classes = [permissions.AllowAny]
 
@@ -174,6 +204,80 @@ class DoctorAvailabilityListView(generics.ListAPIView):
     def get_queryset(self):
         return DoctorAvailability.objects.filter(doctor_id=self.kwargs['doctor_id'], is_available=True)
 
+class DoctorSlotsView(views.APIView):
+    """
+    Bookable slots for one or many doctors over a date range.
+    GET /api/doctors/slots/?doctor_ids=1,2,3&start_date=2025-11-10&end_date=2025-11-16&slot_minutes=30
+    GET /api/doctors/slots/?specialty=4&start_date=...  (every verified doctor in the specialty)
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        from .scheduling import get_bookable_slots, DEFAULT_SLOT_MINUTES, MAX_RANGE_DAYS, MAX_DOCTORS_PER_REQUEST
+
+        params = request.query_params
+        try:
+            start_date = datetime.date.fromisoformat(params.get('start_date', ''))
+            end_date = datetime.date.fromisoformat(params.get('end_date') or params.get('start_date', ''))
+        except ValueError:
+            return Response({'error': 'start_date and end_date must be ISO dates (YYYY-MM-DD).'}, status=status.HTTP_400_BAD_REQUEST)
+        if end_date < start_date:
+            return Response({'error': 'end_date must not be before start_date.'}, status=status.HTTP_400_BAD_REQUEST)
+        if (end_date - start_date).days + 1 > MAX_RANGE_DAYS:
+            return Response({'error': f'Date range cannot exceed {MAX_RANGE_DAYS} days.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            slot_minutes = int(params.get('slot_minutes', DEFAULT_SLOT_MINUTES))
+        except ValueError:
+            slot_minutes = 0
+        if not 5 <= slot_minutes <= 240:
+            return Response({'error': 'slot_minutes must be between 5 and 240.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        doctors = Doctor.objects.filter(is_verified=True)
+        if params.get('doctor_ids'):
+            try:
+                doctor_ids = [int(value) for value in params['doctor_ids'].split(',') if value.strip()]
+            except ValueError:
+                return Response({'error': 'doctor_ids must be a comma-separated list of integers.'}, status=status.HTTP_400_BAD_REQUEST)
+            if len(set(doctor_ids)) > MAX_DOCTORS_PER_REQUEST:
+                return Response({'error': f'At most {MAX_DOCTORS_PER_REQUEST} doctor_ids per request.'}, status=status.HTTP_400_BAD_REQUEST)
+            doctors = doctors.filter(id__in=doctor_ids)
+        elif params.get('specialty'):
+            try:
+                specialty_id = int(params['specialty'])
+            except ValueError:
+                return Response({'error': 'specialty must be an integer id.'}, status=status.HTTP_400_BAD_REQUEST)
+            doctors = doctors.filter(specialties__id=specialty_id)
+        else:
+            return Response({'error': 'Provide doctor_ids or specialty.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # A specialty can list more doctors than one request serves; has_more tells the
+        # client to ask for the rest by doctor_ids (the ones returned have the lowest ids)
+        doctor_ids = list(doctors.order_by('id').values_list('id', flat=True).distinct()[:MAX_DOCTORS_PER_REQUEST + 1])
+        has_more = len(doctor_ids) > MAX_DOCTORS_PER_REQUEST
+        doctor_ids = doctor_ids[:MAX_DOCTORS_PER_REQUEST]
+        slots = get_bookable_slots(doctor_ids, start_date, end_date, slot_minutes=slot_minutes)
+
+        return Response({
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'slot_minutes': slot_minutes,
+            'has_more': has_more,
+            'doctors': [
+                {
+                    'doctor_id': doctor_id,
+                    'slots': {
+                        day.isoformat(): [
+                            {'start_time': start.strftime('%H:%M'), 'end_time': end.strftime('%H:%M')}
+                            for start, end in day_slots
+                        ]
+                        for day, day_slots in slots[doctor_id].items()
+                    },
+                }
+                for doctor_id in doctor_ids
+            ],
+        })
+
 class DoctorAvailabilityManageViewSet(viewsets.ModelViewSet):
     """
     ViewSet for doctors to manage their own availability.
@@ -219,52 +323,21 @@ class AppointmentListCreateView(generics.ListCreateAPIView):
 
     def perform_create(self, serializer):
         # Check subscription limits before creating appointment
-        from payments.utils import user_can_book_appointment
-        from payments.models import UserSubscription
+        from payments.entitlements import get_entitlements
         
         try:
-            can_book = user_can_book_appointment(self.request.user)
+            entitlements = get_entitlements(self.request.user)
         except Exception as e:
             logger.error(f"Error checking appointment booking permission: {e}", exc_info=True)
             # Allow booking if check fails (fail open)
-            can_book = True
+            entitlements = None
         
-        if not can_book:
-            subscription = UserSubscription.objects.filter(
-                user=self.request.user,
-                status='active'
-            ).first()
-            
-            if subscription and subscription.is_active:
-                max_appointments = subscription.plan.max_appointments_per_month
-                limit_text = f"{max_appointments} appointments/month" if max_appointments else "unlimited"
-                
-                # Check monthly limit for premium
-                from datetime import datetime
-                from django.utils import timezone
-                month_start = timezone.now().replace(day=1, hour=0, minute=0, second=0)
-                current_count = Appointment.objects.filter(
-                    user=self.request.user,
-                    created_at__gte=month_start,
-                    status__in=['scheduled', 'confirmed', 'completed']
-                ).count()
-                limit_val = max_appointments
-            else:
-                from django.conf import settings
-                free_limit = getattr(settings, 'FREEMIUM_APPOINTMENT_LIMIT', 3)
-                limit_text = f"{free_limit} free lifetime appointments"
-                # Check lifetime limit for free tier
-                current_count = Appointment.objects.filter(
-                    user=self.request.user,
-                    status__in=['scheduled', 'confirmed', 'completed']
-                ).count()
-                limit_val = free_limit
-            
+        if entitlements is not None and not entitlements.can_book_appointment:
             raise serializers.ValidationError({
                 'error': 'Appointment limit reached',
-                'message': f'You have reached your appointment limit ({limit_text}). Upgrade to Premium for unlimited appointments.',
-                'current_count': current_count,
-                'limit': limit_val,
+                'message': f'You have reached your appointment limit ({entitlements.appointment_limit_text}). Upgrade to Premium for unlimited appointments.',
+                'current_count': entitlements.appointment_usage,
+                'limit': entitlements.appointment_limit,
                 'upgrade_url': '/subscription'
             })
         
@@ -312,37 +385,50 @@ class AppointmentListCreateView(generics.ListCreateAPIView):
                 discount_amount = (consultation_fee * discount_percentage) / Decimal('100')
                 consultation_fee = consultation_fee - discount_amount
         
-        # If no insurance and consultation fee exists, payment is required
-        if not user_insurance and consultation_fee and consultation_fee > 0:
-            # Allow creating appointment with payment_status='pending' without payment_reference
-            # Payment reference will be added later via PATCH when payment is completed
-            payment_status = 'paid' if payment_reference else 'pending'
-            appointment = serializer.save(
-                user=self.request.user,
-                doctor=doctor,  # Explicitly set doctor to ensure it's saved
-                user_insurance=user_insurance,
-                payment_reference=payment_reference if payment_reference else None,
-                payment_status=payment_status,
-                consultation_fee=consultation_fee,
-                is_followup=is_followup,
-                original_appointment=original_appointment
-            )
-            logger.info(f"Appointment {appointment.id} created for patient {self.request.user.id} with doctor {doctor.id} ({doctor.full_name}). Status: {appointment.status}, Payment: {payment_status}")
-        else:
-            # With insurance or no fee - payment not required
-            # Set payment_status based on whether payment_reference exists
-            payment_status = 'paid' if payment_reference else 'pending'
-            appointment = serializer.save(
-                user=self.request.user,
-                doctor=doctor,  # Explicitly set doctor to ensure it's saved
-                user_insurance=user_insurance,
-                payment_reference=payment_reference if payment_reference else None,
-                payment_status=payment_status,
-                consultation_fee=consultation_fee if consultation_fee else None,
-                is_followup=is_followup,
-                original_appointment=original_appointment
+        # Lock the doctor's calendar so concurrent requests for the same slot
+        # are serialized; the loser gets a 409 instead of a double booking.
+        with transaction.atomic():
+            lock_doctor_schedule(doctor.id)
+            conflict = find_conflicting_appointment(
+                doctor.id,
+                serializer.validated_data.get('date'),
+                serializer.validated_data.get('start_time'),
+                serializer.validated_data.get('end_time'),
             )
-            logger.info(f"Appointment {appointment.id} created for patient {self.request.user.id} with doctor {doctor.id} ({doctor.full_name}). Status: {appointment.status}, Payment: {payment_status}")
+            if conflict:
+                raise AppointmentSlotConflict()
+
+            # If no insurance and consultation fee exists, payment is required
+            if not user_insurance and consultation_fee and consultation_fee > 0:
+                # Allow creating appointment with payment_status='pending' without payment_reference
+                # Payment reference will be added later via PATCH when payment is completed
+                payment_status = 'paid' if payment_reference else 'pending'
+                appointment = serializer.save(
+                    user=self.request.user,
+                    doctor=doctor,  # Explicitly set doctor to ensure it's saved
+                    user_insurance=user_insurance,
+                    payment_reference=payment_reference if payment_reference else None,
+                    payment_status=payment_status,
+                    consultation_fee=consultation_fee,
+                    is_followup=is_followup,
+                    original_appointment=original_appointment
+                )
+                logger.info(f"Appointment {appointment.id} created for patient {self.request.user.id} with doctor {doctor.id} ({doctor.full_name}). Status: {appointment.status}, Payment: {payment_status}")
+            else:
+                # With insurance or no fee - payment not required
+                # Set payment_status based on whether payment_reference exists
+                payment_status = 'paid' if payment_reference else 'pending'
+                appointment = serializer.save(
+                    user=self.request.user,
+                    doctor=doctor,  # Explicitly set doctor to ensure it's saved
+                    user_insurance=user_insurance,
+                    payment_reference=payment_reference if payment_reference else None,
+                    payment_status=payment_status,
+                    consultation_fee=consultation_fee if consultation_fee else None,
+                    is_followup=is_followup,
+                    original_appointment=original_appointment
+                )
+                logger.info(f"Appointment {appointment.id} created for patient {self.request.user.id} with doctor {doctor.id} ({doctor.full_name}). Status: {appointment.status}, Payment: {payment_status}")
         
         # Calculate insurance coverage if insurance is selected
         if user_insurance and appointment.consultation_fee:
@@ -551,9 +637,32 @@ class AppointmentDetailView(generics.RetrieveUpdateDestroyAPIView):
         
         old_payment_status = old_instance.payment_status
         
-        # Save the appointment first
+        # Save the appointment first; reschedules and reactivations (e.g. a
+        # cancelled appointment set back to scheduled) take the same calendar
+        # lock and overlap check as bookings
+        data = serializer.validated_data
+        rescheduled = any(
+            field in data and data[field] != getattr(old_instance, field)
+            for field in ('doctor', 'date', 'start_time', 'end_time')
+        )
+        new_status = data.get('status', old_instance.status)
+        reactivated = old_instance.status not in BLOCKING_STATUSES and new_status in BLOCKING_STATUSES
         try:
-            new_instance = serializer.save(user_insurance=user_insurance)
+            with transaction.atomic():
+                if new_status in BLOCKING_STATUSES and (rescheduled or reactivated):
+                    doctor_id = data['doctor'].id if data.get('doctor') else old_instance.doctor_id
+                    lock_doctor_schedule(doctor_id)
+                    if find_conflicting_appointment(
+                        doctor_id,
+                        data.get('date', old_instance.date),
+                        data.get('start_time', old_instance.start_time),
+                        data.get('end_time', old_instance.end_time),
+                        exclude_id=old_instance.id,
+                    ):
+                        raise AppointmentSlotConflict()
+                new_instance = serializer.save(user_insurance=user_insurance)
+        except AppointmentSlotConflict:
+            raise
         except Exception as e:
             logger.error(f"Error saving appointment update: {e}", exc_info=True)
             raise
@@ -802,14 +911,18 @@ class PrescriptionListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Prescription.objects.filter(user=self.request.user).order_by('-date_prescribed')
+        return Prescription.objects.filter(user=self.request.user).prefetch_related(
+            'items__medication'
+        ).order_by('-date_prescribed')
     
 class PrescriptionDetailView(generics.RetrieveAPIView):
     serializer_class = PrescriptionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Prescription.objects.filter(user=self.request.user).order_by('-date_prescribed')
+        return Prescription.objects.filter(user=self.request.user).prefetch_related(
+            'items__medication'
+        ).order_by('-date_prescribed')
 
 
 class ForwardPrescriptionView(views.APIView):
@@ -822,7 +935,9 @@ class ForwardPrescriptionView(views.APIView):
 
     def post(self, request, pk, *args, **kwargs):
         # Import here to avoid circular imports
-        from pharmacy.models import Pharmacy, MedicationOrder, MedicationOrderItem
+        from pharmacy.models import Pharmacy, MedicationOrder
+        from pharmacy.orders import create_medication_order
+        from pharmacy.reservations import InsufficientStockError
         from django.db import transaction
         
         # Get the prescription
@@ -875,8 +990,8 @@ class ForwardPrescriptionView(views.APIView):
             )
         
         # Check if prescription has items
-        prescription_items = PrescriptionItem.objects.filter(prescription=prescription)
-        if not prescription_items.exists():
+        prescription_items = list(PrescriptionItem.objects.filter(prescription=prescription))
+        if not prescription_items:
             return Response(
                 {"error": "Prescription has no items to order."},
                 status=status.HTTP_400_BAD_REQUEST
@@ -885,29 +1000,16 @@ class ForwardPrescriptionView(views.APIView):
         # Create the order
         try:
             with transaction.atomic():
-                # Create medication order
-                order = MedicationOrder.objects.create(
-                    user=request.user,
-                    pharmacy=pharmacy,
+                # Create the order, its items and the pharmacy staff notifications
+                order = create_medication_order(
+                    request.user,
+                    pharmacy,
                     prescription=prescription,
+                    prescription_items=prescription_items,
                     status='pending',
                     notes=f"Order created from prescription #{prescription.id}"
                 )
                 
-                # Create order items from prescription items
-                order_items = []
-                for p_item in prescription_items:
-                    order_item = MedicationOrderItem(
-                        order=order,
-                        prescription_item=p_item,
-                        medication_name_text=p_item.medication_name,
-                        dosage_text=p_item.dosage,
-                        quantity=1,  # Default quantity, pharmacy can adjust
-                    )
-                    order_items.append(order_item)
-                
-                MedicationOrderItem.objects.bulk_create(order_items)
-                
                 # Create notification for user
                 create_notification(
                     recipient=request.user,
@@ -936,6 +1038,14 @@ class ForwardPrescriptionView(views.APIView):
                     status=status.HTTP_201_CREATED
                 )
                 
+        except InsufficientStockError as e:
+            return Response(
+                {
+                    "error": f"{pharmacy.name} does not have enough stock for some of the prescribed medications.",
+                    "unavailable_medication_ids": sorted(e.shortages),
+                },
+                status=status.HTTP_409_CONFLICT
+            )
         except Exception as e:
             logger.error(f"Error forwarding prescription {pk}: {str(e)}")
             return Response(
@@ -953,7 +1063,7 @@ class DoctorEligibleAppointmentListView(generics.ListAPIView):
         return Appointment.objects.filter(
             doctor=doctor_profile,
             status=Appointment.StatusChoices.COMPLETED
-        ).order_by('-date', '-start_time')
+        ).select_related('user').order_by('-date', '-start_time')
 
 
 class DoctorPrescriptionViewSet(viewsets.ModelViewSet):
@@ -966,7 +1076,9 @@ class DoctorPrescriptionViewSet(viewsets.ModelViewSet):
         return DoctorPrescriptionListDetailSerializer
 
     def get_queryset(self):
-        return Prescription.objects.filter(doctor=self.request.user.doctor_profile).order_by('-date_prescribed')
+        return Prescription.objects.filter(doctor=self.request.user.doctor_profile).select_related(
+            'user', 'doctor', 'appointment'
+        ).prefetch_related('items__medication').order_by('-date_prescribed')
 
     def get_permissions(self):
         if self.action in ['update', 'partial_update', 'destroy', 'retrieve']:
@@ -1011,7 +1123,7 @@ class TestRequestListCreateView(generics.ListCreateAPIView):
     def get_queryset(self):
         """Return test requests for the authenticated doctor"""
         doctor_profile = self.request.user.doctor_profile
-        return TestRequest.objects.filter(doctor=doctor_profile).order_by('-requested_at')
+        return TestRequest.objects.filter(doctor=doctor_profile).select_related('doctor', 'patient', 'appointment').order_by('-requested_at')
     
     def perform_create(self, serializer):
         """Create test request and notify patient"""
@@ -1050,10 +1162,10 @@ class TestRequestDetailView(generics.RetrieveUpdateDestroyAPIView):
         
         # If user is a doctor, return their test requests
         if hasattr(user, 'doctor_profile'):
-            return TestRequest.objects.filter(doctor=user.doctor_profile)
+            return TestRequest.objects.filter(doctor=user.doctor_profile).select_related('doctor', 'patient', 'appointment')
         
         # If user is a patient, return their test requests
-        return TestRequest.objects.filter(patient=user)
+        return TestRequest.objects.filter(patient=user).select_related('doctor', 'patient', 'appointment')
     
     def perform_update(self, serializer):
         """Update test request and handle status changes"""
@@ -1092,7 +1204,7 @@ class PatientTestRequestListView(generics.ListAPIView):
     
     def get_queryset(self):
         """Return test requests for the authenticated patient"""
-        return TestRequest.objects.filter(patient=self.request.user).order_by('-requested_at')
+        return TestRequest.objects.filter(patient=self.request.user).select_related('doctor', 'patient', 'appointment').order_by('-requested_at')
 
 
 class TestRequestResultsView(generics.ListAPIView):
@@ -2,6 +2,7 @@
 from django.db import models
 from django.conf import settings
 from django.contrib.gis.db import models as gis_models
+from vitanips.core.operating_hours import OpeningIntervalBase
 
 class EmergencyService(models.Model):
     TYPE_CHOICES = (
@@ -35,6 +36,15 @@ class EmergencyService(models.Model):
     class Meta:
         verbose_name_plural = "Emergency Services"
 
+class EmergencyServiceOpeningInterval(OpeningIntervalBase):
+    """Weekly opening interval parsed from EmergencyService.operating_hours (see vitanips/core/operating_hours.py)"""
+    service = models.ForeignKey(EmergencyService, on_delete=models.CASCADE, related_name='opening_intervals')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_minute', 'end_minute'], name='emergency_hours_range_idx'),
+        ]
+
 class EmergencyContact(models.Model):
     RELATIONSHIP_CHOICES = (
         ('spouse', 'Spouse'),
@@ -0,0 +1,19 @@
+# emergency/signals.py
+from django.db.models.signals import pre_save, post_save
+from django.dispatch import receiver
+from vitanips.core.operating_hours import sync_opening_intervals
+from .models import EmergencyService, EmergencyServiceOpeningInterval
+
+
+@receiver(pre_save, sender=EmergencyService)
+def stash_previous_operating_hours(sender, instance, **kwargs):
+    instance._previous_operating_hours = (
+        EmergencyService.objects.filter(pk=instance.pk).values_list('operating_hours', flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=EmergencyService)
+def sync_service_opening_intervals(sender, instance, created, **kwargs):
+    if created or instance.operating_hours != getattr(instance, '_previous_operating_hours', None):
+        sync_opening_intervals([instance], EmergencyServiceOpeningInterval, 'service')
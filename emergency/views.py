@@ -2,7 +2,9 @@
 from rest_framework import generics, views, permissions, status
 from rest_framework.response import Response
 from .tasks import send_sos_alerts_task
-from .models import EmergencyService, EmergencyContact, EmergencyAlert
+from rest_framework.exceptions import ValidationError
+from vitanips.core.operating_hours import open_at_filter, requested_open_time
+from .models import EmergencyService, EmergencyServiceOpeningInterval, EmergencyContact, EmergencyAlert
 from .serializers import (
     EmergencyServiceSerializer, EmergencyContactSerializer, EmergencyAlertSerializer
 )
@@ -121,6 +123,14 @@ class EmergencyServiceListView(generics.ListAPIView):
         if service_type:
             queryset = queryset.filter(service_type=service_type)
 
+        # ?open_now=true or ?open_at=<ISO datetime>: only services open at that time
+        try:
+            open_time = requested_open_time(self.request.query_params)
+        except ValueError:
+            raise ValidationError({'open_at': 'Must be an ISO 8601 datetime.'})
+        if open_time is not None:
+            queryset = queryset.filter(open_at_filter(EmergencyServiceOpeningInterval, 'service', open_time))
+
         return queryset.order_by('name')
 
 class EmergencyContactListCreateView(generics.ListCreateAPIView):
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import VitalSign, FoodLog, ExerciseLog, SleepLog, HealthGoal, WaterIntakeLog, HealthInsight, MedicalDocument
+from .models import VitalSign, VitalSignThreshold, FoodLog, ExerciseLog, SleepLog, HealthGoal, WaterIntakeLog, HealthInsight, MedicalDocument
 
 @admin.register(VitalSign)
 class VitalSignAdmin(admin.ModelAdmin):
@@ -26,6 +26,13 @@ class VitalSignAdmin(admin.ModelAdmin):
         }),
     )
 
+@admin.register(VitalSignThreshold)
+class VitalSignThresholdAdmin(admin.ModelAdmin):
+    list_display = ('user', 'metric', 'critical_low', 'low', 'high', 'critical_high', 'set_by', 'updated_at')
+    search_fields = ('user__email',)
+    list_filter = ('metric',)
+    raw_id_fields = ('user', 'set_by')
+
 @admin.register(FoodLog)
 class FoodLogAdmin(admin.ModelAdmin):
     list_display = ('user', 'food_item', 'meal_type', 'datetime', 'calories', 'carbohydrates', 'proteins', 'fats', 'created_at')
@@ -0,0 +1,92 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from health.vitals_alerts import ALERT_METRICS, NUMPY_AVAILABLE, evaluate_columns, score_columns
+
+# metric: (mean, standard deviation, whole numbers), loosely around normal adult values
+DISTRIBUTIONS = {
+    'systolic_pressure': (120, 12, True),
+    'diastolic_pressure': (76, 8, True),
+    'heart_rate': (75, 10, True),
+    'temperature': (36.8, 0.5, False),
+    'oxygen_saturation': (97.5, 1.5, True),
+    'blood_glucose': (100, 20, False),
+    'respiratory_rate': (15, 2.5, True),
+}
+# Share of readings without a given metric (wearables mostly report heart rate and SpO2 alone)
+MISSING_RATE = 0.3
+
+
+class Command(BaseCommand):
+    help = ('Measure vital sign alert throughput over synthetic columnar readings: vectorized scoring, '
+            'full alert building and the row-by-row evaluation of the same rule table. Touches no data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readings', type=int, default=1000000, help='Synthetic readings to score')
+        parser.add_argument('--patients', type=int, default=10000, help='Distinct patients the readings belong to')
+        parser.add_argument('--overrides', type=int, default=500, help='Patients with their own thresholds')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per variant (best is reported)')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if options['readings'] < 1:
+            raise CommandError('--readings must be at least 1.')
+        rng = random.Random(options['seed'])
+        columns = self._columns(rng, options['readings'], options['patients'])
+        overrides = self._overrides(rng, options['patients'], options['overrides'])
+        self.stdout.write(
+            f"Generated {options['readings']} readings for {options['patients']} patients "
+            f"({len(overrides)} with overrides)"
+        )
+
+        count = options['readings']
+        repeat = options['repeat']
+        if NUMPY_AVAILABLE:
+            import numpy as np
+            arrays = {name: np.asarray(values, dtype=None if name == 'user_id' else float) for name, values in columns.items()}
+            self._report('score (vectorized, list columns)', count, self._time(repeat, lambda: score_columns(columns, overrides, vectorized=True)))
+            self._report('score (vectorized, array columns)', count, self._time(repeat, lambda: score_columns(arrays, overrides, vectorized=True)))
+            alerts = evaluate_columns(columns, overrides, vectorized=True)
+            self._report('alerts (vectorized)', count, self._time(repeat, lambda: evaluate_columns(columns, overrides, vectorized=True)))
+        else:
+            self.stdout.write(self.style.WARNING('numpy is not installed; only the row-by-row evaluator is timed'))
+            alerts = evaluate_columns(columns, overrides, vectorized=False)
+        self._report('score (row by row)', count, self._time(repeat, lambda: score_columns(columns, overrides, vectorized=False)))
+        flagged = sum(1 for row in alerts if row)
+        self.stdout.write(f'{flagged} readings ({flagged / count:.1%}) raised {sum(map(len, alerts))} alerts')
+
+    def _columns(self, rng, count, patients):
+        columns = {'user_id': [rng.randint(1, patients) for _ in range(count)]}
+        for metric in ALERT_METRICS:
+            mean, deviation, whole = DISTRIBUTIONS[metric]
+            values = []
+            for _ in range(count):
+                if rng.random() < MISSING_RATE:
+                    values.append(None)
+                    continue
+                value = rng.gauss(mean, deviation)
+                values.append(max(int(value), 1) if whole else round(value, 1))
+            columns[metric] = values
+        return columns
+
+    def _overrides(self, rng, patients, count):
+        overrides = {}
+        for user_id in rng.sample(range(1, patients + 1), min(count, patients)):
+            metric = rng.choice(('systolic_pressure', 'heart_rate', 'blood_glucose'))
+            mean, deviation, _ = DISTRIBUTIONS[metric]
+            overrides[user_id] = {metric: {'high': mean + deviation, 'low': mean - 2 * deviation}}
+        return overrides
+
+    def _time(self, repeat, run):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    def _report(self, label, count, seconds):
+        self.stdout.write(self.style.SUCCESS(
+            f'{label}: {seconds * 1000:.1f}ms, {count / seconds:,.0f} readings/s'
+        ))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from health.vitals_rollups import rebuild_vital_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute hourly, daily and weekly vital sign rollups from VitalSign (backfill after deploy, or to repair drift)'
+
+    def handle(self, *args, **options):
+        count = rebuild_vital_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} vital sign rollups'))
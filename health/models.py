@@ -22,9 +22,88 @@ class VitalSign(models.Model):
     source = models.CharField(max_length=50, default='manual', choices=[('manual', 'Manual'), ('device', 'Device'), ('wearable', 'Wearable')])
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Range reads per user and the ingestion duplicate check
+            models.Index(fields=['user', 'date_recorded'], name='vitalsign_user_recorded_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.email} - {self.date_recorded}"
 
+class VitalSignThreshold(models.Model):
+    """
+    A patient's own alert thresholds for one vital sign, overriding the
+    defaults in health/vitals_alerts.py. Levels left empty keep the default.
+    """
+    class MetricChoices(models.TextChoices):
+        SYSTOLIC_PRESSURE = 'systolic_pressure', 'Systolic Pressure'
+        DIASTOLIC_PRESSURE = 'diastolic_pressure', 'Diastolic Pressure'
+        HEART_RATE = 'heart_rate', 'Heart Rate'
+        TEMPERATURE = 'temperature', 'Temperature'
+        OXYGEN_SATURATION = 'oxygen_saturation', 'Oxygen Saturation'
+        BLOOD_GLUCOSE = 'blood_glucose', 'Blood Glucose'
+        RESPIRATORY_RATE = 'respiratory_rate', 'Respiratory Rate'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='vital_sign_thresholds')
+    metric = models.CharField(max_length=20, choices=MetricChoices.choices)
+    critical_low = models.FloatField(null=True, blank=True)
+    low = models.FloatField(null=True, blank=True)
+    high = models.FloatField(null=True, blank=True)
+    critical_high = models.FloatField(null=True, blank=True)
+    set_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+        help_text="Doctor who set the override"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'metric')
+
+    def __str__(self):
+        return f"{self.user.email} - {self.metric} thresholds"
+
+class VitalSignRollup(models.Model):
+    """
+    Min/max/sum/count of one vital sign metric for a user over an hour, day
+    or week (local time), maintained from VitalSign writes (see
+    health/vitals_rollups.py) so charts never read raw readings.
+    """
+    class MetricChoices(models.TextChoices):
+        HEART_RATE = 'heart_rate', 'Heart Rate'
+        SYSTOLIC_PRESSURE = 'systolic_pressure', 'Systolic Pressure'
+        DIASTOLIC_PRESSURE = 'diastolic_pressure', 'Diastolic Pressure'
+        BLOOD_GLUCOSE = 'blood_glucose', 'Blood Glucose'
+        OXYGEN_SATURATION = 'oxygen_saturation', 'Oxygen Saturation'
+        TEMPERATURE = 'temperature', 'Temperature'
+        WEIGHT = 'weight', 'Weight'
+
+    class GranularityChoices(models.TextChoices):
+        HOUR = 'hour', 'Hour'
+        DAY = 'day', 'Day'
+        WEEK = 'week', 'Week'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='vital_sign_rollups')
+    metric = models.CharField(max_length=20, choices=MetricChoices.choices)
+    granularity = models.CharField(max_length=5, choices=GranularityChoices.choices)
+    bucket_start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+    total = models.FloatField(default=0.0)
+    min_value = models.FloatField()
+    max_value = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Also the index chart queries range-scan
+        unique_together = ('user', 'metric', 'granularity', 'bucket_start')
+
+    def __str__(self):
+        return f"{self.user.email} - {self.metric} {self.granularity} {self.bucket_start}"
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
 class FoodLog(models.Model):
     MEAL_CHOICES = (
         ('breakfast', 'Breakfast'),
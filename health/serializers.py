@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from .models import VitalSign, FoodLog, ExerciseLog, SleepLog, HealthGoal, MedicalDocument, WaterIntakeLog, HealthInsight
 from users.serializers import UserSerializer
+from vitanips.core.batching import BatchLoadingMixin, BatchedListSerializer
+from .vitals_alerts import evaluate_readings
 
 class VitalSignSerializer(serializers.ModelSerializer):
     class Meta:
@@ -13,19 +15,25 @@ class VitalSignSerializer(serializers.ModelSerializer):
         read_only_fields = ['user', 'created_at']
 
 
-class VitalSignWithAlertsSerializer(VitalSignSerializer):
+class VitalSignWithAlertsSerializer(BatchLoadingMixin, VitalSignSerializer):
     """
     Extended serializer that includes alerts for abnormal vital signs.
-    Used when doctors view patient vitals.
+    Used when doctors view patient vitals; a page is scored in one batch.
     """
+    batch_loaders = ('alerts',)
+
     alerts = serializers.SerializerMethodField()
     
     class Meta(VitalSignSerializer.Meta):
         fields = VitalSignSerializer.Meta.fields + ['alerts']
+        list_serializer_class = BatchedListSerializer
+
+    def load_alerts(self, instances):
+        """Alerts for the whole page, with the patients' threshold overrides read in one query."""
+        return {vital.pk: alerts for vital, alerts in zip(instances, evaluate_readings(instances))}
     
     def get_alerts(self, obj):
-        from .vitals_utils import analyze_vital_signs
-        return analyze_vital_signs(obj)
+        return self.get_batched('alerts', obj, default=[])
 
 
 class FoodLogSerializer(serializers.ModelSerializer):
@@ -0,0 +1,34 @@
+# health/signals.py
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import VitalSign
+from .vitals_rollups import METRICS, add_readings, refresh_buckets
+
+
+@receiver(pre_save, sender=VitalSign)
+def stash_previous_reading(sender, instance, **kwargs):
+    instance._previous_reading = (
+        VitalSign.objects.filter(pk=instance.pk).values('user_id', 'date_recorded', *METRICS).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=VitalSign)
+def update_vital_sign_rollups(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_reading', None)
+    if created or previous is None:
+        add_readings([instance])
+        return
+    if previous['user_id'] != instance.user_id:
+        refresh_buckets(previous['user_id'], [previous['date_recorded']])
+        refresh_buckets(instance.user_id, [instance.date_recorded])
+    elif (
+        previous['date_recorded'] != instance.date_recorded
+        or any(previous[metric] != getattr(instance, metric) for metric in METRICS)
+    ):
+        refresh_buckets(instance.user_id, [previous['date_recorded'], instance.date_recorded])
+
+
+@receiver(post_delete, sender=VitalSign)
+def remove_vital_sign_from_rollups(sender, instance, **kwargs):
+    refresh_buckets(instance.user_id, [instance.date_recorded])
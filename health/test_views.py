@@ -7,7 +7,7 @@ from django.contrib.auth import get_user_model
 from faker import Faker
 import datetime
 from django.utils import timezone
-from .models import VitalSign, FoodLog, ExerciseLog, SleepLog, HealthGoal, MedicalDocument
+from .models import VitalSign, VitalSignRollup, VitalSignThreshold, FoodLog, ExerciseLog, SleepLog, HealthGoal, MedicalDocument
 from django.core.files.uploadedfile import SimpleUploadedFile
 from doctors.models import Doctor, Appointment, Specialty
 
@@ -61,6 +61,129 @@ class HealthAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(VitalSign.objects.count(), 1)
 
+    def test_vital_sign_chart_reads_incremental_rollups(self):
+        start = timezone.make_aware(datetime.datetime(2025, 3, 3, 8, 0))  # a Monday
+        for day in range(14):
+            for hour, heart_rate in ((0, 60), (1, 80)):
+                VitalSign.objects.create(
+                    user=self.user, date_recorded=start + datetime.timedelta(days=day, hours=hour),
+                    heart_rate=heart_rate, systolic_pressure=120, diastolic_pressure=80,
+                )
+        rollup = VitalSignRollup.objects.get(
+            user=self.user, metric='heart_rate', granularity='day', bucket_start=start.replace(hour=0)
+        )
+        self.assertEqual((rollup.count, rollup.min_value, rollup.max_value, rollup.mean), (2, 60, 80, 70))
+
+        url = reverse('vital-sign-chart')
+        response = self.client.get(url, {'metric': 'heart_rate', 'from': '2025-03-03', 'to': '2025-03-16', 'points': 400})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['granularity'], 'hour')
+        self.assertEqual(len(response.data['series']['heart_rate']), 28)
+
+        response = self.client.get(url, {'metric': 'heart_rate', 'from': '2025-03-03', 'to': '2025-03-16'})
+        self.assertEqual(response.data['granularity'], 'day')
+        points = response.data['series']['heart_rate']
+        self.assertEqual(len(points), 14)
+        self.assertEqual((points[0]['count'], points[0]['min'], points[0]['max'], points[0]['mean']), (2, 60, 80, 70))
+
+        response = self.client.get(url, {'metric': 'blood_pressure', 'from': '2025-03-03', 'to': '2025-03-16', 'points': 1})
+        self.assertEqual(response.data['granularity'], 'week')
+        self.assertEqual(response.data['buckets_per_point'], 2)
+        self.assertEqual(response.data['series']['systolic_pressure'][0]['count'], 28)
+        self.assertEqual(response.data['series']['diastolic_pressure'][0]['mean'], 80)
+
+        # Edits and deletes recompute the buckets they touched
+        reading = VitalSign.objects.filter(user=self.user, heart_rate=80).earliest('date_recorded')
+        reading.heart_rate = 100
+        reading.save()
+        VitalSign.objects.filter(user=self.user, heart_rate=60, date_recorded__lt=start + datetime.timedelta(hours=1)).delete()
+        rollup = VitalSignRollup.objects.get(
+            user=self.user, metric='heart_rate', granularity='day', bucket_start=start.replace(hour=0)
+        )
+        self.assertEqual((rollup.count, rollup.min_value, rollup.max_value), (1, 100, 100))
+
+        response = self.client.get(url, {'metric': 'steps'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ingest_gzipped_ndjson_batch_deduplicates_and_reports_per_record(self):
+        import gzip
+        import json
+        start = timezone.make_aware(datetime.datetime(2025, 3, 3, 0, 0))
+        VitalSign.objects.create(user=self.user, date_recorded=start, heart_rate=70, source='wearable')
+        readings = [
+            {'date_recorded': (start + datetime.timedelta(minutes=minute)).isoformat(), 'heart_rate': 60 + minute % 30}
+            for minute in range(1440)
+        ]
+        readings.append(readings[5])
+        readings.append({'date_recorded': 'yesterday', 'heart_rate': 70})
+        readings.append({'date_recorded': start.isoformat(), 'notes': 'no values'})
+        body = gzip.compress('\n'.join(json.dumps(reading) for reading in readings).encode() + b'\nnot json\n')
+
+        url = reverse('vital-sign-ingest')
+        response = self.client.generic(
+            'POST', url, body, content_type='application/x-ndjson', HTTP_CONTENT_ENCODING='gzip'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            (response.data['received'], response.data['created'], response.data['duplicates'], response.data['invalid']),
+            (1444, 1439, 2, 3)
+        )
+        results = response.data['results']
+        self.assertEqual([result['index'] for result in results], list(range(1444)))
+        self.assertEqual(results[0]['status'], 'duplicate')
+        self.assertEqual(results[1]['status'], 'created')
+        self.assertEqual(results[1440]['status'], 'duplicate')
+        self.assertIn('date_recorded', results[1441]['errors'])
+        self.assertEqual(VitalSign.objects.filter(user=self.user, source='wearable').count(), 1440)
+        self.assertEqual(
+            VitalSignRollup.objects.get(
+                user=self.user, metric='heart_rate', granularity='day', bucket_start=start
+            ).count,
+            1440
+        )
+
+        # Resending the same batch as a JSON array stores nothing new
+        response = self.client.generic(
+            'POST', url, json.dumps(readings[:1440]), content_type='application/json'
+        )
+        self.assertEqual(response.data['duplicates'], 1440)
+        self.assertEqual(VitalSign.objects.filter(user=self.user).count(), 1440)
+
+        response = self.client.generic('POST', url, b'[{"heart_rate": 1}', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # One oversized element is refused instead of being re-scanned on every read
+        oversized = json.dumps([{'date_recorded': start.isoformat(), 'notes': 'x' * (100 * 1024)}])
+        response = self.client.generic('POST', url, oversized, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_patient_vitals_alerts_use_rule_table_and_patient_overrides(self):
+        now = timezone.now()
+        VitalSign.objects.create(user=self.user, date_recorded=now, heart_rate=85, systolic_pressure=185, diastolic_pressure=95)
+        VitalSign.objects.create(user=self.user, date_recorded=now - datetime.timedelta(hours=1), heart_rate=105, oxygen_saturation=89)
+        VitalSign.objects.create(user=self.user, date_recorded=now - datetime.timedelta(hours=2), heart_rate=72, temperature=36.6)
+        self.client.force_authenticate(user=self.doctor.user)
+        url = reverse('patient-vital-signs', kwargs={'user_id': self.user.pk})
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        alerts = [[(a['field'], a['type'], a['severity']) for a in row['alerts']] for row in response.data['results']]
+        self.assertEqual(alerts, [
+            [('blood_pressure', 'high_bp', 'critical')],
+            [('heart_rate', 'high_hr', 'warning'), ('oxygen_saturation', 'low_o2', 'critical')],
+            [],
+        ])
+        self.assertEqual(response.data['results'][0]['alerts'][0]['message'], 'Critical high blood pressure: 185/95 mmHg')
+
+        # A patient whose resting heart rate should stay under 80
+        VitalSignThreshold.objects.create(user=self.user, metric='heart_rate', high=80, set_by=self.doctor.user)
+        response = self.client.get(url)
+        self.assertEqual(
+            [(a['field'], a['severity']) for a in response.data['results'][0]['alerts']],
+            [('blood_pressure', 'critical'), ('heart_rate', 'warning')]
+        )
+        self.assertEqual(response.data['results'][2]['alerts'], [])
+
     def test_create_food_log(self):
         url = reverse('food-log-list')
         data = {
@@ -1,3 +1,43 @@
-from django.test import TestCase
+import random
+from unittest import skipUnless
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from .vitals_alerts import ALERT_METRICS, NUMPY_AVAILABLE, evaluate_columns, score_columns
+
+
+@skipUnless(NUMPY_AVAILABLE, "numpy is not installed")
+class VectorizedAlertScoringTest(SimpleTestCase):
+    """The NumPy evaluation must agree with the row-by-row one it replaces."""
+
+    RANGES = {
+        'systolic_pressure': (60, 200), 'diastolic_pressure': (30, 130), 'heart_rate': (30, 130),
+        'temperature': (33.0, 40.5), 'oxygen_saturation': (85, 100), 'blood_glucose': (45, 220),
+        'respiratory_rate': (5, 35),
+    }
+
+    def random_columns(self, rows, seed=7):
+        rng = random.Random(seed)
+        columns = {'user_id': [rng.randint(1, 25) for _ in range(rows)]}
+        for metric in ALERT_METRICS:
+            low, high = self.RANGES[metric]
+            draw = rng.uniform if isinstance(low, float) else rng.randint
+            # Missing and zero readings are both "not measured"
+            columns[metric] = [rng.choice((None, 0)) if rng.random() < 0.15 else draw(low, high) for _ in range(rows)]
+        return columns
+
+    def test_vectorized_scores_match_row_by_row(self):
+        columns = self.random_columns(2000)
+        overrides = {
+            3: {'heart_rate': {'high': 80, 'critical_high': 95}},
+            7: {'systolic_pressure': {'high': 130}, 'oxygen_saturation': {'low': 92}},
+            # A patient with no readings in the batch
+            99: {'temperature': {'high': 37.5}},
+        }
+        for given in (None, overrides):
+            vectorized = score_columns(columns, given, vectorized=True)
+            rows = score_columns(columns, given, vectorized=False)
+            self.assertEqual({field: list(scores) for field, scores in vectorized.items()}, rows)
+            self.assertEqual(
+                evaluate_columns(columns, given, vectorized=True), evaluate_columns(columns, given, vectorized=False)
+            )
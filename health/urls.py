@@ -1,6 +1,6 @@
 from django.urls import path
 from .views import (
-    VitalSignListCreateView, VitalSignDetailView, VitalSignLatestView, PatientVitalSignsView,
+    VitalSignListCreateView, VitalSignDetailView, VitalSignLatestView, VitalSignChartView, VitalSignIngestView, PatientVitalSignsView,
     FoodLogListCreateView, FoodLogDetailView,
     ExerciseLogListCreateView, ExerciseLogDetailView,
     SleepLogListCreateView, SleepLogDetailView,
@@ -18,6 +18,8 @@ from .analytics_views import HealthRecommendationsView, HealthTrendView
 urlpatterns = [
     path('vital-signs/', VitalSignListCreateView.as_view(), name='vital-sign-list'),
     path('vital-signs/latest/', VitalSignLatestView.as_view(), name='vital-sign-latest'),
+    path('vital-signs/ingest/', VitalSignIngestView.as_view(), name='vital-sign-ingest'),
+    path('vital-signs/chart/', VitalSignChartView.as_view(), name='vital-sign-chart'),
     path('vital-signs/<int:pk>/', VitalSignDetailView.as_view(), name='vital-sign-detail'),
     path('patients/<int:user_id>/vital-signs/', PatientVitalSignsView.as_view(), name='patient-vital-signs'),
     
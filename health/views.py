@@ -1,4 +1,8 @@
-from rest_framework import generics, permissions, views
+import logging
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import generics, permissions, views, status
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
 from django_filters.rest_framework import DjangoFilterBackend
@@ -12,8 +16,12 @@ from .serializers import (
 )
 
 from .permissions import IsOwnerOrSharedWith
+from .vitals_ingest import FORMATS as INGEST_FORMATS, IngestError, detect_format, ingest_vitals, open_stream
+from .vitals_rollups import DEFAULT_CHART_POINTS, GRANULARITIES, MAX_CHART_POINTS, METRICS, chart_series
 from .services import HealthAnalyticsService
 
+logger = logging.getLogger(__name__)
+
 # ... (Previous views remain, I'll re-include them for completeness)
 
 class MedicalDocumentListCreateView(generics.ListCreateAPIView):
@@ -181,6 +189,105 @@ class VitalSignLatestView(generics.RetrieveAPIView):
         return VitalSign.objects.filter(user=self.request.user).order_by('-date_recorded').first()
 
 
+class VitalSignIngestView(views.APIView):
+    """
+    POST: Store a batch of device/wearable readings in one request. The body
+    is NDJSON (Content-Type application/x-ndjson) or a JSON array
+    (application/json), optionally gzip-compressed (Content-Encoding: gzip).
+    Readings default to source
+    'wearable'; one with the same timestamp and source as a stored reading
+    is skipped as a duplicate. Returns a result per reading, in order.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        fmt = detect_format(request.content_type)
+        if fmt not in INGEST_FORMATS:
+            return Response(
+                {"error": f"Unsupported format '{fmt}'. Use one of: {', '.join(INGEST_FORMATS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if request.stream is None:
+            return Response({"error": "The request body is empty."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            stream = open_stream(request.stream, request.headers.get('Content-Encoding'))
+            report = ingest_vitals(request.user, stream, fmt)
+        except IngestError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        logger.info(
+            f"Vitals ingest for user {request.user.id}: {report.created} created, "
+            f"{report.duplicates} duplicates, {report.invalid} invalid"
+        )
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
+
+
+# Chart metric -> rolled-up VitalSign fields; blood pressure is charted as both readings
+CHART_METRICS = {
+    'blood_pressure': ['systolic_pressure', 'diastolic_pressure'],
+    **{metric: [metric] for metric in METRICS},
+}
+
+
+def _parse_chart_bound(value, end=False):
+    """An ISO datetime, or a date meaning its start (or, for `end`, the start of the next day)."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+class VitalSignChartView(views.APIView):
+    """
+    GET: A downsampled vital sign series for any range in one response, read
+    from the hourly/daily/weekly rollups.
+    Query params: metric (heart_rate, blood_pressure, blood_glucose,
+    oxygen_saturation, temperature, weight, ...), from / to (ISO date or
+    datetime, default the last 30 days), points (maximum points per series,
+    default 200) and optionally granularity (hour, day or week).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        metric = request.query_params.get('metric')
+        if metric not in CHART_METRICS:
+            return Response(
+                {"error": f"metric must be one of: {', '.join(CHART_METRICS)}."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            end = _parse_chart_bound(request.query_params['to'], end=True) if request.query_params.get('to') else timezone.now()
+            start = _parse_chart_bound(request.query_params['from']) if request.query_params.get('from') else end - timedelta(days=30)
+            points = int(request.query_params.get('points', DEFAULT_CHART_POINTS))
+        except (ValueError, TypeError):
+            return Response(
+                {"error": "from and to must be ISO dates or datetimes, and points an integer."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if start >= end:
+            return Response({"error": "from must be before to."}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= points <= MAX_CHART_POINTS:
+            return Response(
+                {"error": f"points must be between 1 and {MAX_CHART_POINTS}."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        granularity = request.query_params.get('granularity')
+        if granularity is not None and granularity not in GRANULARITIES:
+            return Response({"error": "granularity must be hour, day or week."}, status=status.HTTP_400_BAD_REQUEST)
+
+        granularity, buckets_per_point, series = chart_series(
+            request.user, CHART_METRICS[metric], start, end, points=points, granularity=granularity
+        )
+        return Response({
+            'metric': metric,
+            'from': start,
+            'to': end,
+            'granularity': granularity,
+            'buckets_per_point': buckets_per_point,
+            'series': series,
+        })
+
+
 class PatientVitalSignsView(generics.ListAPIView):
     """
     Endpoint for doctors to view a patient's vital signs.
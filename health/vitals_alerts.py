@@ -0,0 +1,266 @@
+# health/vitals_alerts.py
+"""
+Table-driven vital sign alerts, evaluated a batch of readings at a time.
+
+ALERT_RULES lists, per alert field, the readings it tests and its levels in
+priority order; the first level a reading crosses is its alert for that
+field. Readings are laid out as columns (one list per metric), and every
+level is one comparison over a whole column, so a page of readings or a
+million of them costs the same handful of passes. With NumPy installed the
+comparisons are array operations; without it the same table is evaluated
+row by row. Thresholds come from VITALS_THRESHOLDS unless the patient has a
+VitalSignThreshold override for that metric.
+"""
+import logging
+
+from .models import VitalSignThreshold
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+    logger.warning("numpy not installed; vital sign alerts are evaluated row by row. Install with: pip install numpy")
+
+
+# Medical thresholds for vitals alerts
+VITALS_THRESHOLDS = {
+    'systolic_pressure': {
+        'high': 140,
+        'critical_high': 180,
+        'low': 90,
+        'critical_low': 70,
+    },
+    'diastolic_pressure': {
+        'high': 90,
+        'critical_high': 120,
+        'low': 60,
+        'critical_low': 40,
+    },
+    'heart_rate': {
+        'high': 100,
+        'critical_high': 120,
+        'low': 60,
+        'critical_low': 40,
+    },
+    'temperature': {
+        'high': 38.0,  # Celsius
+        'critical_high': 39.5,
+        'low': 35.0,
+        'critical_low': 34.0,
+    },
+    'oxygen_saturation': {
+        'low': 95,
+        'critical_low': 90,
+    },
+    'blood_glucose': {
+        'high': 140,  # mg/dL (fasting)
+        'critical_high': 200,
+        'low': 70,
+        'critical_low': 54,
+    },
+    'respiratory_rate': {
+        'high': 20,
+        'critical_high': 30,
+        'low': 12,
+        'critical_low': 8,
+    }
+}
+
+# field: (metrics tested, levels as (threshold level, type, severity, message template)).
+# A reading is only tested when it has every metric; a level fires when any
+# metric is at or beyond its threshold (>= for *high levels, <= for *low).
+ALERT_RULES = {
+    'blood_pressure': (('systolic_pressure', 'diastolic_pressure'), (
+        ('critical_high', 'high_bp', 'critical', 'Critical high blood pressure: {value} mmHg'),
+        ('high', 'high_bp', 'warning', 'Elevated blood pressure: {value} mmHg'),
+        ('critical_low', 'low_bp', 'critical', 'Critical low blood pressure: {value} mmHg'),
+        ('low', 'low_bp', 'warning', 'Low blood pressure: {value} mmHg'),
+    )),
+    'heart_rate': (('heart_rate',), (
+        ('critical_high', 'high_hr', 'critical', 'Critical high heart rate: {value} BPM'),
+        ('high', 'high_hr', 'warning', 'Elevated heart rate: {value} BPM'),
+        ('critical_low', 'low_hr', 'critical', 'Critical low heart rate: {value} BPM'),
+        ('low', 'low_hr', 'warning', 'Low heart rate: {value} BPM'),
+    )),
+    'temperature': (('temperature',), (
+        ('critical_high', 'fever', 'critical', 'High fever: {value}°C'),
+        ('high', 'fever', 'warning', 'Fever: {value}°C'),
+        ('critical_low', 'hypothermia', 'critical', 'Critical low temperature: {value}°C'),
+        ('low', 'hypothermia', 'warning', 'Low temperature: {value}°C'),
+    )),
+    'oxygen_saturation': (('oxygen_saturation',), (
+        ('critical_low', 'low_o2', 'critical', 'Critical low oxygen saturation: {value}%'),
+        ('low', 'low_o2', 'warning', 'Low oxygen saturation: {value}%'),
+    )),
+    'blood_glucose': (('blood_glucose',), (
+        ('critical_high', 'high_glucose', 'critical', 'Critical high blood glucose: {value} mg/dL'),
+        ('high', 'high_glucose', 'warning', 'Elevated blood glucose: {value} mg/dL'),
+        ('critical_low', 'low_glucose', 'critical', 'Critical low blood glucose: {value} mg/dL'),
+        ('low', 'low_glucose', 'warning', 'Low blood glucose: {value} mg/dL'),
+    )),
+    'respiratory_rate': (('respiratory_rate',), (
+        ('critical_high', 'high_rr', 'critical', 'Critical high respiratory rate: {value} breaths/min'),
+        ('high', 'high_rr', 'warning', 'Elevated respiratory rate: {value} breaths/min'),
+        ('critical_low', 'low_rr', 'critical', 'Critical low respiratory rate: {value} breaths/min'),
+        ('low', 'low_rr', 'warning', 'Low respiratory rate: {value} breaths/min'),
+    )),
+}
+
+ALERT_METRICS = tuple(dict.fromkeys(metric for metrics, _ in ALERT_RULES.values() for metric in metrics))
+LEVELS = ('critical_low', 'low', 'high', 'critical_high')
+
+
+def load_threshold_overrides(user_ids):
+    """{user_id: {metric: {level: value}}} for the users' VitalSignThreshold rows, in one query."""
+    overrides = {}
+    for row in VitalSignThreshold.objects.filter(user_id__in=set(user_ids)).values('user_id', 'metric', *LEVELS):
+        levels = {level: row[level] for level in LEVELS if row[level] is not None}
+        if levels:
+            overrides.setdefault(row['user_id'], {})[row['metric']] = levels
+    return overrides
+
+
+def columns_from_readings(readings):
+    """Columnar view of VitalSign instances: {'user_id': [...], metric: [...]} in reading order."""
+    readings = list(readings)
+    columns = {'user_id': [reading.user_id for reading in readings]}
+    for metric in ALERT_METRICS:
+        columns[metric] = [getattr(reading, metric) for reading in readings]
+    return columns
+
+
+def _overridden(overrides, metric, level):
+    return {
+        user_id: by_metric[metric][level]
+        for user_id, by_metric in overrides.items()
+        if level in by_metric.get(metric, {})
+    }
+
+
+def _score_vectorized(columns, overrides):
+    n = len(columns['user_id'])
+    values = {}
+    for metric in ALERT_METRICS:
+        # None becomes NaN; 0 counts as not measured, as it always has
+        column = np.asarray(columns[metric], dtype=float)
+        values[metric] = np.where(column == 0, np.nan, column)
+
+    patients = None
+
+    def threshold(metric, level):
+        nonlocal patients
+        default = VITALS_THRESHOLDS[metric][level]
+        overridden = _overridden(overrides, metric, level)
+        if not overridden:
+            return default
+        if patients is None:
+            # Distinct patients and each row's position among them, computed once
+            patients = np.unique(np.asarray(columns['user_id']), return_inverse=True)
+        unique_ids, row_patient = patients
+        per_patient = np.full(len(unique_ids), default, dtype=float)
+        ids = np.fromiter(overridden, dtype=unique_ids.dtype, count=len(overridden))
+        positions = np.minimum(np.searchsorted(unique_ids, ids), len(unique_ids) - 1)
+        present = unique_ids[positions] == ids
+        per_patient[positions[present]] = np.fromiter(overridden.values(), dtype=float, count=len(overridden))[present]
+        return per_patient[row_patient]
+
+    scores = {}
+    for field, (metrics, levels) in ALERT_RULES.items():
+        untested = np.zeros(n, dtype=bool)
+        for metric in metrics:
+            untested |= np.isnan(values[metric])
+        remaining = ~untested
+        matched = np.full(n, -1, dtype=np.int8)
+        for index, (level, *_) in enumerate(levels):
+            hit = np.zeros(n, dtype=bool)
+            for metric in metrics:
+                limit = threshold(metric, level)
+                hit |= values[metric] >= limit if level.endswith('high') else values[metric] <= limit
+            hit &= remaining
+            matched[hit] = index
+            remaining &= ~hit
+        scores[field] = matched
+    return scores
+
+
+def _score_rows(columns, overrides):
+    user_ids = columns['user_id']
+    scores = {}
+    for field, (metrics, levels) in ALERT_RULES.items():
+        matched = [-1] * len(user_ids)
+        metric_columns = [columns[metric] for metric in metrics]
+        for row, user_id in enumerate(user_ids):
+            readings = [column[row] for column in metric_columns]
+            if not all(readings):
+                continue
+            user_overrides = overrides.get(user_id, {})
+            for index, (level, *_) in enumerate(levels):
+                high = level.endswith('high')
+                for metric, value in zip(metrics, readings):
+                    limit = user_overrides.get(metric, {}).get(level, VITALS_THRESHOLDS[metric][level])
+                    if (value >= limit) if high else (value <= limit):
+                        break
+                else:
+                    continue
+                matched[row] = index
+                break
+        scores[field] = matched
+    return scores
+
+
+def score_columns(columns, overrides=None, vectorized=None):
+    """
+    The level each reading hits per alert field: {field: sequence of indexes
+    into that field's levels, -1 for no alert}. `overrides` is as returned
+    by load_threshold_overrides.
+    """
+    overrides = overrides or {}
+    if vectorized is None:
+        vectorized = NUMPY_AVAILABLE
+    return _score_vectorized(columns, overrides) if vectorized else _score_rows(columns, overrides)
+
+
+def _plain(value):
+    # NumPy scalars read back from array columns
+    return value.item() if hasattr(value, 'item') else value
+
+
+def evaluate_columns(columns, overrides=None, vectorized=None):
+    """Alert dicts (type, severity, message, value, field) per reading, in the columns' row order."""
+    scores = score_columns(columns, overrides, vectorized=vectorized)
+    alerts = [[] for _ in range(len(columns['user_id']))]
+    for field, (metrics, levels) in ALERT_RULES.items():
+        matched = scores[field]
+        rows = np.flatnonzero(matched >= 0) if NUMPY_AVAILABLE and hasattr(matched, 'dtype') else (
+            row for row, index in enumerate(matched) if index >= 0
+        )
+        for row in rows:
+            _, alert_type, severity, message = levels[matched[row]]
+            readings = [_plain(columns[metric][row]) for metric in metrics]
+            value = '/'.join(str(reading) for reading in readings) if len(readings) > 1 else readings[0]
+            alerts[row].append({
+                'type': alert_type,
+                'severity': severity,
+                'message': message.format(value=value),
+                'value': value,
+                'field': field,
+            })
+    return alerts
+
+
+def evaluate_readings(readings, overrides=None):
+    """
+    Alerts for each of `readings` (VitalSign instances), using the patients'
+    threshold overrides (loaded in one query unless given).
+    """
+    readings = list(readings)
+    if not readings:
+        return []
+    columns = columns_from_readings(readings)
+    if overrides is None:
+        overrides = load_threshold_overrides(columns['user_id'])
+    return evaluate_columns(columns, overrides)
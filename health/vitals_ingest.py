@@ -0,0 +1,261 @@
+# health/vitals_ingest.py
+"""
+Batched ingestion of device and wearable vital sign readings.
+
+A batch is a request body holding NDJSON (one reading per line) or a JSON
+array of readings, optionally gzip-compressed. Readings are decoded and
+validated one at a time as the body streams in, and inserted with
+bulk_create in chunks: each chunk costs one duplicate lookup, one INSERT and
+one rollup upsert (see health/vitals_rollups.py). A reading is a duplicate
+when the user already has one with the same timestamp and source, so a
+device can resend a batch safely. The whole batch is one transaction that
+holds the user's row lock, so concurrent syncs of the same user cannot
+insert the same reading twice.
+"""
+import codecs
+import gzip
+import json
+import zlib
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from .models import VitalSign
+from .serializers import VitalSignSerializer
+from .vitals_rollups import add_readings
+
+FORMATS = ('ndjson', 'json')
+DEFAULT_CHUNK_SIZE = 500
+# A week of one-minute samples fits in one batch
+MAX_RECORDS = 20000
+MAX_DECOMPRESSED_BYTES = 50 * 1024 * 1024
+DEFAULT_SOURCE = 'wearable'
+READ_SIZE = 64 * 1024
+# A single reading is a few hundred bytes; anything near this is not one, and
+# re-scanning an ever-growing partial record on every read would be quadratic
+MAX_RECORD_CHARS = 64 * 1024
+
+READING_FIELDS = (
+    'heart_rate', 'systolic_pressure', 'diastolic_pressure', 'respiratory_rate', 'temperature',
+    'oxygen_saturation', 'blood_glucose', 'weight',
+)
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/json-seq')
+
+
+class IngestError(ValueError):
+    """The batch as a whole cannot be read; nothing from it is stored."""
+
+
+def detect_format(content_type, default='ndjson'):
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in NDJSON_CONTENT_TYPES:
+        return 'ndjson'
+    if content_type == 'application/json':
+        return 'json'
+    return default
+
+
+def open_stream(stream, content_encoding=None):
+    """The request body, decompressed when it is sent with Content-Encoding: gzip."""
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        return stream
+    if encoding in ('gzip', 'x-gzip'):
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    raise IngestError(f"Unsupported Content-Encoding '{content_encoding}'. Send gzip or uncompressed data.")
+
+
+class _ByteBudget:
+    def __init__(self, limit=MAX_DECOMPRESSED_BYTES):
+        self.remaining = limit
+
+    def spend(self, data):
+        self.remaining -= len(data)
+        if self.remaining < 0:
+            raise IngestError(f"Batch exceeds {MAX_DECOMPRESSED_BYTES} bytes once decompressed.")
+        return data
+
+
+def _iter_ndjson(stream, budget):
+    # Read fixed-size blocks and split them here: iterating the stream by line
+    # would let a gzip body inflate one endless line before the budget sees it
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+    while True:
+        data = stream.read(READ_SIZE)
+        pending += text_decoder.decode(budget.spend(data), final=not data)
+        *lines, pending = pending.split('\n')
+        if len(pending) > MAX_RECORD_CHARS:
+            raise IngestError(f"A line is longer than {MAX_RECORD_CHARS} characters.")
+        if not data:
+            lines.append(pending)
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+        if not data:
+            return
+
+
+def _iter_json_array(stream, budget):
+    """Yield the elements of a top-level JSON array without reading the whole body first."""
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer, exhausted, started, count, after_value = '', False, False, 0, False
+
+    def fill():
+        nonlocal buffer, exhausted
+        data = stream.read(READ_SIZE)
+        if not data:
+            exhausted = True
+            buffer += text_decoder.decode(b'', final=True)
+            return
+        buffer += text_decoder.decode(budget.spend(data))
+
+    while True:
+        buffer = buffer.lstrip()
+        if not buffer:
+            if exhausted:
+                raise IngestError("Body is not a JSON array of readings." if not started else "JSON array is not terminated.")
+            fill()
+            continue
+        if not started:
+            if not buffer.startswith('['):
+                raise IngestError("Body is not a JSON array of readings.")
+            buffer, started = buffer[1:], True
+            continue
+        if buffer.startswith(']') and (after_value or count == 0):
+            return
+        if after_value:
+            if not buffer.startswith(','):
+                raise IngestError("Body is not a valid JSON array.")
+            buffer, after_value = buffer[1:], False
+            continue
+        try:
+            value, end = decoder.raw_decode(buffer)
+        except ValueError:
+            value, end = None, None
+        if end is None or end == len(buffer):
+            # The element may continue past what has been read so far
+            if len(buffer) > MAX_RECORD_CHARS:
+                raise IngestError(f"Body is not a valid JSON array, or an element is longer than {MAX_RECORD_CHARS} characters.")
+            if not exhausted:
+                fill()
+                continue
+            if end is None:
+                raise IngestError("Body is not a valid JSON array.")
+        if end > MAX_RECORD_CHARS:
+            raise IngestError(f"An array element is longer than {MAX_RECORD_CHARS} characters.")
+        buffer, count, after_value = buffer[end:], count + 1, True
+        yield value
+
+
+def iter_records(stream, fmt):
+    """Yield the raw readings (dicts, or None for lines that are not JSON) of a binary stream."""
+    budget = _ByteBudget()
+    if fmt == 'ndjson':
+        return _iter_ndjson(stream, budget)
+    if fmt == 'json':
+        return _iter_json_array(stream, budget)
+    raise IngestError(f"Unsupported format '{fmt}'. Use one of: {', '.join(FORMATS)}")
+
+
+class VitalSignIngest:
+    """Accumulates the per-record outcome of one batch; see ingest_vitals."""
+
+    def __init__(self, user, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.user = user
+        self.chunk_size = chunk_size
+        self.received = 0
+        self.created = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.results = []
+        # (date_recorded, source) of every reading accepted so far in this batch
+        self.seen = set()
+
+    def as_dict(self):
+        return {
+            'received': self.received,
+            'created': self.created,
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'results': self.results,
+        }
+
+    def parse(self, index, raw):
+        if not isinstance(raw, dict):
+            self.invalid += 1
+            self.results.append({'index': index, 'status': 'invalid', 'errors': {'non_field_errors': ['Not a JSON object.']}})
+            return None
+        serializer = VitalSignSerializer(data={'source': DEFAULT_SOURCE, **raw})
+        if not serializer.is_valid():
+            self.invalid += 1
+            self.results.append({'index': index, 'status': 'invalid', 'errors': serializer.errors})
+            return None
+        data = serializer.validated_data
+        if all(data.get(metric) is None for metric in READING_FIELDS):
+            self.invalid += 1
+            self.results.append({
+                'index': index, 'status': 'invalid', 'errors': {'non_field_errors': ['No vital sign values given.']}
+            })
+            return None
+        return VitalSign(user=self.user, **data)
+
+    def run(self, records):
+        with transaction.atomic():
+            # Serializes batches of the same user, so the duplicate check below cannot race
+            list(get_user_model().objects.select_for_update().filter(pk=self.user.pk).values_list('pk', flat=True))
+            chunk = []
+            for index, raw in enumerate(records):
+                if index >= MAX_RECORDS:
+                    raise IngestError(f"A batch may hold at most {MAX_RECORDS} readings.")
+                self.received += 1
+                vital = self.parse(index, raw)
+                if vital is not None:
+                    chunk.append((index, vital))
+                if len(chunk) >= self.chunk_size:
+                    self.flush(chunk)
+                    chunk = []
+            if chunk:
+                self.flush(chunk)
+        self.results.sort(key=lambda result: result['index'])
+        return self
+
+    def flush(self, chunk):
+        existing = set(
+            VitalSign.objects.filter(
+                user=self.user, date_recorded__in={vital.date_recorded for _, vital in chunk}
+            ).values_list('date_recorded', 'source')
+        )
+        new = []
+        for index, vital in chunk:
+            key = (vital.date_recorded, vital.source)
+            if key in existing or key in self.seen:
+                self.duplicates += 1
+                self.results.append({'index': index, 'status': 'duplicate'})
+                continue
+            self.seen.add(key)
+            new.append((index, vital))
+        if not new:
+            return
+        created = VitalSign.objects.bulk_create([vital for _, vital in new])
+        # One rollup upsert per chunk instead of update_vital_sign_rollups once per reading
+        add_readings(created)
+        self.created += len(created)
+        self.results.extend(
+            {'index': index, 'status': 'created', 'id': vital.pk} for (index, _), vital in zip(new, created)
+        )
+
+
+def ingest_vitals(user, stream, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Validate and store a batch of `user`'s readings from a binary stream; returns the report."""
+    try:
+        return VitalSignIngest(user, chunk_size=chunk_size).run(iter_records(stream, fmt))
+    except (OSError, EOFError, zlib.error) as e:
+        raise IngestError(f"Body could not be decompressed: {e}")
+    except UnicodeDecodeError:
+        raise IngestError("Body is not UTF-8 encoded.")
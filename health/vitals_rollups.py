@@ -0,0 +1,211 @@
+# health/vitals_rollups.py
+"""
+Hourly, daily and weekly rollups of vital sign readings (VitalSignRollup).
+
+New readings are added to their buckets by one INSERT ... ON CONFLICT that
+moves count/total/min/max in place, so concurrent inserts for the same bucket
+add up. Min and max cannot be taken back, so an edited or deleted reading
+has the buckets it touched recomputed from the raw rows instead (see
+health/signals.py). Charts read only rollups: the finest granularity that
+fits the requested number of points is used, and adjacent buckets are
+merged when even weekly buckets are too many.
+"""
+import logging
+from datetime import timedelta
+from math import ceil
+
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .models import VitalSign, VitalSignRollup
+
+logger = logging.getLogger(__name__)
+
+METRICS = tuple(VitalSignRollup.MetricChoices.values)
+# Finest first
+GRANULARITIES = ('hour', 'day', 'week')
+BUCKET_LENGTH = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+}
+UPSERT_BATCH_SIZE = 1000
+DEFAULT_CHART_POINTS = 200
+MAX_CHART_POINTS = 1000
+
+
+def bucket_start(value, granularity):
+    """Start of the local hour, day or (Monday-based) week containing `value`."""
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    value = timezone.localtime(value).replace(minute=0, second=0, microsecond=0)
+    if granularity == 'hour':
+        return value
+    value = value.replace(hour=0)
+    if granularity == 'week':
+        value -= timedelta(days=value.weekday())
+    return value
+
+
+def reading_deltas(vitals):
+    """{(user_id, metric, granularity, bucket_start): [count, total, min, max]} for new readings."""
+    deltas = {}
+    for vital in vitals:
+        for metric in METRICS:
+            value = getattr(vital, metric)
+            if value is None:
+                continue
+            for granularity in GRANULARITIES:
+                key = (vital.user_id, metric, granularity, bucket_start(vital.date_recorded, granularity))
+                delta = deltas.get(key)
+                if delta is None:
+                    deltas[key] = [1, float(value), value, value]
+                else:
+                    delta[0] += 1
+                    delta[1] += value
+                    delta[2] = min(delta[2], value)
+                    delta[3] = max(delta[3], value)
+    return deltas
+
+
+def add_readings(vitals):
+    """Count newly inserted readings into their rollups. Returns how many buckets moved."""
+    rows = [(*key, *delta) for key, delta in sorted(reading_deltas(vitals).items())]
+    if not rows:
+        return 0
+    table = connection.ops.quote_name(VitalSignRollup._meta.db_table)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            values = ', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s, now())'] * len(batch))
+            cursor.execute(f"""
+                INSERT INTO {table} AS rollup
+                    (user_id, metric, granularity, bucket_start, count, total, min_value, max_value, updated_at)
+                VALUES {values}
+                ON CONFLICT (user_id, metric, granularity, bucket_start) DO UPDATE SET
+                    count = rollup.count + EXCLUDED.count,
+                    total = rollup.total + EXCLUDED.total,
+                    min_value = LEAST(rollup.min_value, EXCLUDED.min_value),
+                    max_value = GREATEST(rollup.max_value, EXCLUDED.max_value),
+                    updated_at = now()
+            """, [value for row in batch for value in row])
+    return len(rows)
+
+
+def _aggregate(vitals, granularity):
+    """Rollups for a VitalSign queryset at one granularity, all metrics in one query."""
+    aggregates = {}
+    for metric in METRICS:
+        aggregates.update({
+            f'{metric}_count': Count(metric), f'{metric}_total': Sum(metric),
+            f'{metric}_min': Min(metric), f'{metric}_max': Max(metric),
+        })
+    rows = (
+        vitals.annotate(bucket=Trunc('date_recorded', granularity, tzinfo=timezone.get_current_timezone()))
+        .values('user_id', 'bucket').annotate(**aggregates).order_by()
+    )
+    rollups = []
+    for row in rows:
+        for metric in METRICS:
+            if row[f'{metric}_count']:
+                rollups.append(VitalSignRollup(
+                    user_id=row['user_id'], metric=metric, granularity=granularity, bucket_start=row['bucket'],
+                    count=row[f'{metric}_count'], total=row[f'{metric}_total'],
+                    min_value=row[f'{metric}_min'], max_value=row[f'{metric}_max'],
+                ))
+    return rollups
+
+
+def refresh_buckets(user_id, moments):
+    """
+    Recompute, from the raw readings, every bucket of the user's that contains
+    one of `moments`. Buckets are upserted in place, so a reading added to
+    one meanwhile cannot collide with a delete-and-reinsert.
+    """
+    with transaction.atomic():
+        for granularity in GRANULARITIES:
+            starts = {bucket_start(moment, granularity) for moment in moments}
+            ranges = Q()
+            for start in starts:
+                ranges |= Q(date_recorded__gte=start, date_recorded__lt=start + BUCKET_LENGTH[granularity])
+            rollups = VitalSignRollup.objects.bulk_create(
+                _aggregate(VitalSign.objects.filter(ranges, user_id=user_id), granularity),
+                update_conflicts=True,
+                unique_fields=['user', 'metric', 'granularity', 'bucket_start'],
+                update_fields=['count', 'total', 'min_value', 'max_value', 'updated_at'],
+            )
+            # Buckets whose last reading of a metric was deleted or moved away
+            VitalSignRollup.objects.filter(
+                user_id=user_id, granularity=granularity, bucket_start__in=starts
+            ).exclude(pk__in=[rollup.pk for rollup in rollups]).delete()
+
+
+def rebuild_vital_rollups():
+    """Recompute every rollup from VitalSign (backfill or repair). Returns how many rows were written."""
+    written = 0
+    with transaction.atomic():
+        VitalSignRollup.objects.all().delete()
+        for granularity in GRANULARITIES:
+            rollups = _aggregate(VitalSign.objects.all(), granularity)
+            VitalSignRollup.objects.bulk_create(rollups, batch_size=UPSERT_BATCH_SIZE)
+            written += len(rollups)
+    logger.info(f"Rebuilt {written} vital sign rollups")
+    return written
+
+
+def chart_granularity(start, end, points):
+    """(granularity, buckets merged per point) giving at most `points` points between start and end."""
+    span = end - start
+    for granularity in GRANULARITIES:
+        if span / BUCKET_LENGTH[granularity] <= points:
+            return granularity, 1
+    return 'week', ceil(span / (BUCKET_LENGTH['week'] * points))
+
+
+def _point(start, count, total, min_value, max_value):
+    return {
+        'start': start,
+        'count': count,
+        'min': min_value,
+        'max': max_value,
+        'mean': round(total / count, 2),
+    }
+
+
+def chart_series(user, metrics, start, end, points=DEFAULT_CHART_POINTS, granularity=None):
+    """
+    Downsampled series per metric between `start` and `end`, read from the
+    rollups in one query. Returns (granularity, buckets per point, series).
+    """
+    if granularity is None:
+        granularity, factor = chart_granularity(start, end, points)
+    else:
+        factor = max(ceil((end - start) / (BUCKET_LENGTH[granularity] * points)), 1)
+    first = bucket_start(start, granularity)
+    step = BUCKET_LENGTH[granularity] * factor
+    rows = (
+        VitalSignRollup.objects.filter(
+            user=user, metric__in=metrics, granularity=granularity, bucket_start__gte=first, bucket_start__lt=end
+        )
+        .order_by('metric', 'bucket_start')
+        .values_list('metric', 'bucket_start', 'count', 'total', 'min_value', 'max_value')
+    )
+
+    merged = {metric: {} for metric in metrics}
+    for metric, start_at, count, total, min_value, max_value in rows:
+        point_start = first + step * ((start_at - first) // step)
+        point = merged[metric].get(point_start)
+        if point is None:
+            merged[metric][point_start] = [count, total, min_value, max_value]
+        else:
+            point[0] += count
+            point[1] += total
+            point[2] = min(point[2], min_value)
+            point[3] = max(point[3], max_value)
+    series = {
+        metric: [_point(point_start, *point) for point_start, point in buckets.items()]
+        for metric, buckets in merged.items()
+    }
+    return granularity, factor, series
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
     NotificationTemplate, Notification, NotificationDelivery,
-    NotificationPreference, NotificationSchedule
+    NotificationPreference, NotificationSchedule, AppointmentReminderJob
 )
 
 
@@ -52,3 +52,12 @@ class NotificationScheduleAdmin(admin.ModelAdmin):
     search_fields = ['user__email', 'template__name']
     readonly_fields = ['created_at', 'updated_at', 'last_sent_at', 'total_sent']
     date_hierarchy = 'created_at'
+
+
+@admin.register(AppointmentReminderJob)
+class AppointmentReminderJobAdmin(admin.ModelAdmin):
+    list_display = ['appointment', 'reminder_type', 'fire_at', 'status', 'sent_at']
+    list_filter = ['reminder_type', 'status']
+    search_fields = ['appointment__user__email']
+    readonly_fields = ['dispatch_id', 'claimed_at', 'sent_at', 'notification', 'channels', 'created_at', 'updated_at']
+    date_hierarchy = 'fire_at'
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from doctors.models import Appointment
+from notifications.models import AppointmentReminderJob
+from notifications.reminders import ACTIVE_STATUSES, build_reminder_jobs
+
+
+class Command(BaseCommand):
+    help = 'Create reminder jobs for upcoming appointments booked before event-driven scheduling existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        appointments = Appointment.objects.filter(
+            status__in=ACTIVE_STATUSES,
+            date__gte=timezone.localdate(now),
+        ).exclude(reminder_jobs__isnull=False).order_by('id')
+
+        jobs = []
+        for appointment in appointments.iterator(chunk_size=options['batch_size']):
+            jobs.extend(build_reminder_jobs(appointment, now=now))
+        AppointmentReminderJob.objects.bulk_create(jobs, batch_size=options['batch_size'], ignore_conflicts=True)
+        self.stdout.write(self.style.SUCCESS(f'Scheduled {len(jobs)} reminder jobs'))
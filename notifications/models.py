@@ -325,4 +325,62 @@ class NotificationSchedule(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
-        return f"{self.template.name} for {self.user.email} - {self.frequency}"
\ No newline at end of file
+        return f"{self.template.name} for {self.user.email} - {self.frequency}"
+
+class AppointmentReminderJob(models.Model):
+    """
+    A scheduled appointment reminder. Jobs are created when an appointment is
+    booked or rescheduled and claimed by the dispatcher once `fire_at` passes;
+    one row per appointment and lead time doubles as the sent-reminder ledger.
+    """
+    REMINDER_TYPE_CHOICES = [
+        ('24h', '24 hours before'),
+        ('1h', '1 hour before'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('sent', 'Sent'),
+        ('expired', 'Expired'),
+        ('failed', 'Failed'),
+    ]
+
+    appointment = models.ForeignKey(
+        'doctors.Appointment',
+        on_delete=models.CASCADE,
+        related_name='reminder_jobs'
+    )
+    reminder_type = models.CharField(max_length=10, choices=REMINDER_TYPE_CHOICES)
+    fire_at = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    dispatch_id = models.UUIDField(null=True, blank=True, help_text="Dispatcher run that claimed this job")
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    notification = models.ForeignKey(
+        Notification,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    # Per-channel outcome of the last attempt, e.g. {'email': 'sent', 'sms': 'failed', 'push': 'held'}
+    channels = models.JSONField(default=dict, blank=True)
+    attempts = models.PositiveIntegerField(default=0, help_text="Dispatches in which every channel failed")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('appointment', 'reminder_type')
+        ordering = ['fire_at']
+        indexes = [
+            # The dispatcher only ever scans jobs waiting to fire
+            models.Index(
+                fields=['fire_at'],
+                condition=models.Q(status__in=['pending', 'processing']),
+                name='reminder_job_due_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Reminder {self.reminder_type} for appointment {self.appointment_id} at {self.fire_at}"
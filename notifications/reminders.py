@@ -0,0 +1,374 @@
+# notifications/reminders.py
+"""
+Event-driven appointment reminders.
+
+Booking or rescheduling an appointment schedules one AppointmentReminderJob
+per lead time with a `fire_at` timestamp (see notifications/signals.py);
+cancelling it drops the jobs that have not fired. The dispatcher claims due
+jobs with SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers can
+share the queue, then bulk-loads users, preferences and push devices and fans
+email/SMS/push out over a thread pool. Work is proportional to the reminders
+actually due, not to the size of the appointment table.
+
+A job is only marked sent once a channel delivered it (or the user has every
+channel turned off, leaving the in-app notification). When every channel
+failed it goes back to pending with an exponential backoff, up to
+MAX_ATTEMPTS; when its channels were held back by quiet hours it is retried
+after QUIET_HOURS_RETRY. The in-app notification is created only once.
+"""
+import logging
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connections, transaction
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
+from push_notifications.models import GCMDevice as FCMDevice, APNSDevice
+
+from doctors.models import Appointment
+from .models import AppointmentReminderJob, Notification, NotificationPreference
+
+logger = logging.getLogger(__name__)
+
+# Most specific lead time first: an appointment booked less than an hour
+# ahead only gets the 1h reminder, never a late 24h one as well.
+REMINDER_LEAD_TIMES = [
+    ('1h', timedelta(hours=1)),
+    ('24h', timedelta(hours=24)),
+]
+
+ACTIVE_STATUSES = [
+    Appointment.StatusChoices.SCHEDULED,
+    Appointment.StatusChoices.CONFIRMED,
+]
+
+DISPATCH_WORKERS = getattr(settings, 'REMINDER_DISPATCH_WORKERS', 16)
+DISPATCH_BATCH_SIZE = getattr(settings, 'REMINDER_DISPATCH_BATCH_SIZE', 500)
+EMAIL_BATCH_SIZE = getattr(settings, 'REMINDER_EMAIL_BATCH_SIZE', 100)
+# A job left in 'processing' this long is assumed orphaned by a dead worker
+CLAIM_TIMEOUT = timedelta(minutes=10)
+# Retries after every channel failed: RETRY_BACKOFF, then doubling each time
+RETRY_BACKOFF = timedelta(minutes=5)
+MAX_ATTEMPTS = 5
+QUIET_HOURS_RETRY = timedelta(minutes=15)
+
+_twilio_client = None
+
+
+def _get_twilio_client():
+    global _twilio_client
+    if _twilio_client is None:
+        account_sid = getattr(settings, 'TWILIO_ACCOUNT_SID', None)
+        auth_token = getattr(settings, 'TWILIO_AUTH_TOKEN', None)
+        if not (account_sid and auth_token and getattr(settings, 'TWILIO_PHONE_NUMBER', None)):
+            return None
+        from twilio.rest import Client
+        _twilio_client = Client(account_sid, auth_token)
+    return _twilio_client
+
+
+def _push_configured():
+    push_settings = getattr(settings, 'PUSH_NOTIFICATIONS_SETTINGS', {})
+    return bool(
+        push_settings.get('FCM_API_KEY')
+        or push_settings.get('FCM_SERVICE_ACCOUNT_KEY')
+        or push_settings.get('APNS_CERTIFICATE')
+    )
+
+
+def _appointment_start(appointment):
+    # Fields may still hold the raw strings they were assigned before save()
+    date = Appointment._meta.get_field('date').to_python(appointment.date)
+    start_time = Appointment._meta.get_field('start_time').to_python(appointment.start_time)
+    return timezone.make_aware(datetime.combine(date, start_time))
+
+
+def build_reminder_jobs(appointment, now=None):
+    """Unsaved reminder jobs for an active, upcoming appointment."""
+    now = now or timezone.now()
+    if appointment.status not in ACTIVE_STATUSES:
+        return []
+    start = _appointment_start(appointment)
+    starts_in = start - now
+    jobs = []
+    previous_lead = timedelta(0)
+    for reminder_type, lead in REMINDER_LEAD_TIMES:
+        # Skip lead times already covered by a more specific reminder
+        if starts_in > previous_lead:
+            jobs.append(AppointmentReminderJob(
+                appointment=appointment,
+                reminder_type=reminder_type,
+                fire_at=max(start - lead, now),
+            ))
+        previous_lead = lead
+    return jobs
+
+
+def schedule_appointment_reminders(appointment, now=None):
+    """
+    (Re)schedule the reminder jobs for one appointment. Called on booking and
+    on any change of date, time or status; cancelled or completed
+    appointments just lose their jobs.
+    """
+    AppointmentReminderJob.objects.filter(appointment=appointment).exclude(status='sent').delete()
+    jobs = build_reminder_jobs(appointment, now=now)
+    if jobs:
+        # A reschedule re-arms reminders that already fired for the old slot
+        AppointmentReminderJob.objects.bulk_create(
+            jobs,
+            update_conflicts=True,
+            unique_fields=['appointment', 'reminder_type'],
+            update_fields=['fire_at', 'status', 'dispatch_id', 'claimed_at', 'sent_at', 'notification', 'channels', 'attempts'],
+        )
+    return jobs
+
+
+def claim_due_jobs(now, dispatch_id, limit=DISPATCH_BATCH_SIZE):
+    """
+    Claim up to `limit` due jobs for this run. Rows locked by a concurrent
+    dispatcher are skipped rather than waited on, so workers never block each
+    other or double-send.
+    """
+    with transaction.atomic():
+        job_ids = list(
+            AppointmentReminderJob.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status='pending') | Q(status='processing', claimed_at__lt=now - CLAIM_TIMEOUT),
+                fire_at__lte=now,
+            )
+            .order_by('fire_at')
+            .values_list('id', flat=True)[:limit]
+        )
+        if job_ids:
+            AppointmentReminderJob.objects.filter(id__in=job_ids).update(
+                status='processing', dispatch_id=dispatch_id, claimed_at=now
+            )
+    return job_ids
+
+
+def _channel_state(user, prefs, channel):
+    """'enabled', 'disabled' by the user's settings, or 'held' until their quiet hours end."""
+    if not getattr(user, f'notify_appointment_reminder_{channel}', False):
+        return 'disabled'
+    if prefs is None:
+        return 'enabled'
+    if not getattr(prefs, f'{channel}_enabled') or not prefs.get_channel_preference('appointment', channel):
+        return 'disabled'
+    # Email is never intrusive; SMS and push wait for the user's quiet hours to end
+    return 'enabled' if channel == 'email' or prefs.should_send_now() else 'held'
+
+
+def _build_message(job):
+    appt = job.appointment
+    doctor_name = f"Dr. {appt.doctor.last_name}" if appt.doctor else "your doctor"
+    time_str = appt.start_time.strftime('%I:%M %p')
+    date_str = appt.date.strftime('%b %d, %Y')
+    return {
+        'doctor_name': doctor_name,
+        'subject': f"Appointment Reminder: {date_str} at {time_str}",
+        'text': f"Reminder: Appointment with {doctor_name} on {date_str} at {time_str}.",
+        'sms': f"VitaNips Reminder: Appt with {doctor_name} on {date_str} at {time_str}.",
+        'url': f"/appointments/{appt.id}",
+    }
+
+
+def _send_email_batch(sends):
+    """Send one chunk of (job, EmailMultiAlternatives) over a single SMTP connection."""
+    try:
+        with get_connection() as connection:
+            connection.send_messages([message for _, message in sends])
+        return [(job, 'sent') for job, _ in sends]
+    except Exception as e:
+        logger.error(f"Reminder email batch of {len(sends)} failed: {e}")
+        return [(job, 'failed') for job, _ in sends]
+
+
+def _send_sms(job, to, body):
+    try:
+        _get_twilio_client().messages.create(to=str(to), from_=settings.TWILIO_PHONE_NUMBER, body=body)
+        return job, 'sent'
+    except Exception as e:
+        logger.error(f"Reminder SMS for appointment {job.appointment_id} failed: {e}")
+        return job, 'failed'
+
+
+def _send_push(job, fcm_devices, apns_devices, title, body, extra):
+    sent = False
+    for device in fcm_devices:
+        try:
+            device.send_message(body, title=title, extra=extra)
+            sent = True
+        except Exception as e:
+            logger.error(f"FCM reminder push to device {device.id} failed: {e}")
+    for device in apns_devices:
+        try:
+            device.send_message(message={"title": title, "body": body}, extra=extra)
+            sent = True
+        except Exception as e:
+            logger.error(f"APNS reminder push to device {device.id} failed: {e}")
+    # FCM may deactivate stale devices from this worker thread; don't leak its connection
+    connections.close_all()
+    return job, 'sent' if sent else 'failed'
+
+
+def _send_reminders(jobs, now, summary):
+    """Deliver one claimed batch of jobs across all channels."""
+    user_ids = {job.appointment.user_id for job in jobs}
+    prefs = {p.user_id: p for p in NotificationPreference.objects.filter(user_id__in=user_ids)}
+    push_enabled = _push_configured()
+    fcm_by_user, apns_by_user = defaultdict(list), defaultdict(list)
+    if push_enabled:
+        for device in FCMDevice.objects.filter(user_id__in=user_ids, active=True):
+            fcm_by_user[device.user_id].append(device)
+        for device in APNSDevice.objects.filter(user_id__in=user_ids, active=True):
+            apns_by_user[device.user_id].append(device)
+    twilio_client = _get_twilio_client()
+
+    notifications = []
+    email_sends, sms_sends, push_sends = [], [], []
+    for job in jobs:
+        appt, user = job.appointment, job.appointment.user
+        message = _build_message(job)
+        user_prefs = prefs.get(user.id)
+        states = {channel: _channel_state(user, user_prefs, channel) for channel in ('email', 'sms', 'push')}
+        if job.notification_id is None:
+            # A retried job already has its in-app notification
+            notifications.append((job, Notification(
+                recipient=user,
+                title="Appointment Reminder",
+                verb=message['text'],
+                level='info',
+                category='appointment',
+                action_url=message['url'],
+                action_text="View Details",
+                sent_at=now,
+                metadata={
+                    'appointment_id': appt.id,
+                    'reminder_type': job.reminder_type,
+                    'doctor_name': message['doctor_name'],
+                },
+            )))
+
+        reachable = {
+            'email': bool(user.email),
+            'sms': bool(twilio_client and user.phone_number),
+            'push': bool(push_enabled and (fcm_by_user[user.id] or apns_by_user[user.id])),
+        }
+        for channel, state in states.items():
+            if reachable[channel] and state == 'held':
+                job.channels[channel] = 'held'
+        if reachable['email'] and states['email'] == 'enabled':
+            html = render_to_string('emails/appointment_reminder.html', {
+                'user': user, 'appointment': appt,
+                'doctor_name': message['doctor_name'], 'subject': message['subject'],
+            })
+            email = EmailMultiAlternatives(
+                subject=message['subject'], body=strip_tags(html),
+                from_email=settings.DEFAULT_FROM_EMAIL, to=[user.email],
+            )
+            email.attach_alternative(html, "text/html")
+            email_sends.append((job, email))
+        if reachable['sms'] and states['sms'] == 'enabled':
+            sms_sends.append((job, user.phone_number, message['sms']))
+        if reachable['push'] and states['push'] == 'enabled':
+            extra = {"type": "appointment_reminder", "appointment_id": appt.id, "url": message['url']}
+            push_sends.append((job, fcm_by_user[user.id], apns_by_user[user.id], "Appointment Reminder", message['text'], extra))
+
+    created = Notification.objects.bulk_create([notification for _, notification in notifications])
+    for (job, _), notification in zip(notifications, created):
+        job.notification = notification
+    summary['in_app'] += len(notifications)
+
+    with ThreadPoolExecutor(max_workers=DISPATCH_WORKERS) as pool:
+        email_futures = [
+            pool.submit(_send_email_batch, email_sends[i:i + EMAIL_BATCH_SIZE])
+            for i in range(0, len(email_sends), EMAIL_BATCH_SIZE)
+        ]
+        channel_futures = (
+            [('sms', pool.submit(_send_sms, *send)) for send in sms_sends]
+            + [('push', pool.submit(_send_push, *send)) for send in push_sends]
+        )
+        for future in email_futures:
+            for job, status in future.result():
+                job.channels['email'] = status
+                summary['email' if status == 'sent' else 'failed'] += 1
+        for channel, future in channel_futures:
+            job, status = future.result()
+            job.channels[channel] = status
+            summary[channel if status == 'sent' else 'failed'] += 1
+
+
+def _settle_job(job, now, summary):
+    """Mark a dispatched job sent, or put it back in the queue when nothing reached the user."""
+    outcomes = set(job.channels.values())
+    if 'sent' in outcomes or not outcomes:
+        # Nothing to wait for when the user turned every channel off: the in-app notification is it
+        job.status, job.sent_at = 'sent', now
+        return
+    if 'failed' not in outcomes:
+        # Only held back by quiet hours
+        job.status, job.fire_at = 'pending', now + QUIET_HOURS_RETRY
+        summary['retried'] += 1
+        return
+    job.attempts += 1
+    if job.attempts >= MAX_ATTEMPTS:
+        logger.error(f"Giving up appointment reminder job {job.id} after {job.attempts} failed attempts")
+        job.status = 'failed'
+        summary['given_up'] += 1
+        return
+    job.status, job.fire_at = 'pending', now + RETRY_BACKOFF * 2 ** (job.attempts - 1)
+    summary['retried'] += 1
+
+
+def dispatch_appointment_reminders(now=None, max_batches=20):
+    """
+    Claim and send due reminder jobs, batch by batch, until none are left
+    (or `max_batches` is reached). Safe to run on several workers at once.
+    Returns a per-channel summary.
+    """
+    now = now or timezone.now()
+    summary = {
+        'claimed': 0, 'expired': 0, 'in_app': 0, 'email': 0, 'sms': 0, 'push': 0, 'failed': 0,
+        'retried': 0, 'given_up': 0,
+    }
+
+    for _ in range(max_batches):
+        dispatch_id = uuid.uuid4()
+        job_ids = claim_due_jobs(now, dispatch_id)
+        if not job_ids:
+            break
+        jobs = list(
+            AppointmentReminderJob.objects.filter(id__in=job_ids, dispatch_id=dispatch_id)
+            .select_related('appointment__user', 'appointment__doctor')
+        )
+        summary['claimed'] += len(jobs)
+
+        # A backlog (e.g. workers were down) must not remind people about past appointments
+        due, expired = [], []
+        for job in jobs:
+            job.channels = {}
+            (due if _appointment_start(job.appointment) > now else expired).append(job)
+        if due:
+            _send_reminders(due, now, summary)
+        for job in due:
+            _settle_job(job, now, summary)
+        for job in expired:
+            job.status = 'expired'
+        summary['expired'] += len(expired)
+
+        AppointmentReminderJob.objects.bulk_update(
+            jobs, ['status', 'sent_at', 'notification', 'channels', 'attempts', 'fire_at'],
+            batch_size=DISPATCH_BATCH_SIZE
+        )
+        if len(job_ids) < DISPATCH_BATCH_SIZE:
+            break
+
+    if summary['claimed']:
+        logger.info(f"Appointment reminders dispatched: {summary}")
+    return summary
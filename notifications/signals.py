@@ -0,0 +1,31 @@
+# notifications/signals.py
+from django.db.models.signals import pre_save, post_save
+from django.dispatch import receiver
+from doctors.models import Appointment
+from .reminders import ACTIVE_STATUSES, schedule_appointment_reminders
+
+
+def _reminder_key(date, start_time, status):
+    # Fields may still hold the raw strings they were assigned before save()
+    date = Appointment._meta.get_field('date').to_python(date)
+    start_time = Appointment._meta.get_field('start_time').to_python(start_time)
+    return (date, start_time, status in ACTIVE_STATUSES)
+
+
+@receiver(pre_save, sender=Appointment)
+def remember_previous_appointment_slot(sender, instance, **kwargs):
+    """Stash the stored slot so post_save only reschedules reminders when it changed."""
+    instance._previous_reminder_key = None
+    if instance.pk:
+        previous = Appointment.objects.filter(pk=instance.pk).values('date', 'start_time', 'status').first()
+        if previous:
+            instance._previous_reminder_key = _reminder_key(**previous)
+
+
+@receiver(post_save, sender=Appointment)
+def schedule_reminders_on_booking(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_reminder_key', None)
+    if created or previous != _reminder_key(instance.date, instance.start_time, instance.status):
+        schedule_appointment_reminders(instance)
@@ -5,86 +5,29 @@ from django.core.mail import EmailMultiAlternatives
 from twilio.rest import Client
 from push_notifications.models import APNSDevice, GCMDevice
 import logging
-from datetime import timedelta, datetime
+from datetime import timedelta
 from .models import (
     Notification, NotificationDelivery, NotificationPreference,
     NotificationSchedule, NotificationTemplate
 )
-from doctors.models import Appointment
 from pharmacy.models import MedicationReminder
+from .reminders import dispatch_appointment_reminders
 
 logger = logging.getLogger(__name__)
 
 
 # ========== SCHEDULED REMINDER TASKS ==========
 
-@shared_task(bind=True, max_retries=3)
-def check_appointment_reminders(self):
-    """Check for upcoming appointments and send reminders"""
-    now = timezone.now()
-    now_date = now.date()
-    now_time = now.time()
-    
-    # 24-hour reminders
-    tomorrow = now + timedelta(hours=24)
-    tomorrow_date = tomorrow.date()
-    
-    # Get all confirmed appointments and filter in Python to combine date + start_time
-    all_appointments = Appointment.objects.filter(
-        status='confirmed',
-        date__gte=now_date,
-        date__lte=tomorrow_date
-    ).select_related('user', 'doctor')
-    
-    appointments_24h = []
-    for appointment in all_appointments:
-        # Combine date and start_time into a datetime
-        appointment_datetime = timezone.make_aware(
-            datetime.combine(appointment.date, appointment.start_time)
-        )
-        if now <= appointment_datetime <= tomorrow:
-            appointments_24h.append(appointment)
-    
-    for appointment in appointments_24h:
-        # Check if reminder already sent
-        existing = Notification.objects.filter(
-            recipient=appointment.user,
-            category='appointment',
-            metadata__appointment_id=appointment.id,
-            metadata__reminder_type='24h',
-            timestamp__gte=now - timedelta(hours=1)
-        ).exists()
-        
-        if not existing:
-            send_appointment_reminder.delay(appointment.id, reminder_type='24h')
-    
-    # 1-hour reminders
-    one_hour = now + timedelta(hours=1)
-    one_hour_date = one_hour.date()
-    
-    appointments_1h = []
-    for appointment in all_appointments:
-        # Combine date and start_time into a datetime
-        appointment_datetime = timezone.make_aware(
-            datetime.combine(appointment.date, appointment.start_time)
-        )
-        if now <= appointment_datetime <= one_hour:
-            appointments_1h.append(appointment)
-    
-    for appointment in appointments_1h:
-        existing = Notification.objects.filter(
-            recipient=appointment.user,
-            category='appointment',
-            metadata__appointment_id=appointment.id,
-            metadata__reminder_type='1h',
-            timestamp__gte=now - timedelta(minutes=30)
-        ).exists()
-        
-        if not existing:
-            send_appointment_reminder.delay(appointment.id, reminder_type='1h')
-    
-    logger.info(f"Checked appointment reminders: {len(appointments_24h)} 24h, {len(appointments_1h)} 1h")
-    return {'24h': len(appointments_24h), '1h': len(appointments_1h)}
+@shared_task(name="notifications.tasks.dispatch_appointment_reminders")
+def dispatch_appointment_reminders_task():
+    """Claim and send appointment reminder jobs whose fire_at has passed"""
+    return dispatch_appointment_reminders()
+
+
+@shared_task
+def check_appointment_reminders():
+    """Deprecated alias kept for existing beat entries; jobs are claimed with SKIP LOCKED so duplicate runs are harmless"""
+    return dispatch_appointment_reminders()
 
 
 @shared_task(bind=True, max_retries=3)
@@ -142,49 +85,6 @@ def process_scheduled_notifications(self):
 
 # ========== NOTIFICATION CREATION TASKS ==========
 
-@shared_task(bind=True, max_retries=3)
-def send_appointment_reminder(self, appointment_id, reminder_type='24h'):
-    """Send appointment reminder notification"""
-    try:
-        appointment = Appointment.objects.select_related(
-            'user', 'doctor'
-        ).get(id=appointment_id)
-        
-        # Combine date and start_time into a datetime
-        appointment_datetime = timezone.make_aware(
-            datetime.combine(appointment.date, appointment.start_time)
-        )
-        
-        # Create notification
-        notification = Notification.objects.create(
-            recipient=appointment.user,
-            title=f"Appointment Reminder - {reminder_type}",
-            verb=f"Your appointment with Dr. {appointment.doctor.user.get_full_name()} is in {reminder_type}",
-            level='info',
-            category='appointment',
-            action_url=f"/appointments/{appointment.id}",
-            action_text="View Details",
-            metadata={
-                'appointment_id': appointment.id,
-                'reminder_type': reminder_type,
-                'doctor_name': appointment.doctor.user.get_full_name(),
-                'appointment_time': appointment_datetime.isoformat(),
-            }
-        )
-        
-        # Queue delivery across channels
-        deliver_notification.delay(notification.id)
-        
-        return notification.id
-        
-    except Appointment.DoesNotExist:
-        logger.error(f"Appointment {appointment_id} not found")
-        return None
-    except Exception as e:
-        logger.error(f"Error sending appointment reminder: {e}")
-        self.retry(countdown=60, exc=e)
-
-
 @shared_task(bind=True, max_retries=3)
 def send_refill_reminder(self, reminder_id, days_remaining):
     """Send medication refill reminder"""
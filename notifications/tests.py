@@ -1,9 +1,17 @@
 # notifications/tests.py
+from datetime import datetime, timedelta
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.core import mail
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
-from .models import Notification
+from .models import Notification, AppointmentReminderJob
+from .reminders import dispatch_appointment_reminders
+from doctors.models import Doctor, Appointment
 
 
 User = get_user_model()
@@ -76,3 +84,93 @@ class NotificationAPITests(APITestCase):
 from django.test import TestCase
 
 # Create your tests here.
+
+
+class AppointmentReminderDispatchTests(TestCase):
+    def setUp(self):
+        self.doctor = Doctor.objects.create(
+            first_name="Ada", last_name="Obi", gender="F", education="MD",
+            bio="GP", languages_spoken="English"
+        )
+        self.count = 0
+
+    def _book(self, starts_in):
+        self.count += 1
+        user = User.objects.create_user(
+            email=f"patient{self.count}@example.com", username=f"patient{self.count}", password="password123"
+        )
+        start = timezone.now() + starts_in
+        return Appointment.objects.create(
+            user=user, doctor=self.doctor, date=start.date(), start_time=start.time(),
+            end_time=(start + timedelta(minutes=30)).time(), reason="Checkup",
+            status=Appointment.StatusChoices.CONFIRMED,
+        )
+
+    def _jobs(self, appointment):
+        return dict(AppointmentReminderJob.objects.filter(appointment=appointment).values_list('reminder_type', 'fire_at'))
+
+    def test_booking_schedules_jobs_for_each_lead_time(self):
+        soon = self._book(timedelta(minutes=40))
+        later = self._book(timedelta(hours=30))
+
+        self.assertEqual(set(self._jobs(soon)), {'1h'})
+        jobs = self._jobs(later)
+        start = timezone.make_aware(datetime.combine(later.date, later.start_time))
+        self.assertEqual(jobs['24h'], start - timedelta(hours=24))
+        self.assertEqual(jobs['1h'], start - timedelta(hours=1))
+
+    def test_reschedule_and_cancellation_update_pending_jobs(self):
+        appointment = self._book(timedelta(hours=30))
+        new_start = timezone.now() + timedelta(hours=50)
+        appointment.date, appointment.start_time = new_start.date(), new_start.time()
+        appointment.save()
+        self.assertEqual(
+            self._jobs(appointment)['1h'],
+            timezone.make_aware(datetime.combine(new_start.date(), new_start.time())) - timedelta(hours=1),
+        )
+
+        appointment.status = Appointment.StatusChoices.CANCELLED
+        appointment.save()
+        self.assertFalse(AppointmentReminderJob.objects.filter(appointment=appointment).exists())
+
+    def test_dispatch_sends_due_jobs_once(self):
+        soon = self._book(timedelta(minutes=40))
+        self._book(timedelta(hours=30))
+
+        summary = dispatch_appointment_reminders()
+        self.assertEqual(summary['claimed'], 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(AppointmentReminderJob.objects.get(appointment=soon).status, 'sent')
+        self.assertEqual(dispatch_appointment_reminders()['claimed'], 0)
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        from unittest.mock import patch
+        from .reminders import RETRY_BACKOFF
+        appointment = self._book(timedelta(minutes=40))
+        now = timezone.now()
+
+        with patch('notifications.reminders.get_connection', side_effect=OSError('SMTP down')):
+            summary = dispatch_appointment_reminders(now=now)
+        job = AppointmentReminderJob.objects.get(appointment=appointment)
+        self.assertEqual(summary['retried'], 1)
+        self.assertEqual((job.status, job.attempts, job.channels), ('pending', 1, {'email': 'failed'}))
+        self.assertEqual(job.fire_at, now + RETRY_BACKOFF)
+        self.assertEqual(dispatch_appointment_reminders(now=now)['claimed'], 0)
+
+        dispatch_appointment_reminders(now=now + RETRY_BACKOFF)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'sent')
+        self.assertEqual(len(mail.outbox), 1)
+        # The retry does not add a second in-app notification
+        self.assertEqual(Notification.objects.filter(recipient=appointment.user, title="Appointment Reminder").count(), 1)
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        self._book(timedelta(hours=3))
+        with CaptureQueriesContext(connection) as small:
+            dispatch_appointment_reminders()
+        for _ in range(15):
+            self._book(timedelta(hours=3))
+        with CaptureQueriesContext(connection) as large:
+            summary = dispatch_appointment_reminders()
+        self.assertEqual(summary['claimed'], 15)
+        self.assertEqual(len(large), len(small))
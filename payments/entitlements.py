@@ -0,0 +1,174 @@
+# payments/entitlements.py
+"""
+Per-user subscription entitlements served from the cache.
+
+A snapshot combines the user's active plan (tier, limits, expiry) with their
+booking usage counters. The plan part is cached until it is invalidated by a
+UserSubscription change or the subscription period ends; the counters live in
+their own keys and are adjusted with atomic incr/decr as appointments are
+booked or cancelled (see payments/signals.py), so a booking check never has
+to recount the user's appointments. This relies on the default cache being
+shared by all processes (Redis, see CACHES in settings): with per-process
+memory every worker would keep its own counters.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import UserSubscription
+
+# Appointment states that consume a booking allowance
+COUNTED_APPOINTMENT_STATUSES = ('scheduled', 'confirmed', 'completed')
+
+PLAN_CACHE_TIMEOUT = 60 * 60
+COUNTER_CACHE_TIMEOUT = 60 * 60 * 24 * 35
+
+
+def _plan_key(user_id):
+    return f'entitlements:{user_id}:plan'
+
+
+def _lifetime_key(user_id):
+    return f'entitlements:{user_id}:bookings:lifetime'
+
+
+def _month_key(user_id, month):
+    return f'entitlements:{user_id}:bookings:{month}'
+
+
+def _generation_key(user_id):
+    return f'entitlements:{user_id}:bookings:generation'
+
+
+def _month_label(moment):
+    return timezone.localtime(moment).strftime('%Y-%m')
+
+
+@dataclass(frozen=True)
+class Entitlements:
+    tier: str
+    plan_name: Optional[str]
+    subscription_id: Optional[int]
+    expires_at: Optional[datetime]
+    monthly_appointment_limit: Optional[int]
+    lifetime_appointment_limit: Optional[int]
+    lifetime_bookings: int
+    bookings_this_month: int
+
+    @property
+    def has_premium(self):
+        return self.subscription_id is not None
+
+    @property
+    def appointment_limit(self):
+        """Limit that applies to this user, or None when unlimited."""
+        return self.monthly_appointment_limit if self.has_premium else self.lifetime_appointment_limit
+
+    @property
+    def appointment_usage(self):
+        return self.bookings_this_month if self.has_premium else self.lifetime_bookings
+
+    @property
+    def can_book_appointment(self):
+        limit = self.appointment_limit
+        return limit is None or self.appointment_usage < limit
+
+    @property
+    def appointment_limit_text(self):
+        if self.has_premium:
+            limit = self.monthly_appointment_limit
+            return f"{limit} appointments/month" if limit else "unlimited"
+        return f"{self.lifetime_appointment_limit} free lifetime appointments"
+
+
+def _load_plan(user_id, now):
+    subscription = UserSubscription.objects.filter(
+        user_id=user_id,
+        status='active',
+        current_period_end__gt=now,
+    ).select_related('plan').order_by('-created_at').first()
+    if not subscription:
+        return {'tier': 'free', 'plan_name': None, 'subscription_id': None, 'expires_at': None,
+                'monthly_appointment_limit': None}, PLAN_CACHE_TIMEOUT
+    timeout = min(PLAN_CACHE_TIMEOUT, int((subscription.current_period_end - now).total_seconds()))
+    return {
+        'tier': subscription.plan.tier,
+        'plan_name': subscription.plan.name,
+        'subscription_id': subscription.id,
+        'expires_at': subscription.current_period_end,
+        'monthly_appointment_limit': subscription.plan.max_appointments_per_month,
+    }, max(timeout, 1)
+
+
+def _count_bookings(user_id, now):
+    from doctors.models import Appointment
+    month_start = timezone.localtime(now).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return Appointment.objects.filter(
+        user_id=user_id, status__in=COUNTED_APPOINTMENT_STATUSES
+    ).aggregate(
+        lifetime=Count('id'),
+        this_month=Count('id', filter=Q(created_at__gte=month_start)),
+    )
+
+
+def get_entitlements(user, now=None):
+    """Return the user's Entitlements, rebuilding only the cache entries that are missing."""
+    now = now or timezone.now()
+    user_id = getattr(user, 'pk', user)
+    month_key = _month_key(user_id, _month_label(now))
+    generation_key = _generation_key(user_id)
+    cached = cache.get_many([_plan_key(user_id), _lifetime_key(user_id), month_key, generation_key])
+
+    plan = cached.get(_plan_key(user_id))
+    if plan is None:
+        plan, timeout = _load_plan(user_id, now)
+        cache.set(_plan_key(user_id), plan, timeout)
+
+    lifetime = cached.get(_lifetime_key(user_id))
+    this_month = cached.get(month_key)
+    if lifetime is None or this_month is None:
+        counts = _count_bookings(user_id, now)
+        lifetime, this_month = counts['lifetime'], counts['this_month']
+        cache.add(_lifetime_key(user_id), lifetime, COUNTER_CACHE_TIMEOUT)
+        cache.add(month_key, this_month, COUNTER_CACHE_TIMEOUT)
+        # A booking change that landed while we counted found no key to
+        # increment, so what was just added may be stale: drop it and let
+        # the next read recount
+        if cache.get(generation_key) != cached.get(generation_key):
+            cache.delete_many([_lifetime_key(user_id), month_key])
+
+    return Entitlements(
+        lifetime_appointment_limit=getattr(settings, 'FREEMIUM_APPOINTMENT_LIMIT', 3),
+        lifetime_bookings=lifetime,
+        bookings_this_month=this_month,
+        **plan,
+    )
+
+
+def record_booking_change(user_id, created_at, delta):
+    """
+    Adjust cached usage counters when an appointment starts (+1) or stops (-1)
+    counting against the user's allowance. Counters that are not cached are
+    left alone; the next read recounts them. The generation is bumped first
+    so a read that is counting meanwhile discards its result.
+    """
+    generation_key = _generation_key(user_id)
+    cache.add(generation_key, 0, COUNTER_CACHE_TIMEOUT)
+    try:
+        cache.incr(generation_key)
+    except ValueError:
+        pass
+    for key in (_lifetime_key(user_id), _month_key(user_id, _month_label(created_at))):
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            pass
+
+
+def invalidate_plan(user_id):
+    cache.delete(_plan_key(user_id))
@@ -0,0 +1,39 @@
+# payments/signals.py
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from doctors.models import Appointment
+from .entitlements import COUNTED_APPOINTMENT_STATUSES, invalidate_plan, record_booking_change
+from .models import UserSubscription
+
+
+@receiver(post_save, sender=UserSubscription)
+@receiver(post_delete, sender=UserSubscription)
+def invalidate_entitlements_on_subscription_change(sender, instance, **kwargs):
+    invalidate_plan(instance.user_id)
+    # A read racing this transaction may have re-cached the old plan
+    transaction.on_commit(lambda: invalidate_plan(instance.user_id))
+
+
+@receiver(pre_save, sender=Appointment)
+def remember_previous_appointment_status(sender, instance, **kwargs):
+    instance._previous_status = None
+    if instance.pk:
+        instance._previous_status = Appointment.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=Appointment)
+def count_booking_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    was_counted = not created and getattr(instance, '_previous_status', None) in COUNTED_APPOINTMENT_STATUSES
+    is_counted = instance.status in COUNTED_APPOINTMENT_STATUSES
+    if was_counted != is_counted:
+        delta = 1 if is_counted else -1
+        transaction.on_commit(lambda: record_booking_change(instance.user_id, instance.created_at, delta))
+
+
+@receiver(post_delete, sender=Appointment)
+def uncount_booking_on_delete(sender, instance, **kwargs):
+    if instance.status in COUNTED_APPOINTMENT_STATUSES:
+        transaction.on_commit(lambda: record_booking_change(instance.user_id, instance.created_at, -1))
@@ -13,6 +13,7 @@ from .models import (
     PharmacySubscription, PharmacySubscriptionRecord
 )
 from .services import flutterwave_service
+from .entitlements import get_entitlements, invalidate_plan
 from .commission_service import get_commission_breakdown
 import logging
 import uuid
@@ -91,6 +92,7 @@ class SubscribeView(APIView):
             user=request.user,
             status='active'
         ).update(status='cancelled', cancelled_at=timezone.now())
+        invalidate_plan(request.user.id)  # update() bypasses the post_save hook
         
         # Create new subscription
         now = timezone.now()
@@ -180,29 +182,18 @@ class CheckSubscriptionStatusView(APIView):
     
     def get(self, request):
         try:
-            subscription = UserSubscription.objects.filter(
-                user=request.user,
-                status='active'
-            ).select_related('plan').first()
+            entitlements = get_entitlements(request.user)
             
-            if subscription and subscription.is_active:
+            if entitlements.has_premium:
                 return Response({
                     'has_premium': True,
-                    'plan': subscription.plan.tier,
-                    'plan_name': subscription.plan.name,
-                    'expires_at': subscription.current_period_end
+                    'plan': entitlements.tier,
+                    'plan_name': entitlements.plan_name,
+                    'expires_at': entitlements.expires_at
                 })
             else:
-                # Calculate remaining free appointments
-                # Count lifetime appointments for this user
-                from doctors.models import Appointment
-                from django.conf import settings
-                
-                appointment_count = Appointment.objects.filter(
-                    user=request.user
-                ).count()
-                
-                free_limit = getattr(settings, 'FREEMIUM_APPOINTMENT_LIMIT', 3)
+                free_limit = entitlements.lifetime_appointment_limit
+                appointment_count = entitlements.lifetime_bookings
                 remaining = max(0, free_limit - appointment_count)
                 
                 return Response({
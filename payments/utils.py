@@ -4,8 +4,7 @@ Utility functions for subscription, premium feature checks, and payment processi
 """
 import requests
 from django.conf import settings
-from .models import UserSubscription
-from django.utils import timezone
+from .entitlements import get_entitlements
 
 # Flutterwave API Configuration
 FLUTTERWAVE_SECRET_KEY = getattr(settings, 'FLUTTERWAVE_SECRET_KEY', 'FLWSECK_TEST-SANDBOX')
@@ -195,23 +194,12 @@ def initiate_split_payment(email, amount, reference, subaccount_id, commission_p
 
 def user_has_premium(user):
     """Check if user has active premium subscription"""
-    subscription = UserSubscription.objects.filter(
-        user=user,
-        status='active'
-    ).first()
-    return subscription and subscription.is_active
+    return get_entitlements(user).has_premium
 
 
 def get_user_subscription_tier(user):
     """Get user's current subscription tier"""
-    subscription = UserSubscription.objects.filter(
-        user=user,
-        status='active'
-    ).first()
-    
-    if subscription and subscription.is_active:
-        return subscription.plan.tier
-    return 'free'
+    return get_entitlements(user).tier
 
 
 def user_can_book_appointment(user):
@@ -220,36 +208,4 @@ def user_can_book_appointment(user):
     Free tier: Max 3 lifetime consultations.
     Premium/Family: Unlimited (or plan limit).
     """
-    subscription = UserSubscription.objects.filter(
-        user=user,
-        status='active'
-    ).first()
-    
-    from doctors.models import Appointment
-    
-    # Count ALL completed or scheduled appointments (excluding cancelled)
-    total_appointments = Appointment.objects.filter(
-        user=user,
-        status__in=['scheduled', 'confirmed', 'completed']
-    ).count()
-    
-    if not subscription or not subscription.is_active:
-        # Free tier - check lifetime limit
-        free_limit = getattr(settings, 'FREEMIUM_APPOINTMENT_LIMIT', 3)
-        return total_appointments < free_limit
-    else:
-        # Premium - check plan limits
-        max_appointments = subscription.plan.max_appointments_per_month
-        if max_appointments is None:
-            return True  # Unlimited
-        
-        # Check monthly limit for premium plans that have limits
-        month_start = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        appointments_this_month = Appointment.objects.filter(
-            user=user,
-            created_at__gte=month_start,
-            status__in=['scheduled', 'confirmed', 'completed']
-        ).count()
-        
-        return appointments_this_month < max_appointments
-
+    return get_entitlements(user).can_book_appointment
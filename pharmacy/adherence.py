@@ -0,0 +1,234 @@
+# pharmacy/adherence.py
+"""
+Medication adherence rollups (MedicationAdherenceDay).
+
+Every MedicationLog write moves the taken/missed/skipped counters of its
+reminder's rollup row for the local day of the dose, in the same transaction
+(see pharmacy/signals.py). A dose logged after it was marked missed replaces
+the missed log. Counters are moved by single INSERT ... ON
+CONFLICT / UPDATE statements, so concurrent logs for the same day add up
+instead of overwriting each other. A nightly pass logs the previous day's
+scheduled doses that nobody logged as missed, in bulk, and adherence
+history is served from the rollups alone.
+"""
+import logging
+from datetime import datetime, time, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import MedicationAdherenceDay, MedicationLog, MedicationReminder
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ('taken', 'missed', 'skipped')
+MISSED_BATCH_SIZE = 1000
+GRANULARITIES = ('day', 'week', 'month')
+MAX_HISTORY_DAYS = 366 * 2
+
+
+def local_day(value):
+    return timezone.localtime(value).date()
+
+
+def _values(rows, template):
+    return ', '.join([template] * len(rows)), [value for row in rows for value in row]
+
+
+def apply_adherence_deltas(deltas):
+    """
+    Add `deltas` ({(reminder_id, day): {status: count}}) to the rollups.
+    Increments create missing rows; decrements only ever apply to rows that
+    counted the log being undone and never take a counter below zero.
+    """
+    increments, decrements = [], []
+    for (reminder_id, day), counts in sorted(deltas.items()):
+        up = [max(counts.get(status, 0), 0) for status in STATUSES]
+        down = [max(-counts.get(status, 0), 0) for status in STATUSES]
+        if any(up):
+            increments.append((reminder_id, day, *up))
+        if any(down):
+            decrements.append((reminder_id, day, *down))
+
+    table = connection.ops.quote_name(MedicationAdherenceDay._meta.db_table)
+    reminder_table = connection.ops.quote_name(MedicationReminder._meta.db_table)
+    with connection.cursor() as cursor:
+        if increments:
+            values, params = _values(increments, '(%s, %s::date, %s, %s, %s)')
+            cursor.execute(f"""
+                INSERT INTO {table} AS rollup (reminder_id, user_id, day, taken, missed, skipped, updated_at)
+                SELECT r.id, r.user_id, v.day, v.taken, v.missed, v.skipped, now()
+                FROM (VALUES {values}) AS v (reminder_id, day, taken, missed, skipped)
+                JOIN {reminder_table} r ON r.id = v.reminder_id
+                ON CONFLICT (reminder_id, day) DO UPDATE SET
+                    taken = rollup.taken + EXCLUDED.taken,
+                    missed = rollup.missed + EXCLUDED.missed,
+                    skipped = rollup.skipped + EXCLUDED.skipped,
+                    updated_at = now()
+            """, params)
+        if decrements:
+            values, params = _values(decrements, '(%s, %s::date, %s, %s, %s)')
+            cursor.execute(f"""
+                UPDATE {table} AS rollup SET
+                    taken = GREATEST(rollup.taken - v.taken, 0),
+                    missed = GREATEST(rollup.missed - v.missed, 0),
+                    skipped = GREATEST(rollup.skipped - v.skipped, 0),
+                    updated_at = now()
+                FROM (VALUES {values}) AS v (reminder_id, day, taken, missed, skipped)
+                WHERE rollup.reminder_id = v.reminder_id AND rollup.day = v.day
+            """, params)
+
+
+def log_deltas(reminder_id, scheduled_time, status, sign=1):
+    return {(reminder_id, local_day(scheduled_time)): {status: sign}}
+
+
+def _merge(*deltas):
+    merged = {}
+    for delta in deltas:
+        for key, counts in delta.items():
+            target = merged.setdefault(key, {})
+            for status, count in counts.items():
+                target[status] = target.get(status, 0) + count
+    return merged
+
+
+def record_log_change(previous, log, deleted=False):
+    """
+    Move the rollups for a MedicationLog that was created (previous is None),
+    edited (previous holds the stored reminder_id, scheduled_time and status)
+    or deleted.
+    """
+    if deleted:
+        apply_adherence_deltas(log_deltas(log.reminder_id, log.scheduled_time, log.status, -1))
+        return
+    deltas = [log_deltas(log.reminder_id, log.scheduled_time, log.status)]
+    if previous is not None:
+        deltas.append(log_deltas(previous['reminder_id'], previous['scheduled_time'], previous['status'], -1))
+    apply_adherence_deltas(_merge(*deltas))
+    if log.status != 'missed':
+        _drop_superseded_missed_logs(log)
+
+
+def _drop_superseded_missed_logs(log):
+    """
+    A dose logged as taken or skipped after it was marked missed (usually by
+    the nightly pass) replaces the missed log; deleting it takes it back off
+    the missed counter (update_adherence_on_log_delete) so the dose is not
+    counted twice.
+    """
+    MedicationLog.objects.filter(
+        reminder_id=log.reminder_id, scheduled_time=log.scheduled_time, status='missed'
+    ).exclude(pk=log.pk).delete()
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def mark_missed_doses(day, batch_size=MISSED_BATCH_SIZE):
+    """
+    Log as missed every dose scheduled on `day` by a reminder that has no
+    log that day, and count them in the rollups. Safe to re-run. Returns how
+    many doses were marked.
+    """
+    start, end = day_bounds(day)
+    reminders = (
+        MedicationReminder.objects.filter(is_active=True, start_date__lte=day, created_at__lt=end)
+        .exclude(end_date__lt=day)
+        .order_by('id')
+    )
+    marked = 0
+    batch = []
+    for reminder in reminders.iterator(chunk_size=batch_size):
+        batch.append(reminder)
+        if len(batch) >= batch_size:
+            marked += _mark_missed_batch(batch, day, start, end)
+            batch = []
+    if batch:
+        marked += _mark_missed_batch(batch, day, start, end)
+    logger.info(f"Marked {marked} unlogged doses on {day} as missed")
+    return marked
+
+
+def _mark_missed_batch(reminders, day, start, end):
+    logged = set(
+        MedicationLog.objects.filter(
+            reminder_id__in=[reminder.id for reminder in reminders],
+            scheduled_time__gte=start, scheduled_time__lt=end,
+        ).values_list('reminder_id', flat=True)
+    )
+    missed = []
+    for reminder in reminders:
+        scheduled_time = reminder.occurrence_on(day)
+        if scheduled_time is None or reminder.id in logged:
+            continue
+        missed.append(MedicationLog(reminder=reminder, scheduled_time=scheduled_time, status='missed'))
+    if not missed:
+        return 0
+    with transaction.atomic():
+        # update_adherence_on_log_save never sees these logs; count them as missed in the same transaction
+        MedicationLog.objects.bulk_create(missed)
+        apply_adherence_deltas({(log.reminder_id, day): {'missed': 1} for log in missed})
+    return len(missed)
+
+
+def rebuild_adherence_rollups():
+    """Recount every rollup from MedicationLog (backfill or repair). Returns how many rows were written."""
+    counts = {}
+    for row in (
+        MedicationLog.objects.annotate(day=TruncDate('scheduled_time', tzinfo=timezone.get_current_timezone()))
+        .values('reminder_id', 'day', 'status').annotate(count=Count('id')).order_by()
+    ):
+        counts.setdefault((row['reminder_id'], row['day']), {})[row['status']] = row['count']
+    keys = list(counts)
+    with transaction.atomic():
+        MedicationAdherenceDay.objects.all().delete()
+        for start in range(0, len(keys), MISSED_BATCH_SIZE):
+            apply_adherence_deltas({key: counts[key] for key in keys[start:start + MISSED_BATCH_SIZE]})
+    return len(counts)
+
+
+def adherence_rate(taken, missed, skipped):
+    total = taken + missed + skipped
+    return round(taken / total, 4) if total else None
+
+
+def adherence_history(user, start, end, granularity='day', reminder_id=None):
+    """
+    Taken/missed/skipped totals per day, week or month between `start` and
+    `end` (inclusive) for the user's reminders, or one of them, read from the
+    rollups in a single query. Returns (series, totals).
+    """
+    rollups = MedicationAdherenceDay.objects.filter(user=user, day__gte=start, day__lte=end)
+    if reminder_id is not None:
+        rollups = rollups.filter(reminder_id=reminder_id)
+    if granularity == 'week':
+        rollups = rollups.annotate(period=TruncWeek('day'))
+    elif granularity == 'month':
+        rollups = rollups.annotate(period=TruncMonth('day'))
+    else:
+        rollups = rollups.annotate(period=F('day'))
+    rows = (
+        rollups.values('period')
+        .annotate(taken=Sum('taken'), missed=Sum('missed'), skipped=Sum('skipped'))
+        .order_by('period')
+    )
+
+    series = []
+    totals = dict.fromkeys(STATUSES, 0)
+    for row in rows:
+        series.append({
+            'period': row['period'],
+            'taken': row['taken'],
+            'missed': row['missed'],
+            'skipped': row['skipped'],
+            'adherence_rate': adherence_rate(row['taken'], row['missed'], row['skipped']),
+        })
+        for status in STATUSES:
+            totals[status] += row[status]
+    totals['adherence_rate'] = adherence_rate(totals['taken'], totals['missed'], totals['skipped'])
+    return series, totals
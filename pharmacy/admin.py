@@ -56,7 +56,7 @@ class MedicationAdmin(admin.ModelAdmin):
 
 @admin.register(PharmacyInventory)
 class PharmacyInventoryAdmin(admin.ModelAdmin):
-    list_display = ('pharmacy', 'medication', 'in_stock', 'quantity', 'price', 'last_updated')
+    list_display = ('pharmacy', 'medication', 'in_stock', 'quantity', 'reserved_quantity', 'price', 'last_updated')
     search_fields = ('pharmacy__name', 'medication__name', 'medication__generic_name')
     list_filter = ('in_stock', 'last_updated')
     ordering = ('-last_updated',)
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class PharmacyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pharmacy'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .inventory_feed import install_inventory_feed_triggers
+        post_migrate.connect(install_inventory_feed_triggers, sender=self)
@@ -0,0 +1,75 @@
+import json
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from urllib.parse import parse_qs
+from .order_events import REPLAY_LIMIT, events_since, pharmacy_group_name
+
+
+class PharmacyOrderConsumer(AsyncWebsocketConsumer):
+    """
+    Order queue for pharmacy staff. Every staff member of a pharmacy shares
+    one group. Connect with ?resume=<last event id> (or send
+    {"type": "resume", "token": <id>}) to replay missed events first; events
+    can arrive twice around a resume, so clients should skip ids they have.
+    A replay sends at most REPLAY_LIMIT events and ends with a "resumed"
+    message: on `has_more` resume again from the last id received, on
+    `reset` reload the order list instead.
+    """
+    async def connect(self):
+        user = self.scope["user"]
+        if user.is_anonymous or not user.is_pharmacy_staff or not user.works_at_pharmacy_id:
+            await self.close()
+            return
+
+        self.pharmacy_id = user.works_at_pharmacy_id
+        self.group_name = pharmacy_group_name(self.pharmacy_id)
+
+        # Join before replaying so nothing published in between is lost
+        await self.channel_layer.group_add(
+            self.group_name,
+            self.channel_name
+        )
+        await self.accept()
+
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        if 'resume' in query:
+            await self.replay(query['resume'][0])
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(
+                self.group_name,
+                self.channel_name
+            )
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            message = json.loads(text_data or '')
+        except ValueError:
+            return
+        if message.get('type') == 'resume':
+            await self.replay(message.get('token'))
+
+    async def replay(self, token):
+        try:
+            token = int(token)
+        except (TypeError, ValueError):
+            await self.send(text_data=json.dumps({'type': 'error', 'error': 'Invalid resume token.'}))
+            return
+        events = await database_sync_to_async(events_since)(self.pharmacy_id, token, REPLAY_LIMIT + 1)
+        if events is None:
+            # Too far behind: the client should reload the order list
+            await self.send(text_data=json.dumps({'type': 'resync_required'}))
+            await self.send(text_data=json.dumps({'type': 'resumed', 'count': 0, 'has_more': False, 'reset': True}))
+            return
+        has_more = len(events) > REPLAY_LIMIT
+        events = events[:REPLAY_LIMIT]
+        for event in events:
+            await self.send(text_data=json.dumps({'type': 'order_event', **event}))
+        await self.send(text_data=json.dumps({
+            'type': 'resumed', 'count': len(events), 'has_more': has_more, 'reset': False
+        }))
+
+    # Receive message from pharmacy group
+    async def order_event(self, event):
+        await self.send(text_data=json.dumps({'type': 'order_event', **event['event']}))
@@ -0,0 +1,87 @@
+# pharmacy/geocoding.py
+"""
+Background geocoding of pharmacy addresses.
+
+Pharmacy.save() no longer calls the provider; it queues the pharmacy for
+geocode_pharmacies_task once the write commits, and a periodic sweep picks up
+anything still missing a location (queueing failed, provider was down). Each
+batch geocodes every distinct address once through the shared cache and
+rate limiter in vitanips.core.geocoding and writes the results with one
+bulk update for the located pharmacies and one update for the rest.
+"""
+import logging
+from datetime import timedelta
+
+from django.contrib.gis.geos import Point
+from django.db.models import Q
+from django.utils import timezone
+
+from vitanips.core.geocoding import GeocodingError, TransientGeocodingError, geocode_address, get_geocoder, normalize_address
+from .models import Pharmacy
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+# Addresses that could not be located are retried after this long
+RETRY_AFTER = timedelta(days=1)
+
+
+def pharmacies_needing_geocoding(now=None, limit=BATCH_SIZE):
+    """Ids of pharmacies with an address but no location that are due another attempt."""
+    now = now or timezone.now()
+    return list(
+        Pharmacy.objects.filter(location__isnull=True)
+        .exclude(address='')
+        .filter(Q(geocode_attempted_at__isnull=True) | Q(geocode_attempted_at__lt=now - RETRY_AFTER))
+        .order_by('id').values_list('id', flat=True)[:limit]
+    )
+
+
+def geocode_pharmacies(pharmacy_ids, geocoder=None):
+    """
+    Geocode the given pharmacies that still lack a location. Returns
+    (located, pending): how many got a location and the ids left pending
+    by transient provider errors, which the caller should retry.
+    """
+    pharmacies = list(
+        Pharmacy.objects.filter(id__in=pharmacy_ids, location__isnull=True)
+        .exclude(address='').only('id', 'address')
+    )
+    if not pharmacies:
+        return 0, []
+
+    geocoder = geocoder or get_geocoder()
+    by_address = {}
+    for pharmacy in pharmacies:
+        by_address.setdefault(normalize_address(pharmacy.address), []).append(pharmacy)
+
+    now = timezone.now()
+    found, not_found, pending = [], [], []
+    for group in by_address.values():
+        try:
+            coordinates = geocode_address(group[0].address, geocoder=geocoder)
+        except TransientGeocodingError as e:
+            logger.warning(f"Geocoding deferred for pharmacies {[p.id for p in group]}: {e}")
+            pending.extend(p.id for p in group)
+            continue
+        except GeocodingError as e:
+            logger.error(f"Geocoding failed for pharmacies {[p.id for p in group]}: {e}")
+            coordinates = None
+        if coordinates is None:
+            not_found.extend(p.id for p in group)
+            continue
+        lat, lng = coordinates
+        for pharmacy in group:
+            # Point takes (x, y) which is (longitude, latitude)
+            pharmacy.location = Point(lng, lat, srid=4326)
+            pharmacy.geocode_attempted_at = now
+            found.append(pharmacy)
+
+    # Neither write goes through save(), so it does not queue another geocode, and
+    # both skip rows that were given a location (e.g. in the admin) meanwhile
+    unlocated = Pharmacy.objects.filter(location__isnull=True)
+    if found:
+        unlocated.bulk_update(found, ['location', 'geocode_attempted_at'])
+    if not_found:
+        unlocated.filter(pk__in=not_found).update(geocode_attempted_at=now)
+    return len(found), pending
@@ -0,0 +1,166 @@
+# pharmacy/inventory_feed.py
+"""
+Incremental change feed for a pharmacy's inventory.
+
+Every insert or update of a PharmacyInventory row takes the next value of one
+database sequence into `change_seq` and the id of the writing transaction
+into `change_xid`, and every delete writes a PharmacyInventoryTombstone
+stamped the same way. Both are done by triggers (installed after migrate), so
+bulk upserts, queryset updates, raw SQL and cascading deletes are covered
+along with ordinary saves.
+
+The feed is ordered by (change_xid, change_seq) and only serves changes of
+transactions older than the oldest one still running
+(pg_snapshot_xmin(pg_current_snapshot())). Those transactions have all
+finished, so nothing can later appear below a cursor: a long transaction,
+such as a bulk import or an order holding stock, delays the feed instead of
+having its rows skipped. Clients pass back an opaque cursor holding the
+position they have applied. A cursor older than the tombstone retention
+period, or from the earlier sequence-only format, gets `reset`, because
+deletions it would need may have been pruned.
+"""
+import base64
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import connection, connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import PharmacyInventory, PharmacyInventoryTombstone
+
+SEQUENCE_NAME = 'pharmacy_inventory_change_seq'
+TOMBSTONE_RETENTION = timedelta(days=30)
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 2000
+
+
+def install_inventory_feed_triggers(sender=None, using='default', **kwargs):
+    """post_migrate hook: create the change sequence and the inventory write/delete triggers."""
+    conn = connections[using]
+    if conn.vendor != 'postgresql':
+        return
+    inventory_table = PharmacyInventory._meta.db_table
+    tombstone_table = PharmacyInventoryTombstone._meta.db_table
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {SEQUENCE_NAME};")
+        cursor.execute(f"""
+            CREATE OR REPLACE FUNCTION {inventory_table}_stamp_change() RETURNS trigger AS $$
+            BEGIN
+                NEW.change_seq := nextval('{SEQUENCE_NAME}');
+                NEW.change_xid := pg_current_xact_id()::text::bigint;
+                -- Raw UPDATEs (stock reservations) bypass auto_now
+                NEW.last_updated := clock_timestamp();
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+        """)
+        cursor.execute(f"""
+            CREATE OR REPLACE FUNCTION {inventory_table}_tombstone() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO {tombstone_table} (inventory_id, pharmacy_id, medication_id, change_seq, change_xid, deleted_at)
+                VALUES (
+                    OLD.id, OLD.pharmacy_id, OLD.medication_id, nextval('{SEQUENCE_NAME}'),
+                    pg_current_xact_id()::text::bigint, clock_timestamp()
+                );
+                RETURN OLD;
+            END;
+            $$ LANGUAGE plpgsql;
+        """)
+        cursor.execute(f"DROP TRIGGER IF EXISTS {inventory_table}_stamp_change ON {inventory_table};")
+        cursor.execute(f"""
+            CREATE TRIGGER {inventory_table}_stamp_change
+            BEFORE INSERT OR UPDATE ON {inventory_table}
+            FOR EACH ROW EXECUTE FUNCTION {inventory_table}_stamp_change();
+        """)
+        cursor.execute(f"DROP TRIGGER IF EXISTS {inventory_table}_tombstone ON {inventory_table};")
+        cursor.execute(f"""
+            CREATE TRIGGER {inventory_table}_tombstone
+            AFTER DELETE ON {inventory_table}
+            FOR EACH ROW EXECUTE FUNCTION {inventory_table}_tombstone();
+        """)
+
+
+def encode_cursor(xid, seq, issued_at):
+    raw = f"{xid}:{seq}:{int(issued_at.timestamp())}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    (xid, seq, issued_at) for a cursor from encode_cursor; ValueError if
+    malformed. Cursors of the older seq:issued format decode with xid None.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        parts = raw.split(':')
+        if len(parts) == 2:
+            seq, issued = parts
+            return None, int(seq), datetime.fromtimestamp(int(issued), tz=dt_timezone.utc)
+        xid, seq, issued = parts
+        return int(xid), int(seq), datetime.fromtimestamp(int(issued), tz=dt_timezone.utc)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor.")
+
+
+def _visibility_horizon():
+    """
+    (oldest running transaction id, this transaction's id or None). Writes of
+    transactions below the first have all committed or rolled back; this
+    transaction's own writes are visible to it as well.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint, "
+            "pg_current_xact_id_if_assigned()::text::bigint"
+        )
+        return cursor.fetchone()
+
+
+def get_inventory_changes(pharmacy_id, cursor=None, limit=DEFAULT_LIMIT, now=None):
+    """
+    Changes for `pharmacy_id` after `cursor` (a token from a previous call,
+    or None for a full sync). Returns a dict with `changes` (PharmacyInventory
+    rows), `deleted` (tombstones), the next `cursor`, `has_more` and `reset`.
+    """
+    now = now or timezone.now()
+    after_xid, after_seq, reset = 0, 0, False
+    if cursor:
+        after_xid, after_seq, issued_at = decode_cursor(cursor)
+        if after_xid is None or issued_at < now - TOMBSTONE_RETENTION:
+            after_xid, after_seq, reset = 0, 0, True
+    full_sync = (after_xid, after_seq) == (0, 0)
+
+    horizon_xid, own_xid = _visibility_horizon()
+    finished = Q(change_xid__lt=horizon_xid)
+    if own_xid is not None:
+        finished |= Q(change_xid=own_xid)
+    after = Q(change_xid__gt=after_xid) | Q(change_xid=after_xid, change_seq__gt=after_seq)
+
+    rows = list(
+        PharmacyInventory.objects.filter(finished, after, pharmacy_id=pharmacy_id)
+        .select_related('medication').order_by('change_xid', 'change_seq')[:limit + 1]
+    )
+    tombstones = []
+    if not full_sync:
+        tombstones = list(
+            PharmacyInventoryTombstone.objects.filter(finished, after, pharmacy_id=pharmacy_id)
+            .order_by('change_xid', 'change_seq')[:limit + 1]
+        )
+
+    merged = sorted(rows + tombstones, key=lambda item: (item.change_xid, item.change_seq))
+    has_more = len(merged) > limit
+    merged = merged[:limit]
+    position = (merged[-1].change_xid, merged[-1].change_seq) if merged else (after_xid, after_seq)
+    return {
+        'changes': [item for item in merged if isinstance(item, PharmacyInventory)],
+        'deleted': [item for item in merged if isinstance(item, PharmacyInventoryTombstone)],
+        'cursor': encode_cursor(*position, now),
+        'has_more': has_more,
+        'reset': reset,
+    }
+
+
+def prune_inventory_tombstones(now=None):
+    cutoff = (now or timezone.now()) - TOMBSTONE_RETENTION
+    deleted, _ = PharmacyInventoryTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
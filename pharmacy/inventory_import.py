@@ -0,0 +1,237 @@
+# pharmacy/inventory_import.py
+"""
+Bulk inventory import for the pharmacy portal.
+
+A price list is read row by row from a CSV or NDJSON stream, validated, mapped
+to Medication rows and upserted into PharmacyInventory in chunks: each chunk
+costs one medication lookup and one INSERT ... ON CONFLICT (pharmacy,
+medication) DO UPDATE, so only a chunk is ever held in memory.
+
+Recognised columns/keys:
+    medication_id    or  medication_name (+ optional strength)
+    price            required, >= 0
+    quantity         optional, defaults to 0
+    in_stock         optional, defaults to quantity > 0
+"""
+import codecs
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from .models import Medication, PharmacyInventory
+from .price_index import schedule_price_refresh
+
+FORMATS = ('csv', 'ndjson')
+DEFAULT_CHUNK_SIZE = 1000
+# Only the first errors are kept in the report; error_count still counts all of them
+MAX_REPORTED_ERRORS = 500
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'f'}
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(filename, default='csv'):
+    name = (filename or '').lower()
+    if name.endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def iter_rows(stream, fmt):
+    """Yield (line_number, row_dict) from a binary stream without reading it all."""
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'ndjson':
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_number, None
+                continue
+            yield line_number, row if isinstance(row, dict) else None
+    else:
+        raise ValueError(f"Unsupported format '{fmt}'. Use one of: {', '.join(FORMATS)}")
+
+
+def _clean(value):
+    return value.strip() if isinstance(value, str) else value
+
+
+def parse_row(row):
+    """Validate one raw row into a dict of typed values, or raise RowError."""
+    if row is None:
+        raise RowError("Row is not a valid JSON object.")
+
+    medication_id = _clean(row.get('medication_id'))
+    medication_name = _clean(row.get('medication_name'))
+    if medication_id not in (None, ''):
+        try:
+            medication_id = int(medication_id)
+        except (TypeError, ValueError):
+            raise RowError(f"Invalid medication_id '{medication_id}'.")
+    elif not medication_name:
+        raise RowError("Either medication_id or medication_name is required.")
+    else:
+        medication_id = None
+
+    try:
+        price = Decimal(str(_clean(row.get('price'))))
+        if not price.is_finite() or price < 0:
+            raise InvalidOperation
+    except (InvalidOperation, TypeError, ValueError):
+        raise RowError(f"Invalid price '{row.get('price')}'.")
+
+    quantity = _clean(row.get('quantity'))
+    try:
+        quantity = int(quantity) if quantity not in (None, '') else 0
+        if quantity < 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        raise RowError(f"Invalid quantity '{row.get('quantity')}'.")
+
+    in_stock = _clean(row.get('in_stock'))
+    if in_stock in (None, ''):
+        in_stock = quantity > 0
+    elif isinstance(in_stock, bool):
+        pass
+    elif str(in_stock).lower() in TRUE_VALUES:
+        in_stock = True
+    elif str(in_stock).lower() in FALSE_VALUES:
+        in_stock = False
+    else:
+        raise RowError(f"Invalid in_stock '{row.get('in_stock')}'.")
+
+    return {
+        'medication_id': medication_id,
+        'medication_name': medication_name,
+        'strength': _clean(row.get('strength')) or None,
+        'price': price,
+        'quantity': quantity,
+        'in_stock': in_stock,
+    }
+
+
+class InventoryImport:
+    """Accumulates the outcome of one import; see import_inventory."""
+
+    def __init__(self, pharmacy, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.pharmacy = pharmacy
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.upserted = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'upserted': self.upserted,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+    def run(self, rows):
+        chunk = []
+        for line, raw in rows:
+            self.rows += 1
+            try:
+                chunk.append((line, parse_row(raw)))
+            except RowError as e:
+                self.add_error(line, str(e))
+            if len(chunk) >= self.chunk_size:
+                self.flush(chunk)
+                chunk = []
+        if chunk:
+            self.flush(chunk)
+        return self
+
+    def _resolve(self, chunk):
+        """Map each parsed row to a medication id with at most two queries per chunk."""
+        ids = {row['medication_id'] for _, row in chunk if row['medication_id'] is not None}
+        names = {
+            Medication.normalize_name(row['medication_name'])
+            for _, row in chunk if row['medication_id'] is None
+        }
+        known_ids = set(Medication.objects.filter(pk__in=ids).values_list('pk', flat=True)) if ids else set()
+
+        by_name = {}
+        by_name_strength = {}
+        if names:
+            candidates = Medication.objects.annotate(name_lower=Lower('name')).filter(
+                name_lower__in=names
+            ).order_by('id').values_list('id', 'name_lower', 'strength')
+            for medication_id, name_lower, strength in candidates:
+                by_name.setdefault(name_lower, medication_id)
+                by_name_strength.setdefault((name_lower, (strength or '').strip().lower()), medication_id)
+
+        resolved = []
+        for line, row in chunk:
+            if row['medication_id'] is not None:
+                if row['medication_id'] not in known_ids:
+                    self.add_error(line, f"Medication {row['medication_id']} does not exist.")
+                    continue
+                medication_id = row['medication_id']
+            else:
+                name = Medication.normalize_name(row['medication_name'])
+                if row['strength']:
+                    medication_id = by_name_strength.get((name, row['strength'].lower()))
+                else:
+                    medication_id = by_name.get(name)
+                if medication_id is None:
+                    label = f"{row['medication_name']} {row['strength'] or ''}".strip()
+                    self.add_error(line, f"No medication matches '{label}'.")
+                    continue
+            resolved.append((medication_id, row))
+        return resolved
+
+    def flush(self, chunk):
+        # Later rows for the same medication win, as if the file were applied in order
+        latest = {}
+        for medication_id, row in self._resolve(chunk):
+            latest[medication_id] = row
+        if not latest:
+            return
+        objs = [
+            PharmacyInventory(
+                pharmacy=self.pharmacy,
+                medication_id=medication_id,
+                price=row['price'],
+                quantity=row['quantity'],
+                in_stock=row['in_stock'],
+            )
+            for medication_id, row in latest.items()
+        ]
+        with transaction.atomic():
+            PharmacyInventory.objects.bulk_create(
+                objs,
+                update_conflicts=True,
+                unique_fields=['pharmacy', 'medication'],
+                update_fields=['price', 'quantity', 'in_stock', 'last_updated'],
+            )
+            # One refresh for the chunk's medications stands in for the per-row post_save one
+            schedule_price_refresh(latest)
+        self.upserted += len(objs)
+
+
+def import_inventory(pharmacy, stream, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream `stream` (binary, CSV or NDJSON) into `pharmacy`'s inventory and return the report."""
+    return InventoryImport(pharmacy, chunk_size=chunk_size).run(iter_rows(stream, fmt))
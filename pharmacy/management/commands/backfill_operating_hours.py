@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from emergency.models import EmergencyService, EmergencyServiceOpeningInterval
+from pharmacy.models import Pharmacy, PharmacyOpeningInterval
+from vitanips.core.operating_hours import sync_opening_intervals
+
+
+class Command(BaseCommand):
+    help = 'Parse free-text operating_hours of pharmacies and emergency services into structured opening intervals'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        targets = (
+            ('pharmacies', Pharmacy, PharmacyOpeningInterval, 'pharmacy'),
+            ('emergency services', EmergencyService, EmergencyServiceOpeningInterval, 'service'),
+        )
+        for label, model, interval_model, owner_field in targets:
+            processed = unparsed = 0
+            batch = []
+            for owner in model.objects.only('id', 'operating_hours').order_by('id').iterator(chunk_size=batch_size):
+                batch.append(owner)
+                if len(batch) >= batch_size:
+                    unparsed += sync_opening_intervals(batch, interval_model, owner_field)
+                    processed += len(batch)
+                    batch = []
+            if batch:
+                unparsed += sync_opening_intervals(batch, interval_model, owner_field)
+                processed += len(batch)
+            self.stdout.write(self.style.SUCCESS(
+                f'Parsed operating hours for {processed} {label} ({unparsed} could not be parsed)'
+            ))
@@ -0,0 +1,84 @@
+import random
+import statistics
+import time
+
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from pharmacy.models import Pharmacy
+
+# Rough bounding box of Nigeria (lon_min, lat_min, lon_max, lat_max)
+BOUNDS = (2.7, 4.3, 14.6, 13.9)
+
+
+class Command(BaseCommand):
+    help = ('Compare radius search with KNN nearest-N search over synthetic pharmacies. '
+            'Everything runs in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pharmacies', type=int, default=100000, help='Synthetic pharmacies to insert')
+        parser.add_argument('--queries', type=int, default=200, help='Search points to time')
+        parser.add_argument('--nearest', type=int, default=10, help='N for the nearest-N search')
+        parser.add_argument('--radius', type=float, default=25, help='Radius (km) for the radius search')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            self._seed(rng, options['pharmacies'])
+            points = [self._random_point(rng) for _ in range(options['queries'])]
+
+            radius = D(km=options['radius'])
+            limit = options['nearest']
+            radius_times = self._time(points, lambda point: list(
+                Pharmacy.objects.filter(location__distance_lte=(point, radius))
+                .annotate(distance=Distance('location', point)).order_by('distance')[:limit]
+            ))
+            knn_times = self._time(points, lambda point: list(Pharmacy.objects.nearest(point, limit)))
+            filtered_knn_times = self._time(points, lambda point: list(
+                Pharmacy.objects.filter(offers_delivery=True, is_24_hours=True).nearest(point, limit)
+            ))
+            self._report(f'radius {options["radius"]}km, first {limit}', radius_times)
+            self._report(f'nearest {limit} (KNN)', knn_times)
+            self._report(f'nearest {limit} (KNN, delivery + 24h)', filtered_knn_times)
+            transaction.set_rollback(True)
+
+    def _random_point(self, rng):
+        lon_min, lat_min, lon_max, lat_max = BOUNDS
+        return Point(rng.uniform(lon_min, lon_max), rng.uniform(lat_min, lat_max), srid=4326)
+
+    def _seed(self, rng, count, batch_size=5000):
+        # bulk_create skips Pharmacy.save(), so no geocoding requests are made
+        for offset in range(0, count, batch_size):
+            Pharmacy.objects.bulk_create([
+                Pharmacy(
+                    name=f'Benchmark Pharmacy {offset + i}',
+                    address='Synthetic',
+                    phone_number='0000000000',
+                    operating_hours='9am-5pm',
+                    location=self._random_point(rng),
+                    offers_delivery=rng.random() < 0.5,
+                    is_24_hours=rng.random() < 0.2,
+                )
+                for i in range(min(batch_size, count - offset))
+            ])
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Pharmacy._meta.db_table}')
+        self.stdout.write(f'Inserted {count} synthetic pharmacies')
+
+    def _time(self, points, run):
+        timings = []
+        for point in points:
+            started = time.perf_counter()
+            run(point)
+            timings.append((time.perf_counter() - started) * 1000)
+        return sorted(timings)
+
+    def _report(self, label, timings):
+        p95 = timings[int(len(timings) * 0.95) - 1] if timings else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'{label}: mean {statistics.mean(timings):.2f}ms, '
+            f'median {statistics.median(timings):.2f}ms, p95 {p95:.2f}ms'
+        ))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from pharmacy.inventory_import import DEFAULT_CHUNK_SIZE, FORMATS, detect_format, import_inventory
+from pharmacy.models import Pharmacy
+
+
+class Command(BaseCommand):
+    help = 'Upsert a pharmacy\'s inventory from a CSV or NDJSON price list'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pharmacy_id', type=int)
+        parser.add_argument('path', help='CSV or NDJSON file')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Rows upserted per statement')
+
+    def handle(self, *args, **options):
+        try:
+            pharmacy = Pharmacy.objects.get(pk=options['pharmacy_id'])
+        except Pharmacy.DoesNotExist:
+            raise CommandError(f"Pharmacy {options['pharmacy_id']} does not exist")
+
+        fmt = options['format'] or detect_format(options['path'])
+        with open(options['path'], 'rb') as stream:
+            report = import_inventory(pharmacy, stream, fmt, chunk_size=options['chunk_size'])
+
+        for error in report.errors:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        if report.error_count > len(report.errors):
+            self.stderr.write(f"... {report.error_count - len(report.errors)} more errors")
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {report.rows} rows for {pharmacy.name}: {report.upserted} upserted, {report.error_count} errors'
+        ))
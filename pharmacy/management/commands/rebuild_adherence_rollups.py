@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from pharmacy.adherence import rebuild_adherence_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recount medication adherence rollups from MedicationLog (backfill after deploy, or to repair drift)'
+
+    def handle(self, *args, **options):
+        count = rebuild_adherence_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} medication adherence rollups'))
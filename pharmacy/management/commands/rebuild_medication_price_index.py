@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from pharmacy.price_index import rebuild_price_index, REBUILD_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Recompute every medication price summary (backfill after deploy, or to repair drift)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=REBUILD_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        count = rebuild_price_index(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt price summaries for {count} medications'))
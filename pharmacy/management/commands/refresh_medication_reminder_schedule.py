@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from pharmacy.models import MedicationReminder
+
+
+class Command(BaseCommand):
+    help = 'Recompute next_fire_at for all medication reminders (backfill after deploy or schedule logic changes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        batch_size = options['batch_size']
+        batch = []
+        updated = 0
+        for reminder in MedicationReminder.objects.order_by('id').iterator(chunk_size=batch_size):
+            reminder.refresh_next_fire_at(after=now)
+            batch.append(reminder)
+            if len(batch) >= batch_size:
+                updated += len(batch)
+                MedicationReminder.objects.bulk_update(batch, ['next_fire_at'])
+                batch = []
+        if batch:
+            updated += len(batch)
+            MedicationReminder.objects.bulk_update(batch, ['next_fire_at'])
+        self.stdout.write(self.style.SUCCESS(f'Refreshed next_fire_at for {updated} medication reminders'))
@@ -0,0 +1,93 @@
+# pharmacy/matching.py
+"""
+Rank nearby pharmacies by how much of a prescription they can fill.
+
+The prescription is reduced to a {medication_id: units needed} map (one unit
+per PrescriptionItem, as CreateOrderFromPrescriptionView orders them), and a
+single aggregate query over Pharmacy joined to PharmacyInventory scores every
+pharmacy in the search radius at once: the number of items it can fill from
+unreserved stock and what those items would cost there.
+"""
+from decimal import Decimal
+
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.measure import D
+from django.db.models import Case, DecimalField, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Lower
+from django.utils import timezone
+
+from .models import Medication, Pharmacy
+
+DEFAULT_RADIUS_KM = 10
+MAX_RADIUS_KM = 50
+DEFAULT_LIMIT = 20
+
+
+def required_medications(prescription):
+    """
+    Units needed per medication id. Items written before medications were
+    linked are matched to a Medication by case-insensitive name.
+    Returns (needed, unmatched_item_count).
+    """
+    items = list(prescription.items.values_list('medication_id', 'medication_name'))
+    unlinked = {
+        Medication.normalize_name(name)
+        for medication_id, name in items if medication_id is None and name
+    }
+    by_name = {}
+    if unlinked:
+        for medication_id, name_lower in (
+            Medication.objects.annotate(name_lower=Lower('name'))
+            .filter(name_lower__in=unlinked).order_by('id').values_list('id', 'name_lower')
+        ):
+            by_name.setdefault(name_lower, medication_id)
+
+    needed = {}
+    unmatched = 0
+    for medication_id, name in items:
+        medication_id = medication_id or by_name.get(Medication.normalize_name(name or ''))
+        if medication_id is None:
+            unmatched += 1
+            continue
+        needed[medication_id] = needed.get(medication_id, 0) + 1
+    return needed, unmatched
+
+
+def match_pharmacies(prescription, point, radius_km=DEFAULT_RADIUS_KM, limit=DEFAULT_LIMIT):
+    """
+    Pharmacies within `radius_km` of `point` that stock at least one item of
+    the prescription, annotated with `fillable_items`, `total_price` (for the
+    fillable items) and `distance`. Ordered by most items filled, then
+    cheapest, then nearest.
+    """
+    needed, _ = required_medications(prescription)
+    if not needed:
+        return Pharmacy.objects.none()
+
+    units = Case(
+        *[
+            When(inventory__medication_id=medication_id,
+                 inventory__quantity__gte=F('inventory__reserved_quantity') + count, then=Value(count))
+            for medication_id, count in needed.items()
+        ],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    money = DecimalField(max_digits=12, decimal_places=2)
+    return (
+        Pharmacy.objects.filter(is_active=True, location__distance_lte=(point, D(km=radius_km)))
+        .filter(Q(subscription_expiry__isnull=True) | Q(subscription_expiry__gte=timezone.now().date()))
+        # Join only the in-stock rows for the prescribed medications, not the whole catalog
+        .filter(inventory__medication_id__in=needed, inventory__in_stock=True)
+        .annotate(
+            fillable_items=Coalesce(Sum(units), 0),
+            total_price=Coalesce(
+                Sum(F('inventory__price') * units, output_field=money),
+                Value(Decimal('0.00')),
+                output_field=money,
+            ),
+            distance=Distance('location', point),
+        )
+        .filter(fillable_items__gt=0)
+        .order_by('-fillable_items', 'total_price', 'distance', 'pk')[:limit]
+    )
@@ -0,0 +1,148 @@
+# pharmacy/medication_search.py
+"""
+Medication catalog lookups: autocomplete, substring search and name matching.
+
+Autocomplete runs two index-backed stages: prefix matches on lower(name) /
+lower(generic_name) (text_pattern_ops btree), then, if the page is not full,
+typo-tolerant trigram word-similarity matches (gin_trgm_ops). Results are
+small dicts kept in a per-process LRU cache, so the repeated keystroke
+prefixes that dominate traffic never reach the database; the cache is
+cleared when a medication changes (see pharmacy/signals.py) and entries also
+expire after AUTOCOMPLETE_CACHE_TTL.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.functions import Greatest, Length, Lower
+
+from .models import Medication
+
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 25
+AUTOCOMPLETE_CACHE_SIZE = 5000
+AUTOCOMPLETE_CACHE_TTL = 300
+# Shorter terms have too few trigrams to be matched fuzzily
+FUZZY_MIN_LENGTH = 3
+# Minimum trigram word similarity of a fuzzy match, applied through
+# pg_trgm.word_similarity_threshold for the duration of the query
+FUZZY_THRESHOLD = 0.4
+
+RESULT_FIELDS = ('id', 'name', 'generic_name', 'strength', 'dosage_form', 'requires_prescription')
+
+
+class _LRUCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_autocomplete_cache = _LRUCache(AUTOCOMPLETE_CACHE_SIZE, AUTOCOMPLETE_CACHE_TTL)
+
+
+def clear_autocomplete_cache(**kwargs):
+    _autocomplete_cache.clear()
+
+
+def normalize_term(term):
+    return ' '.join((term or '').lower().split())
+
+
+def _with_lower_names(queryset):
+    return queryset.annotate(name_lower=Lower('name'), generic_lower=Lower('generic_name'))
+
+
+def _query_autocomplete(term, limit):
+    prefix = list(
+        _with_lower_names(Medication.objects.all())
+        .filter(Q(name_lower__startswith=term) | Q(generic_lower__startswith=term))
+        .order_by(Length('name'), 'name', 'id')
+        .values(*RESULT_FIELDS)[:limit]
+    )
+    if len(prefix) >= limit or len(term) < FUZZY_MIN_LENGTH:
+        return prefix
+
+    seen = [row['id'] for row in prefix]
+    with transaction.atomic():
+        # The indexed <% operator (trigram_word_similar) compares against this
+        # setting, not FUZZY_THRESHOLD; the default 0.6 would drop matches in
+        # [0.4, 0.6) before any filter of ours could see them
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)", [str(FUZZY_THRESHOLD)]
+            )
+        fuzzy = list(
+            _with_lower_names(Medication.objects.exclude(pk__in=seen))
+            .filter(Q(name_lower__trigram_word_similar=term) | Q(generic_lower__trigram_word_similar=term))
+            .annotate(similarity=Greatest(
+                TrigramWordSimilarity(term, 'name_lower'),
+                TrigramWordSimilarity(term, 'generic_lower'),
+            ))
+            .order_by('-similarity', Length('name'), 'id')
+            .values(*RESULT_FIELDS)[:limit - len(prefix)]
+        )
+    return prefix + fuzzy
+
+
+def autocomplete_medications(term, limit=AUTOCOMPLETE_LIMIT):
+    """Best matches for a partially typed medication name, prefix matches first."""
+    term = normalize_term(term)
+    if not term:
+        return []
+    limit = max(1, min(limit, AUTOCOMPLETE_MAX_LIMIT))
+    key = (term, limit)
+    results = _autocomplete_cache.get(key)
+    if results is None:
+        results = _query_autocomplete(term, limit)
+        _autocomplete_cache.set(key, results)
+    return results
+
+
+def search_medications(queryset, term):
+    """Substring filter on name/generic_name that the trigram indexes can serve."""
+    term = normalize_term(term)
+    if not term:
+        return queryset
+    return _with_lower_names(queryset).filter(
+        Q(name_lower__contains=term) | Q(generic_lower__contains=term)
+    )
+
+
+def find_or_create_medication(name, defaults):
+    """Case-insensitive get_or_create by name using the lower(name) index."""
+    name = name.strip()
+    medication = (
+        Medication.objects.annotate(name_lower=Lower('name'))
+        .filter(name_lower=Medication.normalize_name(name)).order_by('id').first()
+    )
+    if medication is None:
+        medication = Medication.objects.create(name=name, **defaults)
+    return medication
@@ -1,14 +1,60 @@
 # pharmacy/models.py
-from django.db import models
+from datetime import date, datetime, timedelta
+from django.db import models, transaction
 from django.conf import settings
+from django.utils import timezone
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db.models import F, FloatField, Func, Value
+from django.db.models.functions import Lower
 from django.contrib.gis.db import models as gis_models
-from django.contrib.gis.geos import Point
+from django.contrib.gis.db.models.functions import Distance
 from doctors.models import Prescription, PrescriptionItem
-import requests
+from vitanips.core.operating_hours import OpeningIntervalBase
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Nearest-N queries read this many index-ordered candidates per requested row
+# before re-ranking them by true (spheroidal) distance
+KNN_CANDIDATE_FACTOR = 4
+
+
+class KNNDistance(Func):
+    """
+    PostGIS `<->` operator. Ordering by it lets the planner walk the GiST
+    index on the geometry column nearest-first instead of scanning a radius.
+    The value is planar (degrees for SRID 4326), so use it for ordering only.
+    """
+    arg_joiner = ' <-> '
+    template = '%(expressions)s'
+    output_field = FloatField()
+
+
+class PharmacyQuerySet(models.QuerySet):
+    def nearest(self, point, limit):
+        """
+        The `limit` pharmacies in this queryset closest to `point`, annotated
+        with `distance` and ordered by it. Candidates come from a KNN index
+        scan; only those are measured exactly, so cost does not depend on how
+        far away the results are.
+        """
+        target = Value(point, output_field=gis_models.PointField(srid=point.srid or 4326))
+        candidates = self.filter(location__isnull=False).annotate(
+            knn=KNNDistance(F('location'), target)
+        ).order_by('knn').values('pk')[:limit * KNN_CANDIDATE_FACTOR]
+        return self.model.objects.filter(pk__in=candidates).annotate(
+            distance=Distance('location', point)
+        ).order_by('distance', 'pk')[:limit]
+
+
+def _enqueue_geocoding(pharmacy_id):
+    from .tasks import geocode_pharmacies_task
+    try:
+        geocode_pharmacies_task.delay([pharmacy_id])
+    except Exception as e:
+        logger.warning(f"Could not queue geocoding for pharmacy {pharmacy_id}: {e}")
+
+
 class Pharmacy(models.Model):
     name = models.CharField(max_length=200)
     address = models.TextField()
@@ -25,36 +71,21 @@ class Pharmacy(models.Model):
     bank_account_details = models.JSONField(default=dict, blank=True, help_text="Bank account details")
     commission_rate = models.DecimalField(max_digits=5, decimal_places=2, default=5.00, help_text="Platform commission percentage for this pharmacy")
     subscription_expiry = models.DateField(null=True, blank=True, help_text="Date when the pharmacy's registration expires")
+    geocode_attempted_at = models.DateTimeField(null=True, blank=True, editable=False, help_text="Last time background geocoding tried this address")
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    def save(self, *args, **kwargs):
-        # Automatic Geocoding if location is missing but address is present
-        if not self.location and self.address:
-            try:
-                api_key = getattr(settings, 'GOOGLE_MAPS_API_KEY', None)
-                if api_key:
-                    response = requests.get(
-                        'https://maps.googleapis.com/maps/api/geocode/json',
-                        params={'address': self.address, 'key': api_key}
-                    )
-                    data = response.json()
-                    
-                    if data.get('status') == 'OK' and data.get('results'):
-                        location = data['results'][0]['geometry']['location']
-                        lat = location['lat']
-                        lng = location['lng']
-                        # Point takes (x, y) which is (longitude, latitude)
-                        self.location = Point(lng, lat, srid=4326)
-                    else:
-                        logger.warning(f"Geocoding failed for pharmacy {self.name}: {data.get('status')}")
-                else:
-                    logger.warning("GOOGLE_MAPS_API_KEY not found in settings. Automatic geocoding skipped.")
-            except Exception as e:
-                logger.error(f"Error during automatic geocoding for pharmacy {self.name}: {e}")
+    objects = PharmacyQuerySet.as_manager()
 
+    def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
+        # Geocoding runs in the background (pharmacy.tasks.geocode_pharmacies_task)
+        # and fills `location` in when it finishes; the periodic sweep picks up
+        # anything this misses, e.g. when the broker is unavailable
+        if not self.location and self.address:
+            pharmacy_id = self.pk
+            transaction.on_commit(lambda: _enqueue_geocoding(pharmacy_id))
     
     def __str__(self):
         return self.name
@@ -62,6 +93,15 @@ class Pharmacy(models.Model):
     class Meta:
         verbose_name_plural = "Pharmacies"
 
+class PharmacyOpeningInterval(OpeningIntervalBase):
+    """Weekly opening interval parsed from Pharmacy.operating_hours (see vitanips/core/operating_hours.py)"""
+    pharmacy = models.ForeignKey(Pharmacy, on_delete=models.CASCADE, related_name='opening_intervals')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_minute', 'end_minute'], name='pharmacy_hours_range_idx'),
+        ]
+
 class Medication(models.Model):
     name = models.CharField(max_length=200)
     generic_name = models.CharField(max_length=200, blank=True, null=True)
@@ -76,9 +116,25 @@ class Medication(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # Case-insensitive equality and prefix lookups (see normalize_name
+            # and pharmacy/medication_search.py)
+            models.Index(OpClass(Lower('name'), name='text_pattern_ops'), name='medication_name_lower_idx'),
+            models.Index(OpClass(Lower('generic_name'), name='text_pattern_ops'), name='medication_generic_lower_idx'),
+            # Typo-tolerant and substring matching
+            GinIndex(OpClass(Lower('name'), name='gin_trgm_ops'), name='medication_name_trgm'),
+            GinIndex(OpClass(Lower('generic_name'), name='gin_trgm_ops'), name='medication_generic_trgm'),
+        ]
+
     def __str__(self):
         return f"{self.name} {self.strength} {self.dosage_form}"
 
+    @staticmethod
+    def normalize_name(name):
+        """Lookup key matching medication_name_lower_idx"""
+        return name.strip().lower()
+
 class PharmacyInventory(models.Model):
     pharmacy = models.ForeignKey(Pharmacy, on_delete=models.CASCADE, related_name='inventory')
     medication = models.ForeignKey(Medication, on_delete=models.CASCADE, related_name='inventories')
@@ -86,13 +142,63 @@ class PharmacyInventory(models.Model):
     quantity = models.PositiveIntegerField(default=0)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     last_updated = models.DateTimeField(auto_now=True)
+    change_seq = models.BigIntegerField(default=0, editable=False, help_text="Assigned by a database trigger on every write (see pharmacy/inventory_feed.py)")
+    change_xid = models.BigIntegerField(default=0, editable=False, help_text="Id of the transaction that last wrote the row, set by the same trigger")
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False, help_text="Units held by open orders (see pharmacy/reservations.py)")
     
     def __str__(self):
         return f"{self.pharmacy.name} - {self.medication.name} - {'In Stock' if self.in_stock else 'Out of Stock'}"
+
+    @property
+    def available_quantity(self):
+        return max(self.quantity - self.reserved_quantity, 0)
     
     class Meta:
         verbose_name_plural = "Pharmacy Inventories"
         unique_together = ('pharmacy', 'medication')
+        indexes = [
+            models.Index(fields=['pharmacy', 'change_xid', 'change_seq'], name='inventory_pharmacy_xid_seq_idx'),
+        ]
+
+class PharmacyInventoryTombstone(models.Model):
+    """
+    Written by a database trigger when a PharmacyInventory row is deleted, so
+    the change feed can tell clients to drop it. Plain id columns rather than
+    foreign keys: the pharmacy or medication may be deleted in the same
+    transaction.
+    """
+    inventory_id = models.BigIntegerField()
+    pharmacy_id = models.BigIntegerField()
+    medication_id = models.BigIntegerField()
+    change_seq = models.BigIntegerField()
+    change_xid = models.BigIntegerField(default=0)
+    deleted_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Deleted inventory {self.inventory_id} (pharmacy {self.pharmacy_id})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['pharmacy_id', 'change_xid', 'change_seq'], name='inv_tomb_pharmacy_xid_idx'),
+            models.Index(fields=['deleted_at'], name='inventory_tomb_deleted_idx'),
+        ]
+
+class MedicationPriceSummary(models.Model):
+    """
+    Price and availability of one medication across pharmacies that have it
+    in stock, kept current by pharmacy/price_index.py so price comparison is
+    a primary-key lookup instead of a scan of PharmacyInventory.
+    """
+    medication = models.OneToOneField(Medication, on_delete=models.CASCADE, primary_key=True, related_name='price_summary')
+    min_price = models.DecimalField(max_digits=10, decimal_places=2)
+    median_price = models.DecimalField(max_digits=10, decimal_places=2)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2)
+    pharmacy_count = models.PositiveIntegerField()
+    cheapest = models.JSONField(default=list, help_text="Cheapest pharmacies first: id, name, address, price, latitude, longitude")
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.medication.name}: {self.min_price}-{self.max_price} at {self.pharmacy_count} pharmacies"
 
 class MedicationOrder(models.Model):
     STATUS_CHOICES = (
@@ -136,6 +242,13 @@ class MedicationOrder(models.Model):
     pickup_or_delivery_date = models.DateTimeField(null=True, blank=True)
     notes = models.TextField(blank=True, null=True)
     
+    def save(self, *args, **kwargs):
+        # Status changes settle stock reservations in post_save (pharmacy/signals.py),
+        # which can refuse the change; keep the row and the stock in one transaction.
+        # Changing status with QuerySet.update() skips this and leaves stock held.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Order {self.id} - {self.user.email} - {self.status}"
 
@@ -156,13 +269,68 @@ class MedicationOrderItem(models.Model):
              return self.quantity * self.price_per_unit
         return None
 
+class StockReservation(models.Model):
+    """
+    Units of a PharmacyInventory row held for an order. A held reservation
+    counts towards PharmacyInventory.reserved_quantity until it is released
+    (order cancelled or hold expired) or committed (order completed, units
+    leave the shelf). See pharmacy/reservations.py.
+    """
+    class StatusChoices(models.TextChoices):
+        HELD = 'held', 'Held'
+        RELEASED = 'released', 'Released'
+        COMMITTED = 'committed', 'Committed'
+
+    order = models.ForeignKey(MedicationOrder, on_delete=models.CASCADE, related_name='reservations')
+    inventory = models.ForeignKey(PharmacyInventory, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=StatusChoices.choices, default=StatusChoices.HELD)
+    expires_at = models.DateTimeField(null=True, blank=True, help_text="Hold is released after this unless the order has progressed; empty means held until completion or cancellation")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Order {self.order_id} - {self.quantity} x inventory {self.inventory_id} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='reservation_status_exp_idx'),
+        ]
+
+class PharmacyOrderEvent(models.Model):
+    """
+    Append-only log of order events pushed to a pharmacy's staff over
+    WebSockets. The id doubles as the resume token a reconnecting client
+    sends to replay what it missed (see pharmacy/order_events.py).
+    """
+    class EventChoices(models.TextChoices):
+        CREATED = 'created', 'Order Created'
+        PAID = 'paid', 'Order Paid'
+        STATUS_CHANGED = 'status_changed', 'Status Changed'
+
+    pharmacy = models.ForeignKey(Pharmacy, on_delete=models.CASCADE, related_name='order_events')
+    order = models.ForeignKey(MedicationOrder, on_delete=models.CASCADE, related_name='events')
+    event = models.CharField(max_length=20, choices=EventChoices.choices)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.get_event_display()} - Order {self.order_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['pharmacy', 'id'], name='order_event_pharmacy_idx'),
+            models.Index(fields=['created_at'], name='order_event_created_idx'),
+        ]
+
 class MedicationReminder(models.Model):
-    FREQUENCY_CHOICES = (
-        ('daily', 'Daily'),
-        ('weekly', 'Weekly'),
-        ('monthly', 'Monthly'),
-        ('custom', 'Custom'),
-    )
+    class FrequencyChoices(models.TextChoices):
+        DAILY = 'daily', 'Daily'
+        WEEKLY = 'weekly', 'Weekly'
+        MONTHLY = 'monthly', 'Monthly'
+        CUSTOM = 'custom', 'Custom'
+
+    FREQUENCY_CHOICES = FrequencyChoices.choices
     
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='medication_reminders')
     medication = models.ForeignKey(Medication, on_delete=models.CASCADE, related_name='reminders')
@@ -171,12 +339,91 @@ class MedicationReminder(models.Model):
     end_date = models.DateField(null=True, blank=True)
     time_of_day = models.TimeField()
     frequency = models.CharField(max_length=10, choices=FREQUENCY_CHOICES)
-    custom_frequency = models.CharField(max_length=100, blank=True, null=True)
+    custom_frequency = models.CharField(max_length=100, blank=True, null=True, help_text="Interval in days for custom frequency")
     dosage = models.CharField(max_length=100)
     notes = models.TextField(blank=True, null=True)
     is_active = models.BooleanField(default=True)
+    next_fire_at = models.DateTimeField(null=True, blank=True, editable=False, help_text="Next scheduled occurrence; null when the schedule has ended")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # The dispatcher only ever range-scans active reminders by next occurrence
+            models.Index(fields=['next_fire_at'], condition=models.Q(is_active=True), name='med_reminder_next_fire_idx'),
+        ]
+
+    def _interval_days(self):
+        if self.frequency == self.FrequencyChoices.DAILY:
+            return 1
+        if self.frequency == self.FrequencyChoices.WEEKLY:
+            return 7
+        if self.frequency == self.FrequencyChoices.CUSTOM:
+            try:
+                days = int(self.custom_frequency)
+            except (TypeError, ValueError):
+                logger.warning(f"Invalid custom_frequency for reminder {self.pk}")
+                return None
+            return days if days > 0 else None
+        return None
+
+    def _occurrence_dates(self, from_date):
+        """Yield scheduled dates on or after from_date, in order."""
+        from_date = max(from_date, self.start_date)
+        if self.frequency == self.FrequencyChoices.MONTHLY:
+            # Months without the start day (e.g. the 31st) are skipped
+            year, month = from_date.year, from_date.month
+            for _ in range(48):
+                try:
+                    candidate = date(year, month, self.start_date.day)
+                except ValueError:
+                    candidate = None
+                if candidate and candidate >= from_date:
+                    yield candidate
+                year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+            return
+        interval = self._interval_days()
+        if not interval:
+            return
+        offset = -(-(from_date - self.start_date).days // interval) * interval
+        candidate = self.start_date + timedelta(days=offset)
+        while True:
+            yield candidate
+            candidate += timedelta(days=interval)
+
+    def compute_next_fire_at(self, after):
+        """First occurrence strictly after `after`, or None once the schedule has ended."""
+        after = timezone.localtime(after)
+        for day in self._occurrence_dates(after.date()):
+            if self.end_date and day > self.end_date:
+                return None
+            fire_at = timezone.make_aware(datetime.combine(day, self.time_of_day))
+            if fire_at > after:
+                return fire_at
+        return None
+
+    def occurrence_on(self, day):
+        """The scheduled dose time on `day`, or None if the reminder has no dose that day."""
+        if day < self.start_date or (self.end_date and day > self.end_date):
+            return None
+        for candidate in self._occurrence_dates(day):
+            if candidate == day:
+                return timezone.make_aware(datetime.combine(day, self.time_of_day))
+            break
+        return None
+
+    def refresh_next_fire_at(self, after=None):
+        self.next_fire_at = self.compute_next_fire_at(after or timezone.now()) if self.is_active else None
+        return self.next_fire_at
+
+    def save(self, *args, **kwargs):
+        # Any edit can move the schedule; keep the materialized next occurrence in step
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'next_fire_at' not in update_fields:
+            self.refresh_next_fire_at()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'next_fire_at'}
+        super().save(*args, **kwargs)
     
 class MedicationLog(models.Model):
     STATUS_CHOICES = (
@@ -197,4 +444,27 @@ class MedicationLog(models.Model):
         return f"{self.reminder.medication.name} - {self.status} at {self.taken_at or self.scheduled_time}"
 
     class Meta:
-        ordering = ['-scheduled_time']
\ No newline at end of file
+        ordering = ['-scheduled_time']
+
+class MedicationAdherenceDay(models.Model):
+    """
+    Per-reminder, per-day counts of logged doses by status, kept in step with
+    MedicationLog (see pharmacy/adherence.py) so adherence history is read
+    from here instead of counting logs.
+    """
+    reminder = models.ForeignKey(MedicationReminder, on_delete=models.CASCADE, related_name='adherence_days')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='medication_adherence_days')
+    day = models.DateField()
+    taken = models.PositiveIntegerField(default=0)
+    missed = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Reminder {self.reminder_id} on {self.day}: {self.taken} taken, {self.missed} missed, {self.skipped} skipped"
+
+    class Meta:
+        unique_together = ('reminder', 'day')
+        indexes = [
+            models.Index(fields=['user', 'day'], name='adherence_user_day_idx'),
+        ]
\ No newline at end of file
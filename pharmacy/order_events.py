@@ -0,0 +1,116 @@
+# pharmacy/order_events.py
+"""
+Real-time order events for pharmacy staff.
+
+When an order is created, paid or changes status, an event is appended to
+PharmacyOrderEvent after the transaction commits and broadcast to the
+pharmacy's Channels group, which every connected staff member of that
+pharmacy joins (see pharmacy/consumers.py). Event ids increase, so a client
+that reconnects sends the last id it saw and the consumer replays anything
+newer before resuming the live stream. An id is drawn when its row is
+inserted, not when it commits, so the events of one pharmacy are written
+under a transaction-scoped advisory lock: they commit in id order and a
+token never passes an event that is still being written.
+"""
+import logging
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import MedicationOrder, PharmacyOrderEvent
+
+logger = logging.getLogger(__name__)
+
+EVENT_RETENTION = timedelta(days=7)
+REPLAY_LIMIT = 500
+
+
+def pharmacy_group_name(pharmacy_id):
+    return f"pharmacy_{pharmacy_id}_orders"
+
+
+def serialize_event(event):
+    return {
+        'id': event.id,
+        'event': event.event,
+        'order': event.payload,
+        'created_at': event.created_at.isoformat(),
+    }
+
+
+def _order_payload(order_id):
+    order = (
+        MedicationOrder.objects.filter(pk=order_id)
+        .select_related('user')
+        .annotate(items_count=Count('items'))
+        .first()
+    )
+    if order is None:
+        return None
+    return order, {
+        'id': order.id,
+        'status': order.status,
+        'payment_status': order.payment_status,
+        'total_amount': str(order.total_amount) if order.total_amount is not None else None,
+        'is_delivery': order.is_delivery,
+        'items_count': order.items_count,
+        'patient_name': f"{order.user.first_name} {order.user.last_name}".strip() or order.user.email,
+        'order_date': order.order_date.isoformat(),
+    }
+
+
+def publish_order_event(order_id, event_type):
+    """Store an event for the order and broadcast it to its pharmacy's staff."""
+    loaded = _order_payload(order_id)
+    if loaded is None:
+        return None
+    order, payload = loaded
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [pharmacy_group_name(order.pharmacy_id)])
+        event = PharmacyOrderEvent.objects.create(
+            pharmacy_id=order.pharmacy_id, order=order, event=event_type, payload=payload
+        )
+    try:
+        channel_layer = get_channel_layer()
+        if channel_layer is not None:
+            async_to_sync(channel_layer.group_send)(
+                pharmacy_group_name(order.pharmacy_id),
+                {'type': 'order.event', 'event': serialize_event(event)}
+            )
+    except Exception as e:
+        # Clients that missed the broadcast pick the event up on resume
+        logger.error(f"Failed to broadcast order event {event.id} for order {order_id}: {e}")
+    return event
+
+
+def record_order_event(order, event_type):
+    """Publish once the surrounding transaction commits, so rolled-back orders never reach staff."""
+    order_id = order.pk
+    transaction.on_commit(lambda: publish_order_event(order_id, event_type))
+
+
+def events_since(pharmacy_id, token, limit=REPLAY_LIMIT):
+    """
+    Events after `token` (an event id) for the pharmacy, oldest first, or
+    None when the token predates retained events and the client must reload.
+    A pharmacy's events commit in id order (see publish_order_event), so
+    none can later appear below an id already served.
+    """
+    # Ids are shared by all pharmacies, so any gap between the token and the
+    # oldest retained event may have held this pharmacy's events
+    oldest = PharmacyOrderEvent.objects.order_by('id').values_list('id', flat=True).first()
+    if oldest is not None and token < oldest - 1:
+        return None
+    events = PharmacyOrderEvent.objects.filter(pharmacy_id=pharmacy_id, id__gt=token).order_by('id')[:limit]
+    return [serialize_event(event) for event in events]
+
+
+def prune_order_events(now=None):
+    cutoff = (now or timezone.now()) - EVENT_RETENTION
+    deleted, _ = PharmacyOrderEvent.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,111 @@
+# pharmacy/orders.py
+"""
+Medication order creation shared by every entry point (direct orders,
+ordering from a prescription, and doctors' forward-to-pharmacy).
+
+Validation stays with the callers since each reports errors its own way; this
+module only writes. It uses a fixed number of queries regardless of how many
+items or pharmacy staff there are: the order insert, one bulk insert of items,
+one staff lookup and one bulk insert of staff notifications, all in a single
+transaction. Stock for catalog-linked items is reserved in the same
+transaction (see pharmacy/reservations.py), so an order that cannot be
+filled from unreserved stock is not created at all.
+"""
+import logging
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from notifications.models import Notification
+from .models import MedicationOrder, MedicationOrderItem
+from .reservations import medication_quantities, reserve_stock
+
+logger = logging.getLogger(__name__)
+
+
+def items_from_prescription(prescription_items):
+    """Order item fields for each PrescriptionItem (quantity 1; the pharmacy adjusts and prices them)."""
+    return [
+        {
+            'prescription_item': p_item,
+            'medication_name_text': p_item.medication_name,
+            'dosage_text': p_item.dosage,
+            'quantity': 1,
+        }
+        for p_item in prescription_items
+    ]
+
+
+def apply_insurance_coverage(order):
+    """Fill insurance_covered_amount and patient_copay in memory when both insurance and a total are known."""
+    if not (order.user_insurance and order.total_amount):
+        return
+    from insurance.utils import calculate_insurance_coverage
+    coverage = calculate_insurance_coverage(
+        order.user_insurance,
+        Decimal(str(order.total_amount)),
+        service_type='medication'
+    )
+    order.insurance_covered_amount = coverage['covered_amount']
+    order.patient_copay = coverage['patient_copay']
+
+
+def _staff_notifications(order, actor, items_count, from_prescription):
+    User = get_user_model()
+    staff = User.objects.filter(
+        is_pharmacy_staff=True,
+        works_at_pharmacy=order.pharmacy,
+        is_active=True
+    ).only('id')
+    patient_name = f"{order.user.first_name} {order.user.last_name}".strip() or order.user.email
+    source = 'Prescription' if from_prescription else 'Order'
+    return [
+        Notification(
+            recipient=staff_member,
+            actor=actor,
+            title=f"New Order #{order.id}",
+            verb=f"New medication order #{order.id} received from {patient_name}. {source} includes {items_count} medication(s).",
+            level='info',
+            category='order',
+            action_url=f"/portal/orders/{order.id}",
+            action_text="View Order",
+            unread=True,
+        )
+        for staff_member in staff
+    ]
+
+
+def create_medication_order(user, pharmacy, *, prescription=None, items=None, prescription_items=None,
+                            actor=None, **order_fields):
+    """
+    Create a MedicationOrder with its items and notify the pharmacy's staff.
+
+    Items come from `items` (dicts of MedicationOrderItem fields) or, failing
+    that, from `prescription_items` / the prescription's items. Remaining
+    keyword arguments are MedicationOrder fields (user_insurance, notes,
+    payment_reference, ...). Insurance coverage is applied before the insert
+    when a total is already known. Raises InsufficientStockError when a
+    listed medication does not have enough unreserved stock.
+    """
+    from_prescription = items is None
+    if from_prescription:
+        if prescription_items is None:
+            prescription_items = prescription.items.all() if prescription else []
+        items = items_from_prescription(prescription_items)
+
+    with transaction.atomic():
+        order = MedicationOrder(user=user, pharmacy=pharmacy, prescription=prescription, **order_fields)
+        apply_insurance_coverage(order)
+        order.save()
+
+        MedicationOrderItem.objects.bulk_create([
+            MedicationOrderItem(order=order, **item_data) for item_data in items
+        ])
+        reserve_stock(order, medication_quantities(items))
+        notifications = Notification.objects.bulk_create(
+            _staff_notifications(order, actor or user, len(items), from_prescription)
+        )
+
+    logger.info(f"Created order {order.id} with {len(items)} items; notified {len(notifications)} pharmacy staff members")
+    return order
@@ -0,0 +1,179 @@
+# pharmacy/price_index.py
+"""
+Per-medication price and availability summaries (MedicationPriceSummary).
+
+A medication's summary covers the inventory rows that are in stock at active
+pharmacies with a current subscription: min, median and max price, how many
+pharmacies stock it and the TOP_K cheapest of them with their locations.
+Summaries are recomputed only for the medications touched by a write, after
+the write commits (see schedule_price_refresh and pharmacy/signals.py); the
+nightly rebuild catches what no write announces, such as subscriptions
+lapsing or locations filled in by background geocoding.
+"""
+import logging
+from math import asin, cos, radians, sin, sqrt
+
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.measure import D
+from django.db import transaction
+from django.db.models import Aggregate, Count, DecimalField, F, Max, Min, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import MedicationPriceSummary, PharmacyInventory
+
+logger = logging.getLogger(__name__)
+
+TOP_K = 20
+REBUILD_CHUNK_SIZE = 1000
+# Refreshes touching more medications than this (e.g. a pharmacy with a large
+# catalog being renamed) run in Celery instead of the request that caused them
+INLINE_REFRESH_LIMIT = 200
+EARTH_RADIUS_KM = 6371.0
+
+
+class Median(Aggregate):
+    function = 'PERCENTILE_CONT'
+    name = 'Median'
+    template = 'CAST(%(function)s(0.5) WITHIN GROUP (ORDER BY %(expressions)s) AS numeric(10, 2))'
+    output_field = DecimalField(max_digits=10, decimal_places=2)
+
+
+def stocked_inventory():
+    return PharmacyInventory.objects.filter(
+        in_stock=True, quantity__gt=0, pharmacy__is_active=True
+    ).filter(
+        Q(pharmacy__subscription_expiry__isnull=True) | Q(pharmacy__subscription_expiry__gte=timezone.now().date())
+    )
+
+
+def _cheapest_by_medication(medication_ids):
+    rows = (
+        stocked_inventory().filter(medication_id__in=medication_ids)
+        .annotate(rank=Window(
+            RowNumber(), partition_by=F('medication_id'), order_by=[F('price').asc(), F('pharmacy_id').asc()]
+        ))
+        .filter(rank__lte=TOP_K)
+        .values('medication_id', 'pharmacy_id', 'pharmacy__name', 'pharmacy__address', 'pharmacy__location', 'price')
+        .order_by('medication_id', 'rank')
+    )
+    cheapest = {}
+    for row in rows:
+        cheapest.setdefault(row['medication_id'], []).append(_cheapest_entry(row))
+    return cheapest
+
+
+def _cheapest_entry(row):
+    location = row['pharmacy__location']
+    return {
+        'pharmacy_id': row['pharmacy_id'],
+        'name': row['pharmacy__name'],
+        'address': row['pharmacy__address'],
+        'price': str(row['price']),
+        'latitude': location.y if location else None,
+        'longitude': location.x if location else None,
+    }
+
+
+def refresh_price_summaries(medication_ids):
+    """Recompute the summaries of the given medications (three queries for any number of them)."""
+    medication_ids = set(medication_ids)
+    if not medication_ids:
+        return 0
+    stats = list(
+        stocked_inventory().filter(medication_id__in=medication_ids)
+        .values('medication_id')
+        .annotate(
+            min_price=Min('price'), median_price=Median('price'), max_price=Max('price'),
+            pharmacy_count=Count('pharmacy_id', distinct=True),
+        )
+        .order_by()
+    )
+    cheapest = _cheapest_by_medication([row['medication_id'] for row in stats]) if stats else {}
+    summaries = [
+        MedicationPriceSummary(cheapest=cheapest.get(row['medication_id'], []), **row)
+        for row in stats
+    ]
+    with transaction.atomic():
+        MedicationPriceSummary.objects.bulk_create(
+            summaries,
+            update_conflicts=True,
+            unique_fields=['medication'],
+            update_fields=['min_price', 'median_price', 'max_price', 'pharmacy_count', 'cheapest', 'refreshed_at'],
+        )
+        # No pharmacy stocks these any more
+        MedicationPriceSummary.objects.filter(
+            medication_id__in=medication_ids - {row['medication_id'] for row in stats}
+        ).delete()
+    return len(summaries)
+
+
+def _enqueue_price_refresh(medication_ids):
+    from .tasks import refresh_price_summaries_task
+    try:
+        for start in range(0, len(medication_ids), REBUILD_CHUNK_SIZE):
+            refresh_price_summaries_task.delay(medication_ids[start:start + REBUILD_CHUNK_SIZE])
+    except Exception as e:
+        # The nightly rebuild catches these up
+        logger.warning(f"Could not queue price summary refresh for {len(medication_ids)} medications: {e}")
+
+
+def schedule_price_refresh(medication_ids):
+    """
+    Refresh the medications' summaries once the current transaction commits:
+    inline for a few, in background tasks beyond INLINE_REFRESH_LIMIT.
+    """
+    medication_ids = set(medication_ids)
+    if not medication_ids:
+        return
+    if len(medication_ids) > INLINE_REFRESH_LIMIT:
+        transaction.on_commit(lambda: _enqueue_price_refresh(sorted(medication_ids)))
+    else:
+        transaction.on_commit(lambda: refresh_price_summaries(medication_ids))
+
+
+def rebuild_price_index(chunk_size=REBUILD_CHUNK_SIZE):
+    """Recompute every summary and drop those of medications no longer stocked. Returns how many exist."""
+    medication_ids = list(
+        stocked_inventory().order_by('medication_id').values_list('medication_id', flat=True).distinct()
+    )
+    for start in range(0, len(medication_ids), chunk_size):
+        refresh_price_summaries(medication_ids[start:start + chunk_size])
+    MedicationPriceSummary.objects.exclude(medication_id__in=stocked_inventory().values('medication_id')).delete()
+    logger.info(f"Rebuilt price summaries for {len(medication_ids)} medications")
+    return len(medication_ids)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle (haversine) distance between two coordinates."""
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
+
+
+def nearby_cheapest(summary, point, radius_km):
+    """
+    The cheapest pharmacies within `radius_km` of `point` stocking the
+    summary's medication, with `distance_km` added. A stored list shorter
+    than TOP_K holds every stocking pharmacy and is filtered in place; a full
+    one only holds the cheapest nationwide, so the radius is searched in
+    inventory instead.
+    """
+    if len(summary.cheapest) < TOP_K:
+        nearby = []
+        for entry in summary.cheapest:
+            if entry['latitude'] is None or entry['longitude'] is None:
+                continue
+            distance = distance_km(point.y, point.x, entry['latitude'], entry['longitude'])
+            if distance <= radius_km:
+                nearby.append({**entry, 'distance_km': round(distance, 2)})
+        return nearby
+
+    rows = (
+        stocked_inventory()
+        .filter(medication_id=summary.medication_id, pharmacy__location__distance_lte=(point, D(km=radius_km)))
+        .annotate(distance=Distance('pharmacy__location', point))
+        .values('pharmacy_id', 'pharmacy__name', 'pharmacy__address', 'pharmacy__location', 'price', 'distance')
+        .order_by('price', 'pharmacy_id')[:TOP_K]
+    )
+    return [{**_cheapest_entry(row), 'distance_km': round(row['distance'].km, 2)} for row in rows]
@@ -0,0 +1,224 @@
+# pharmacy/reservations.py
+"""
+Time-limited stock reservations for medication orders.
+
+When an order is created its catalog-linked items are held against the
+pharmacy's inventory: `reserved_quantity` goes up and a StockReservation
+records the hold. All holds for an order are taken by one conditional UPDATE
+that only succeeds for rows with enough unreserved stock, so concurrent
+orders for the same SKU never oversell and never wait on a read-then-write
+round trip; rows are locked in id order so multi-item orders cannot deadlock.
+
+A hold on a pending order lapses after STOCK_RESERVATION_TTL_MINUTES
+(released by release_expired_reservations); once the order moves past
+pending it is kept until the order is cancelled (released) or completed
+(committed: the units come off `quantity`). An order whose holds lapsed
+while pending is held again when it moves on, and the move is refused with
+InsufficientStockError if the stock has gone in the meantime. Items without
+a linked Medication, or for medications the pharmacy does not list, are not
+held.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import PharmacyInventory, StockReservation
+from .price_index import schedule_price_refresh
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_BATCH_SIZE = 500
+
+
+class InsufficientStockError(Exception):
+    def __init__(self, shortages):
+        # {medication_id: units requested} for the items that could not be held
+        self.shortages = shortages
+        super().__init__(f"Insufficient stock for medications {sorted(shortages)}")
+
+
+def reservation_ttl():
+    return timedelta(minutes=getattr(settings, 'STOCK_RESERVATION_TTL_MINUTES', 30))
+
+
+def _inventory_table():
+    return connection.ops.quote_name(PharmacyInventory._meta.db_table)
+
+
+def _values(rows):
+    placeholders = ', '.join(['(%s, %s)'] * len(rows))
+    params = [value for row in rows for value in row]
+    return placeholders, params
+
+
+def medication_quantities(items):
+    """Units needed per medication id for order item dicts whose prescription item links a Medication."""
+    needed = {}
+    for item in items:
+        prescription_item = item.get('prescription_item')
+        medication_id = getattr(prescription_item, 'medication_id', None)
+        if medication_id is None:
+            continue
+        needed[medication_id] = needed.get(medication_id, 0) + (item.get('quantity') or 1)
+    return needed
+
+
+def reserve_stock(order, needed, now=None):
+    """
+    Hold `needed` ({medication_id: units}) at the order's pharmacy. Either
+    every listed medication is held or InsufficientStockError is raised;
+    call inside the transaction that creates the order so a failure rolls
+    both back. Returns the created reservations.
+    """
+    listed = dict(
+        PharmacyInventory.objects.filter(pharmacy_id=order.pharmacy_id, medication_id__in=needed)
+        .values_list('medication_id', 'id')
+    )
+    if not listed:
+        return []
+
+    values, params = _values([(medication_id, needed[medication_id]) for medication_id in sorted(listed)])
+    table = _inventory_table()
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            WITH wanted (medication_id, qty) AS (VALUES {values}),
+            locked AS (
+                SELECT inv.id FROM {table} inv
+                JOIN wanted ON inv.medication_id = wanted.medication_id
+                WHERE inv.pharmacy_id = %s
+                ORDER BY inv.id FOR UPDATE OF inv
+            )
+            UPDATE {table} inv SET reserved_quantity = inv.reserved_quantity + wanted.qty
+            FROM wanted
+            WHERE inv.id IN (SELECT id FROM locked)
+              AND inv.medication_id = wanted.medication_id
+              AND inv.in_stock
+              AND inv.quantity - inv.reserved_quantity >= wanted.qty
+            RETURNING inv.medication_id
+        """, params + [order.pharmacy_id])
+        held = {row[0] for row in cursor.fetchall()}
+
+    shortages = {medication_id: needed[medication_id] for medication_id in listed if medication_id not in held}
+    if shortages:
+        # The caller's transaction rolls back the holds taken above
+        raise InsufficientStockError(shortages)
+
+    expires_at = (now or timezone.now()) + reservation_ttl()
+    return StockReservation.objects.bulk_create([
+        StockReservation(
+            order=order, inventory_id=listed[medication_id], quantity=needed[medication_id], expires_at=expires_at
+        )
+        for medication_id in sorted(listed)
+    ])
+
+
+def _settle(reservations, new_status):
+    """
+    Move held reservations to `new_status` and give their units back to
+    inventory, taking them off `quantity` too when committing. A reservation
+    another worker is settling is waited for, then skipped if that worker
+    settled it. Returns how many were settled.
+    """
+    ids = [reservation.id for reservation in reservations]
+    claimed = list(
+        StockReservation.objects.filter(id__in=ids, status=StockReservation.StatusChoices.HELD)
+        .select_for_update().order_by('id').values_list('id', 'inventory_id', 'quantity')
+    )
+    if not claimed:
+        return 0
+    StockReservation.objects.filter(id__in=[row[0] for row in claimed]).update(
+        status=new_status, expires_at=None, updated_at=timezone.now()
+    )
+
+    units = {}
+    for _, inventory_id, quantity in claimed:
+        units[inventory_id] = units.get(inventory_id, 0) + quantity
+    values, params = _values(sorted(units.items()))
+    table = _inventory_table()
+    assignments = "reserved_quantity = GREATEST(inv.reserved_quantity - returned.qty, 0)"
+    if new_status == StockReservation.StatusChoices.COMMITTED:
+        assignments += (
+            ", quantity = GREATEST(inv.quantity - returned.qty, 0)"
+            ", in_stock = inv.in_stock AND inv.quantity > returned.qty"
+        )
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            WITH returned (id, qty) AS (VALUES {values}),
+            locked AS (
+                SELECT inv.id FROM {table} inv JOIN returned ON inv.id = returned.id
+                ORDER BY inv.id FOR UPDATE OF inv
+            )
+            UPDATE {table} inv SET {assignments}
+            FROM returned
+            WHERE inv.id IN (SELECT id FROM locked) AND inv.id = returned.id
+            RETURNING inv.medication_id
+        """, params)
+        if new_status == StockReservation.StatusChoices.COMMITTED:
+            # Committed units can take a row out of stock
+            schedule_price_refresh(row[0] for row in cursor.fetchall())
+    return len(claimed)
+
+
+def _held(order):
+    return list(order.reservations.filter(status=StockReservation.StatusChoices.HELD).only('id'))
+
+
+def release_order_reservations(order):
+    """Return an order's held units to the shelf (order cancelled)."""
+    with transaction.atomic():
+        return _settle(_held(order), StockReservation.StatusChoices.RELEASED)
+
+
+def commit_order_reservations(order):
+    """Take an order's held units out of inventory (order completed)."""
+    with transaction.atomic():
+        return _settle(_held(order), StockReservation.StatusChoices.COMMITTED)
+
+
+def reclaim_lapsed_reservations(order):
+    """
+    Hold an order's items again when every hold it had was released while it
+    sat in pending. Raises InsufficientStockError if they can no longer be
+    held; call inside the transaction that moves the order on.
+    """
+    # Locking waits out a sweeper releasing these holds right now, so the
+    # statuses read are the ones it settled on
+    statuses = list(order.reservations.select_for_update().order_by('id').values_list('status', flat=True))
+    if not statuses or any(status != StockReservation.StatusChoices.RELEASED for status in statuses):
+        return []
+    items = order.items.select_related('prescription_item')
+    needed = medication_quantities(
+        {'prescription_item': item.prescription_item, 'quantity': item.quantity} for item in items
+    )
+    return reserve_stock(order, needed) if needed else []
+
+
+def keep_order_reservations(order):
+    """Stop the hold timer once an order has progressed past pending."""
+    return order.reservations.filter(
+        status=StockReservation.StatusChoices.HELD, expires_at__isnull=False
+    ).update(expires_at=None, updated_at=timezone.now())
+
+
+def release_expired_reservations(now=None, batch_size=EXPIRY_BATCH_SIZE):
+    """Release holds whose TTL has passed. Returns how many were released."""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            # Holds an order is settling right now are left to it
+            batch = list(
+                StockReservation.objects.filter(status=StockReservation.StatusChoices.HELD, expires_at__lte=now)
+                .select_for_update(skip_locked=True).order_by('expires_at').only('id')[:batch_size]
+            )
+            if not batch:
+                break
+            released += _settle(batch, StockReservation.StatusChoices.RELEASED)
+        if len(batch) < batch_size:
+            break
+    if released:
+        logger.info(f"Released {released} expired stock reservations")
+    return released
@@ -1,8 +1,8 @@
 # pharmacy/serializers.py
 from rest_framework import serializers
 from .models import (
-    Pharmacy, Medication, PharmacyInventory,
-    MedicationOrder, MedicationOrderItem, MedicationReminder,
+    Pharmacy, Medication, PharmacyInventory, PharmacyInventoryTombstone,
+    MedicationPriceSummary, MedicationOrder, MedicationOrderItem, MedicationReminder,
     MedicationLog
 )
 from users.serializers import UserSerializer
@@ -11,16 +11,22 @@ from django.contrib.gis.geos import Point
 class PharmacySerializer(serializers.ModelSerializer):
     latitude = serializers.FloatField(required=False, allow_null=True)
     longitude = serializers.FloatField(required=False, allow_null=True)
+    distance_km = serializers.SerializerMethodField()
 
     class Meta:
         model = Pharmacy
         fields = [
             'id', 'name', 'address', 'phone_number', 'email',
             'latitude', 'longitude', 'operating_hours', 'is_24_hours',
-            'offers_delivery', 'is_active', 'created_at', 'updated_at'
+            'offers_delivery', 'is_active', 'distance_km', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+    def get_distance_km(self, obj):
+        """Distance from the searched point, present only on proximity queries."""
+        distance = getattr(obj, 'distance', None)
+        return round(distance.km, 2) if distance is not None else None
+
     def to_representation(self, instance):
         rep = super().to_representation(instance)
         if instance.location:
@@ -53,6 +59,18 @@ class PharmacySerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
+class PharmacyMatchSerializer(PharmacySerializer):
+    """Pharmacy annotated by pharmacy.matching.match_pharmacies"""
+    fillable_items = serializers.IntegerField(read_only=True)
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    can_fill_all = serializers.SerializerMethodField()
+
+    class Meta(PharmacySerializer.Meta):
+        fields = PharmacySerializer.Meta.fields + ['fillable_items', 'total_price', 'can_fill_all']
+
+    def get_can_fill_all(self, obj):
+        return obj.fillable_items >= self.context.get('total_items', 0)
+
 class MedicationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Medication
@@ -65,6 +83,19 @@ class MedicationSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
 
 
+class MedicationPriceSummarySerializer(serializers.ModelSerializer):
+    medication_id = serializers.IntegerField(read_only=True)
+    medication_name = serializers.CharField(source='medication.name', read_only=True)
+    medication_strength = serializers.CharField(source='medication.strength', read_only=True)
+
+    class Meta:
+        model = MedicationPriceSummary
+        fields = [
+            'medication_id', 'medication_name', 'medication_strength', 'min_price', 'median_price',
+            'max_price', 'pharmacy_count', 'refreshed_at'
+        ]
+
+
 class PharmacyInventorySerializer(serializers.ModelSerializer):
     medication = MedicationSerializer(read_only=True)
     medication_id = serializers.PrimaryKeyRelatedField(
@@ -76,8 +107,26 @@ class PharmacyInventorySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = PharmacyInventory
-        fields = ['id', 'pharmacy', 'medication', 'medication_id', 'in_stock', 'quantity', 'price', 'last_updated']
-        read_only_fields = ['last_updated', 'pharmacy']
+        fields = ['id', 'pharmacy', 'medication', 'medication_id', 'in_stock', 'quantity', 'reserved_quantity', 'available_quantity', 'price', 'last_updated']
+        read_only_fields = ['last_updated', 'pharmacy', 'reserved_quantity']
+
+
+class PharmacyInventoryChangeSerializer(serializers.ModelSerializer):
+    """Compact inventory row for the change feed"""
+    medication_name = serializers.CharField(source='medication.name', read_only=True)
+    medication_strength = serializers.CharField(source='medication.strength', read_only=True)
+
+    class Meta:
+        model = PharmacyInventory
+        fields = ['id', 'medication_id', 'medication_name', 'medication_strength', 'in_stock', 'quantity', 'price', 'last_updated']
+
+
+class PharmacyInventoryTombstoneSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='inventory_id')
+
+    class Meta:
+        model = PharmacyInventoryTombstone
+        fields = ['id', 'medication_id', 'deleted_at']
 
 
 class PharmacyOrderItemViewSerializer(serializers.ModelSerializer):
@@ -252,11 +301,18 @@ class MedicationOrderSerializer(serializers.ModelSerializer):
             return 'pending'
 
     def create(self, validated_data):
+        from .orders import create_medication_order
+        from .reservations import InsufficientStockError
         items_data = validated_data.pop('items')
-        order = MedicationOrder.objects.create(**validated_data)
-        for item_data in items_data:
-            MedicationOrderItem.objects.create(order=order, **item_data)
-        return order
+        validated_data.pop('user_insurance_id', None)
+        user = validated_data.pop('user')
+        pharmacy = validated_data.pop('pharmacy')
+        try:
+            return create_medication_order(user, pharmacy, items=items_data, **validated_data)
+        except InsufficientStockError as e:
+            raise serializers.ValidationError({
+                'items': f"Not enough stock at this pharmacy for medications {sorted(e.shortages)}."
+            })
 
 
 class PharmacyOrderUpdateSerializer(serializers.ModelSerializer):
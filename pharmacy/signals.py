@@ -0,0 +1,121 @@
+# pharmacy/signals.py
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from vitanips.core.operating_hours import sync_opening_intervals
+from .models import Medication, MedicationLog, MedicationOrder, Pharmacy, PharmacyInventory, PharmacyOpeningInterval, PharmacyOrderEvent
+from .adherence import record_log_change
+from .medication_search import clear_autocomplete_cache
+from .price_index import schedule_price_refresh
+from .order_events import record_order_event
+from .reservations import (
+    commit_order_reservations, keep_order_reservations, reclaim_lapsed_reservations, release_order_reservations
+)
+
+
+@receiver(pre_save, sender=MedicationOrder)
+def stash_previous_order_state(sender, instance, **kwargs):
+    """Stash the stored status/payment_status so post_save can tell what changed."""
+    previous = None
+    if instance.pk:
+        previous = MedicationOrder.objects.filter(pk=instance.pk).values('status', 'payment_status').first()
+    instance._previous_state = previous
+
+
+@receiver(post_save, sender=MedicationOrder)
+def publish_order_events(sender, instance, created, **kwargs):
+    if created:
+        record_order_event(instance, PharmacyOrderEvent.EventChoices.CREATED)
+        return
+    previous = getattr(instance, '_previous_state', None)
+    if previous is None:
+        return
+    if previous['payment_status'] != 'paid' and instance.payment_status == 'paid':
+        record_order_event(instance, PharmacyOrderEvent.EventChoices.PAID)
+    if previous['status'] != instance.status:
+        record_order_event(instance, PharmacyOrderEvent.EventChoices.STATUS_CHANGED)
+
+
+@receiver(post_save, sender=MedicationOrder)
+def settle_stock_reservations(sender, instance, created, **kwargs):
+    """
+    Release held stock on cancellation, commit it on completion, keep it once
+    the order progresses. Holds that lapsed while pending are taken again
+    first; InsufficientStockError then rolls the save back (see
+    MedicationOrder.save).
+    """
+    previous = getattr(instance, '_previous_state', None)
+    if created or previous is None or previous['status'] == instance.status:
+        return
+    if previous['status'] == 'pending' and instance.status != 'cancelled':
+        reclaim_lapsed_reservations(instance)
+    if instance.status == 'cancelled':
+        release_order_reservations(instance)
+    elif instance.status == 'completed':
+        commit_order_reservations(instance)
+    elif previous['status'] == 'pending':
+        keep_order_reservations(instance)
+
+
+# Autocomplete results are cached per process; drop them when the catalog changes
+post_save.connect(clear_autocomplete_cache, sender=Medication, dispatch_uid='medication_autocomplete_save')
+post_delete.connect(clear_autocomplete_cache, sender=Medication, dispatch_uid='medication_autocomplete_delete')
+
+
+@receiver(post_save, sender=PharmacyInventory)
+@receiver(post_delete, sender=PharmacyInventory)
+def refresh_inventory_price_summary(sender, instance, **kwargs):
+    schedule_price_refresh([instance.medication_id])
+
+
+# Pharmacy fields shown in, or deciding membership of, the medication price summaries
+PRICE_SUMMARY_FIELDS = ('name', 'address', 'location', 'is_active', 'subscription_expiry')
+
+
+@receiver(pre_save, sender=Pharmacy)
+def stash_previous_pharmacy_state(sender, instance, **kwargs):
+    """Stash the stored operating hours and price summary fields so post_save can tell what changed."""
+    instance._previous_state = (
+        Pharmacy.objects.filter(pk=instance.pk).values('operating_hours', *PRICE_SUMMARY_FIELDS).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Pharmacy)
+def sync_pharmacy_opening_intervals(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_state', None)
+    if created or previous is None or instance.operating_hours != previous['operating_hours']:
+        sync_opening_intervals([instance], PharmacyOpeningInterval, 'pharmacy')
+
+
+@receiver(post_save, sender=Pharmacy)
+def refresh_pharmacy_price_summaries(sender, instance, created, **kwargs):
+    """Activation, subscription, name and location changes show up in every summary listing the pharmacy."""
+    if created:
+        return
+    previous = getattr(instance, '_previous_state', None)
+    if previous is not None and all(previous[field] == getattr(instance, field) for field in PRICE_SUMMARY_FIELDS):
+        return
+    schedule_price_refresh(
+        PharmacyInventory.objects.filter(pharmacy=instance).values_list('medication_id', flat=True)
+    )
+
+
+@receiver(pre_save, sender=MedicationLog)
+def stash_previous_log_state(sender, instance, **kwargs):
+    previous = None
+    if instance.pk:
+        previous = MedicationLog.objects.filter(pk=instance.pk).values('reminder_id', 'scheduled_time', 'status').first()
+    instance._previous_state = previous
+
+
+@receiver(post_save, sender=MedicationLog)
+def update_adherence_on_log_save(sender, instance, created, **kwargs):
+    previous = None if created else getattr(instance, '_previous_state', None)
+    if previous and all(previous[field] == getattr(instance, field) for field in previous):
+        return
+    record_log_change(previous, instance)
+
+
+@receiver(post_delete, sender=MedicationLog)
+def update_adherence_on_log_delete(sender, instance, **kwargs):
+    record_log_change(None, instance, deleted=True)
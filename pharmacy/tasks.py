@@ -1,95 +1,173 @@
 # pharmacy/tasks.py
 import logging
-from datetime import date
+from datetime import date, timedelta
 from celery import shared_task
+from django.db import transaction
 from django.utils import timezone
-from django.db.models import Q
 from .models import MedicationReminder
+from .inventory_feed import prune_inventory_tombstones
+from .order_events import prune_order_events
+from .geocoding import geocode_pharmacies, pharmacies_needing_geocoding
+from .reservations import release_expired_reservations
+from .price_index import rebuild_price_index, refresh_price_summaries
+from .adherence import mark_missed_doses
 from vitanips.core.utils import send_app_email
-from notifications.utils import create_notification
+from notifications.models import Notification
 
 logger = logging.getLogger(__name__)
 
-def is_reminder_due(reminder: MedicationReminder, today: date) -> bool:
-    start_date = reminder.start_date
-    if reminder.frequency == MedicationReminder.FrequencyChoices.DAILY:
-        return True
-    elif reminder.frequency == MedicationReminder.FrequencyChoices.WEEKLY:
-        return start_date.weekday() == today.weekday()
-    elif reminder.frequency == MedicationReminder.FrequencyChoices.MONTHLY:
-        try:
-            return start_date.day == today.day
-        except ValueError:
-            return False
-    elif reminder.frequency == MedicationReminder.FrequencyChoices.CUSTOM:
-        try:
-            days_interval = int(reminder.custom_frequency)
-            if days_interval > 0:
-                delta_days = (today - start_date).days
-                return delta_days >= 0 and delta_days % days_interval == 0
-        except (ValueError, TypeError):
-            logger.warning(f"Invalid custom_frequency for reminder {reminder.id}")
-    return False
+DISPATCH_BATCH_SIZE = 500
+# Occurrences missed by more than this (e.g. workers were down) are skipped, not sent late
+LATE_GRACE = timedelta(hours=1)
+
+
+def claim_due_medication_reminders(now, limit=DISPATCH_BATCH_SIZE):
+    """
+    Lock up to `limit` due reminders, advance their next_fire_at and return
+    the (reminder, fired_at) pairs still worth sending, plus how many rows
+    were claimed. Advancing the schedule inside the lock is the claim:
+    concurrent workers skip locked rows and will not see them as due again.
+    """
+    with transaction.atomic():
+        reminders = list(
+            MedicationReminder.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(is_active=True, next_fire_at__lte=now)
+            .select_related('user', 'medication')
+            .order_by('next_fire_at')[:limit]
+        )
+        claimed = []
+        for reminder in reminders:
+            fired_at = reminder.next_fire_at
+            reminder.next_fire_at = reminder.compute_next_fire_at(max(fired_at, now))
+            if now - fired_at <= LATE_GRACE:
+                claimed.append((reminder, fired_at))
+        MedicationReminder.objects.bulk_update(reminders, ['next_fire_at'])
+    return claimed, len(reminders)
+
 
 @shared_task(name="pharmacy.tasks.send_medication_reminders_task", bind=True)
 def send_medication_reminders_task(self):
-    """Send medication reminders for due schedules."""
+    """Send medication reminders whose next_fire_at has passed."""
     try:
         now = timezone.now()
-        today = now.date()
-        current_time = now.time()
-
-        potential_reminders = MedicationReminder.objects.filter(
-            is_active=True,
-            start_date__lte=today,
-            time_of_day__hour=current_time.hour,
-            time_of_day__minute=current_time.minute,
-        ).filter(
-            Q(end_date__gte=today) | Q(end_date__isnull=True)
-        ).select_related('user', 'medication').prefetch_related('user__profile')
-
-        if not potential_reminders.exists():
-            logger.info("No medication reminders for current time slot")
-            return "No reminders to process"
+        sent_count = 0
+        skipped_count = 0
+
+        while True:
+            claimed, claimed_count = claim_due_medication_reminders(now)
+            notifications = []
+            for reminder, fired_at in claimed:
+                user = reminder.user
+                if not (user and user.email and user.notify_refill_reminder_email):
+                    logger.debug(f"Skipping reminder {reminder.id}: Invalid user or notification settings")
+                    skipped_count += 1
+                    continue
 
-        reminders_due_count = 0
-        for reminder in potential_reminders:
-            if not is_reminder_due(reminder, today):
-                continue
-
-            user = reminder.user
-            if not (user and user.email and user.notify_refill_reminder_email):
-                logger.debug(f"Skipping reminder {reminder.id}: Invalid user or notification settings")
-                continue
-
-            reminders_due_count += 1
-            try:
-                context = {
-                    'user': user,
-                    'reminder': reminder,
-                    'medication': reminder.medication,
-                    'subject': f"Medication Reminder: {reminder.medication.name}"
-                }
-                send_app_email(
-                    to_email=user.email,
-                    subject=context['subject'],
-                    template_name='emails/medication_reminder.html',
-                    context=context
-                )
-                create_notification(
-                    user=user,
-                    notification_type='MEDICATION_REMINDER',
-                    message=f"Time to take {reminder.medication.name}",
-                    related_object=reminder
-                )
-                logger.info(f"Sent reminder for '{reminder.medication.name}' to {user.email}")
-            except Exception as e:
-                logger.error(f"Failed to send reminder {reminder.id} to {user.email}: {str(e)}")
-
-        result = f"Processed {potential_reminders.count()} reminders, sent {reminders_due_count}"
+                try:
+                    context = {
+                        'user': user,
+                        'reminder': reminder,
+                        'medication': reminder.medication,
+                        'subject': f"Medication Reminder: {reminder.medication.name}"
+                    }
+                    send_app_email(
+                        to_email=user.email,
+                        subject=context['subject'],
+                        template_name='emails/medication_reminder.html',
+                        context=context
+                    )
+                    notifications.append(Notification(
+                        recipient=user,
+                        title="Medication Reminder",
+                        verb=f"Time to take {reminder.medication.name} ({reminder.dosage})",
+                        category='medication',
+                        action_url="/medication-reminders",
+                        sent_at=now,
+                        metadata={'reminder_id': reminder.id, 'scheduled_for': fired_at.isoformat()},
+                    ))
+                    sent_count += 1
+                    logger.info(f"Sent reminder for '{reminder.medication.name}' to {user.email}")
+                except Exception as e:
+                    logger.error(f"Failed to send reminder {reminder.id} to {user.email}: {str(e)}")
+            Notification.objects.bulk_create(notifications)
+            if claimed_count < DISPATCH_BATCH_SIZE:
+                break
+
+        if not sent_count and not skipped_count:
+            return "No reminders to process"
+        result = f"Processed {sent_count + skipped_count} reminders, sent {sent_count}"
         logger.info(result)
         return result
 
     except Exception as e:
         logger.error(f"Medication reminder task failed: {str(e)}", exc_info=True)
-        raise self.retry(countdown=300)
\ No newline at end of file
+        raise self.retry(countdown=300)
+
+
+@shared_task(name="pharmacy.tasks.prune_inventory_tombstones_task")
+def prune_inventory_tombstones_task():
+    """Drop inventory tombstones older than the change-feed retention period."""
+    deleted = prune_inventory_tombstones()
+    logger.info(f"Pruned {deleted} inventory tombstones")
+    return f"Pruned {deleted} inventory tombstones"
+
+
+@shared_task(name="pharmacy.tasks.prune_order_events_task")
+def prune_order_events_task():
+    """Drop pharmacy order events older than the resume window."""
+    deleted = prune_order_events()
+    logger.info(f"Pruned {deleted} pharmacy order events")
+    return f"Pruned {deleted} pharmacy order events"
+
+
+@shared_task(name="pharmacy.tasks.release_expired_reservations_task")
+def release_expired_reservations_task():
+    """Return stock held by pending orders whose reservation TTL has passed."""
+    released = release_expired_reservations()
+    return f"Released {released} expired stock reservations"
+
+
+@shared_task(name="pharmacy.tasks.rebuild_price_index_task")
+def rebuild_price_index_task():
+    """Recompute all medication price summaries (catches subscription lapses and background geocoding)."""
+    count = rebuild_price_index()
+    return f"Rebuilt price summaries for {count} medications"
+
+
+@shared_task(name="pharmacy.tasks.refresh_price_summaries_task")
+def refresh_price_summaries_task(medication_ids):
+    """Recompute the given medications' price summaries (writes touching too many to do inline)."""
+    count = refresh_price_summaries(medication_ids)
+    return f"Refreshed price summaries for {count} medications"
+
+
+@shared_task(name="pharmacy.tasks.mark_missed_doses_task")
+def mark_missed_doses_task(day=None):
+    """Log yesterday's (or `day`'s, YYYY-MM-DD) unlogged scheduled doses as missed."""
+    day = date.fromisoformat(day) if day else timezone.localdate() - timedelta(days=1)
+    marked = mark_missed_doses(day)
+    return f"Marked {marked} doses on {day} as missed"
+
+
+@shared_task(name="pharmacy.tasks.geocode_pharmacies_task", bind=True, max_retries=5)
+def geocode_pharmacies_task(self, pharmacy_ids):
+    """Fill in locations for the given pharmacies, retrying those the provider could not answer yet."""
+    located, pending = geocode_pharmacies(pharmacy_ids)
+    if pending:
+        countdown = 60 * 2 ** self.request.retries
+        try:
+            raise self.retry(args=[pending], countdown=countdown)
+        except self.MaxRetriesExceededError:
+            # The periodic sweep tries these again later
+            logger.error(f"Giving up geocoding pharmacies {pending} after {self.request.retries} retries")
+    return f"Geocoded {located} pharmacies, {len(pending)} pending"
+
+
+@shared_task(name="pharmacy.tasks.geocode_missing_pharmacy_locations")
+def geocode_missing_pharmacy_locations():
+    """Queue pharmacies that still have no location (missed or failed background geocoding)."""
+    pharmacy_ids = pharmacies_needing_geocoding()
+    if not pharmacy_ids:
+        return "No pharmacies to geocode"
+    geocode_pharmacies_task.delay(pharmacy_ids)
+    return f"Queued {len(pharmacy_ids)} pharmacies for geocoding"
@@ -5,7 +5,7 @@ from rest_framework.test import APITestCase, APIClient
 from django.contrib.auth import get_user_model
 from django.contrib.gis.geos import Point
 from decimal import Decimal
-from pharmacy.models import Pharmacy, Medication, MedicationOrder, MedicationOrderItem
+from pharmacy.models import Pharmacy, Medication, PharmacyInventory, MedicationOrder, MedicationOrderItem
 from doctors.models import Doctor, Specialty, Appointment, Prescription, PrescriptionItem
 
 User = get_user_model()
@@ -67,6 +67,50 @@ class PharmacyAPITests(APITestCase):
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['name'], 'API Test Pharmacy')
 
+    def test_nearest_pharmacies_ordered_by_distance_with_filters(self):
+        for name, lon, delivery in [('Far', -73.90, True), ('Near', -74.00, True), ('Nearest No Delivery', -74.005, False)]:
+            Pharmacy.objects.create(
+                name=name, address='Somewhere', phone_number='1234567890', operating_hours='9-5',
+                location=Point(lon, 40.7128, srid=4326), offers_delivery=delivery,
+            )
+        url = reverse('pharmacy-list')
+
+        response = self.client.get(url, {'lat': 40.7128, 'lon': -74.0060, 'nearest': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [p['name'] for p in response.data['results']]
+        self.assertEqual(names, ['API Test Pharmacy', 'Nearest No Delivery', 'Near'])
+        self.assertEqual(response.data['results'][0]['distance_km'], 0)
+
+        response = self.client.get(url, {'lat': 40.7128, 'lon': -74.0060, 'nearest': 5, 'offers_delivery': 'true'})
+        self.assertEqual([p['name'] for p in response.data['results']], ['Near', 'Far'])
+
+    def test_open_at_filter_uses_parsed_operating_hours(self):
+        for name, hours in [('Weekdays', 'Mon-Fri: 9AM-8PM, Sat: 10AM-2PM'), ('Late', '8pm-2am'), ('Unknown', 'Call ahead')]:
+            Pharmacy.objects.create(
+                name=name, address='Somewhere', phone_number='1234567890', operating_hours=hours,
+                location=Point(-74.0, 40.7, srid=4326),
+            )
+        url = reverse('pharmacy-list')
+
+        def open_names(when):
+            response = self.client.get(url, {'open_at': when})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return sorted(p['name'] for p in response.data['results'])
+
+        # 2025-11-19 is a Wednesday, 2025-11-23 a Sunday
+        self.assertEqual(open_names('2025-11-19T12:00:00Z'), ['API Test Pharmacy', 'Weekdays'])
+        self.assertEqual(open_names('2025-11-19T21:00:00Z'), ['API Test Pharmacy', 'Late'])
+        self.assertEqual(open_names('2025-11-24T01:30:00Z'), ['API Test Pharmacy', 'Late'])
+        self.assertEqual(open_names('2025-11-23T12:00:00Z'), ['API Test Pharmacy'])
+
+        weekdays = Pharmacy.objects.get(name='Weekdays')
+        weekdays.operating_hours = 'Daily 8-22'
+        weekdays.save()
+        self.assertEqual(open_names('2025-11-23T12:00:00Z'), ['API Test Pharmacy', 'Weekdays'])
+
+        response = self.client.get(url, {'open_at': 'tomorrow'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_retrieve_pharmacy(self):
         url = reverse('pharmacy-detail', kwargs={'pk': self.pharmacy.pk})
         response = self.client.get(url)
@@ -80,6 +124,23 @@ class PharmacyAPITests(APITestCase):
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['name'], 'Testocillin')
 
+    def test_medication_autocomplete_prefix_then_fuzzy(self):
+        Medication.objects.create(name='Amoxicillin', description='Antibiotic', dosage_form='Capsule', strength='500mg')
+        Medication.objects.create(name='Amoxiclav', description='Antibiotic', dosage_form='Tablet', strength='625mg')
+        Medication.objects.create(name='Paracetamol', generic_name='Acetaminophen', description='Analgesic',
+                                  dosage_form='Tablet', strength='500mg')
+        url = reverse('medication-autocomplete')
+
+        response = self.client.get(url, {'q': 'AMOX'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([m['name'] for m in response.data['results']], ['Amoxiclav', 'Amoxicillin'])
+
+        response = self.client.get(url, {'q': 'acetam'})
+        self.assertEqual([m['name'] for m in response.data['results']], ['Paracetamol'])
+
+        response = self.client.get(url, {'q': 'paracetmol'})
+        self.assertEqual([m['name'] for m in response.data['results']], ['Paracetamol'])
+
     def test_create_medication_order(self):
         self.client.force_authenticate(user=self.user)
         url = reverse('medication-order-list')
@@ -102,6 +163,165 @@ class PharmacyAPITests(APITestCase):
         self.assertEqual(order.items.count(), 1)
         self.assertEqual(order.items.first().prescription_item, self.prescription_item)
 
+    def test_patient_payment_publishes_paid_order_event(self):
+        from pharmacy.models import PharmacyOrderEvent
+        order = MedicationOrder.objects.create(user=self.user, pharmacy=self.pharmacy, total_amount=Decimal('12.00'))
+        self.client.force_authenticate(user=self.user)
+        url = reverse('medication-order-detail', kwargs={'pk': order.pk})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, {'payment_reference': 'PAY-123'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['payment_status'], 'paid')
+        self.assertTrue(PharmacyOrderEvent.objects.filter(order=order, event=PharmacyOrderEvent.EventChoices.PAID).exists())
+
+    def test_prescription_pharmacy_matches_ranked_by_coverage_then_price(self):
+        painkiller = Medication.objects.create(name='Painex', description='Pain', dosage_form='Tablet', strength='200mg')
+        PrescriptionItem.objects.create(
+            prescription=self.prescription, medication=painkiller, medication_name='Painex',
+            dosage='200mg', frequency='Daily', duration='3 days'
+        )
+        cheap = Pharmacy.objects.create(
+            name='Cheap Partial', address='1 Side St', phone_number='1111111111', operating_hours='9-5',
+            location=Point(-74.0050, 40.7130, srid=4326)
+        )
+        full = Pharmacy.objects.create(
+            name='Full Stock', address='2 Side St', phone_number='2222222222', operating_hours='9-5',
+            location=Point(-74.0100, 40.7150, srid=4326)
+        )
+        PharmacyInventory.objects.create(pharmacy=cheap, medication=self.medication, quantity=10, price=Decimal('1.00'))
+        PharmacyInventory.objects.create(pharmacy=full, medication=self.medication, quantity=10, price=Decimal('5.00'))
+        PharmacyInventory.objects.create(pharmacy=full, medication=painkiller, quantity=3, price=Decimal('2.50'))
+        # Out of stock rows do not count
+        PharmacyInventory.objects.create(pharmacy=self.pharmacy, medication=painkiller, in_stock=False, quantity=0, price=Decimal('0.50'))
+
+        self.client.force_authenticate(user=self.user)
+        url = reverse('prescription-pharmacy-matches', kwargs={'prescription_id': self.prescription.pk})
+        response = self.client.get(url, {'lat': 40.7128, 'lon': -74.0060})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_items'], 2)
+        results = response.data['results']
+        self.assertEqual([r['name'] for r in results], ['Full Stock', 'Cheap Partial'])
+        self.assertEqual(results[0]['fillable_items'], 2)
+        self.assertEqual(Decimal(results[0]['total_price']), Decimal('7.50'))
+        self.assertTrue(results[0]['can_fill_all'])
+        self.assertFalse(results[1]['can_fill_all'])
+
+    def test_medication_price_comparison_reads_incrementally_refreshed_summary(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        far = Pharmacy.objects.create(
+            name='Far Pharmacy', address='9 Far Rd', phone_number='3333333333', operating_hours='9-5',
+            location=Point(-73.0000, 41.5000, srid=4326)
+        )
+        near = Pharmacy.objects.create(
+            name='Near Pharmacy', address='3 Side St', phone_number='4444444444', operating_hours='9-5',
+            location=Point(-74.0050, 40.7130, srid=4326)
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            PharmacyInventory.objects.create(pharmacy=self.pharmacy, medication=self.medication, quantity=5, price=Decimal('4.00'))
+            PharmacyInventory.objects.create(pharmacy=far, medication=self.medication, quantity=5, price=Decimal('1.00'))
+            near_row = PharmacyInventory.objects.create(pharmacy=near, medication=self.medication, quantity=5, price=Decimal('3.00'))
+
+        url = reverse('medication-price-comparison', kwargs={'pk': self.medication.pk})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(response.data['pharmacy_count'], 3)
+        self.assertEqual(
+            (response.data['min_price'], response.data['median_price'], response.data['max_price']),
+            ('1.00', '3.00', '4.00')
+        )
+        self.assertEqual([p['name'] for p in response.data['pharmacies']], ['Far Pharmacy', 'Near Pharmacy', 'API Test Pharmacy'])
+
+        response = self.client.get(url, {'lat': 40.7128, 'lon': -74.0060, 'radius': 5})
+        self.assertEqual([p['name'] for p in response.data['pharmacies']], ['Near Pharmacy', 'API Test Pharmacy'])
+
+        # Going out of stock is reflected once the write commits
+        with self.captureOnCommitCallbacks(execute=True):
+            near_row.in_stock = False
+            near_row.save()
+        response = self.client.get(url)
+        self.assertEqual(response.data['pharmacy_count'], 2)
+        self.assertEqual(response.data['median_price'], '2.50')
+
+    def test_medication_price_comparison_searches_radius_beyond_stored_cheapest(self):
+        from unittest.mock import patch
+        for name, lon, price in (('Far One', -73.0000, '1.00'), ('Far Two', -73.0100, '2.00')):
+            far = Pharmacy.objects.create(
+                name=name, address='9 Far Rd', phone_number='3333333333', operating_hours='9-5',
+                location=Point(lon, 41.5000, srid=4326)
+            )
+            PharmacyInventory.objects.create(pharmacy=far, medication=self.medication, quantity=5, price=Decimal(price))
+        PharmacyInventory.objects.create(pharmacy=self.pharmacy, medication=self.medication, quantity=5, price=Decimal('4.00'))
+
+        with patch('pharmacy.price_index.TOP_K', 2):
+            with self.captureOnCommitCallbacks(execute=True):
+                PharmacyInventory.objects.filter(medication=self.medication).first().save()
+            url = reverse('medication-price-comparison', kwargs={'pk': self.medication.pk})
+            response = self.client.get(url, {'lat': 40.7128, 'lon': -74.0060, 'radius': 5})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Stored list holds only the two far ones; the nearby pharmacy comes from the radius search
+        self.assertEqual([p['name'] for p in response.data['pharmacies']], ['API Test Pharmacy'])
+        self.assertEqual(response.data['pharmacies'][0]['price'], '4.00')
+
+    def test_bulk_inventory_import_upserts_and_reports_row_errors(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        staff = User.objects.create_user(
+            username='staff', email='staff@example.com', password='password123',
+            is_pharmacy_staff=True, works_at_pharmacy=self.pharmacy
+        )
+        PharmacyInventory.objects.create(pharmacy=self.pharmacy, medication=self.medication, quantity=1, price=Decimal('9.99'))
+        other = Medication.objects.create(name='Calmex', description='Calm', dosage_form='Tablet', strength='10mg')
+        csv_body = (
+            "medication_name,strength,price,quantity\n"
+            "testocillin,,4.50,20\n"
+            "Calmex,10mg,3.00,0\n"
+            "Unknownium,,1.00,5\n"
+            "Calmex,,not-a-price,5\n"
+        ).encode()
+
+        self.client.force_authenticate(user=staff)
+        url = reverse('pharmacy-portal-inventory-bulk-import')
+        response = self.client.post(url, {'file': SimpleUploadedFile('prices.csv', csv_body, content_type='text/csv')}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rows'], 4)
+        self.assertEqual(response.data['upserted'], 2)
+        self.assertEqual(sorted(e['line'] for e in response.data['errors']), [4, 5])
+        updated = PharmacyInventory.objects.get(pharmacy=self.pharmacy, medication=self.medication)
+        self.assertEqual((updated.price, updated.quantity, updated.in_stock), (Decimal('4.50'), 20, True))
+        created = PharmacyInventory.objects.get(pharmacy=self.pharmacy, medication=other)
+        self.assertFalse(created.in_stock)
+
+    def test_inventory_change_feed_returns_updates_and_tombstones_after_cursor(self):
+        other = Medication.objects.create(name='Calmex', description='Calm', dosage_form='Tablet', strength='10mg')
+        kept = PharmacyInventory.objects.create(pharmacy=self.pharmacy, medication=self.medication, quantity=5, price=Decimal('3.00'))
+        removed = PharmacyInventory.objects.create(pharmacy=self.pharmacy, medication=other, quantity=2, price=Decimal('1.00'))
+        url = reverse('pharmacy-inventory-changes', kwargs={'pharmacy_id': self.pharmacy.pk})
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({row['id'] for row in response.data['changes']}, {kept.id, removed.id})
+        cursor = response.data['cursor']
+
+        response = self.client.get(url, {'cursor': cursor})
+        self.assertEqual((response.data['changes'], response.data['deleted']), ([], []))
+
+        PharmacyInventory.objects.filter(pk=kept.pk).update(quantity=4)
+        removed.delete()
+        response = self.client.get(url, {'cursor': cursor})
+        self.assertEqual([(row['id'], row['quantity']) for row in response.data['changes']], [(kept.id, 4)])
+        self.assertEqual([row['id'] for row in response.data['deleted']], [removed.id])
+        self.assertFalse(response.data['has_more'])
+
+        response = self.client.get(url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_unauthenticated_user_cannot_order(self):
         url = reverse('medication-order-list')
         data = {'pharmacy': self.pharmacy.pk, 'prescription': self.prescription.pk}
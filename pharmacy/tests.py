@@ -1,15 +1,16 @@
 # pharmacy/tests.py
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.contrib.gis.geos import Point
-from datetime import timedelta, time
+from datetime import date, datetime, timedelta, time
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 
-from .models import Pharmacy, Medication, PharmacyInventory, MedicationOrder, MedicationReminder
+from .models import Pharmacy, Medication, PharmacyInventory, MedicationOrder, MedicationReminder, StockReservation
 from doctors.models import Doctor, Prescription, PrescriptionItem, Appointment
+from notifications.models import Notification
 
 User = get_user_model()
 
@@ -41,6 +42,70 @@ class PharmacyModelTest(TestCase):
         """Test __str__ method"""
         self.assertEqual(str(self.pharmacy), "HealthPlus Pharmacy")
 
+    @override_settings(
+        GEOCODING_PROVIDER='vitanips.core.geocoding.StaticGeocoder',
+        GEOCODING_STATIC_RESULTS={'12 Marina Rd, Lagos': (6.4541, 3.3947)},
+    )
+    @patch('pharmacy.tasks.geocode_pharmacies_task.delay')
+    def test_location_filled_in_by_background_geocoding(self, mock_delay):
+        """Saving does not geocode inline; the queued batch fills location and caches by address"""
+        from django.core.cache import cache
+        from vitanips.core.geocoding import StaticGeocoder
+        from .geocoding import geocode_pharmacies
+
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Pharmacy.objects.create(name="Marina Pharmacy", address="12 Marina Rd, Lagos", phone_number="+2341")
+        second = Pharmacy.objects.create(name="Marina Annex", address="12 marina rd lagos", phone_number="+2342")
+        unknown = Pharmacy.objects.create(name="Nowhere Pharmacy", address="1 Unknown St", phone_number="+2343")
+        self.assertIsNone(first.location)
+        mock_delay.assert_called_once_with([first.id])
+
+        geocoder = StaticGeocoder()
+        with patch.object(geocoder, 'geocode', wraps=geocoder.geocode) as provider_call:
+            located, pending = geocode_pharmacies([first.id, second.id, unknown.id], geocoder=geocoder)
+        self.assertEqual((located, pending), (2, []))
+        # Both spellings of the Marina address share one provider call
+        self.assertEqual(provider_call.call_count, 2)
+
+        first.refresh_from_db()
+        unknown.refresh_from_db()
+        self.assertAlmostEqual(first.location.y, 6.4541)
+        self.assertAlmostEqual(first.location.x, 3.3947)
+        self.assertIsNone(unknown.location)
+        self.assertIsNotNone(unknown.geocode_attempted_at)
+
+    @patch('pharmacy.tasks.geocode_pharmacies_task.delay')
+    def test_background_geocoding_keeps_a_location_set_meanwhile(self, mock_delay):
+        from django.core.cache import cache
+        from vitanips.core.geocoding import StaticGeocoder
+        from .geocoding import geocode_pharmacies
+
+        cache.clear()
+        pharmacy = Pharmacy.objects.create(name="Nowhere Pharmacy", address="1 Unknown St", phone_number="+2343")
+        manual = Point(3.3792, 6.5244, srid=4326)
+
+        def set_by_hand(address):
+            # Staff fix the location in the admin while the provider is being asked
+            Pharmacy.objects.filter(pk=pharmacy.pk).update(location=manual)
+            return None
+
+        geocoder = StaticGeocoder()
+        with patch.object(geocoder, 'geocode', side_effect=set_by_hand):
+            self.assertEqual(geocode_pharmacies([pharmacy.id], geocoder=geocoder), (0, []))
+        pharmacy.refresh_from_db()
+        self.assertEqual(pharmacy.location, manual)
+
+    @patch('pharmacy.signals.schedule_price_refresh')
+    def test_price_summaries_refreshed_only_when_listing_fields_change(self, mock_refresh):
+        self.pharmacy.phone_number = "+1987654321"
+        self.pharmacy.save()
+        mock_refresh.assert_not_called()
+
+        self.pharmacy.is_active = False
+        self.pharmacy.save()
+        mock_refresh.assert_called_once()
+
 
 class MedicationModelTest(TestCase):
     """Test Medication model functionality"""
@@ -193,6 +258,35 @@ class PrescriptionForwardingTest(APITestCase):
         order = MedicationOrder.objects.filter(prescription=self.prescription, pharmacy=self.pharmacy).first()
         self.assertIsNotNone(order)
 
+    def test_order_creation_queries_independent_of_items_and_staff(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .orders import create_medication_order
+
+        def add_staff(n):
+            for i in range(n):
+                User.objects.create_user(
+                    username=f'staff{User.objects.count()}', email=f'staff{User.objects.count()}@test.com',
+                    password='testpass123', is_pharmacy_staff=True, works_at_pharmacy=self.pharmacy
+                )
+
+        add_staff(1)
+        with CaptureQueriesContext(connection) as baseline:
+            create_medication_order(self.user, self.pharmacy, prescription=self.prescription)
+
+        add_staff(4)
+        for i in range(5):
+            PrescriptionItem.objects.create(
+                prescription=self.prescription, medication_name=f'Extra {i}',
+                dosage='1 tab', frequency='Daily', duration='5 days'
+            )
+        with CaptureQueriesContext(connection) as many:
+            order = create_medication_order(self.user, self.pharmacy, prescription=self.prescription)
+
+        self.assertEqual(len(many), len(baseline))
+        self.assertEqual(order.items.count(), 6)
+        self.assertEqual(Notification.objects.filter(category='order', title=f"New Order #{order.id}").count(), 5)
+
 
 class MedicationReminderTest(TestCase):
     """Test medication reminder functionality"""
@@ -228,121 +322,177 @@ class MedicationReminderTest(TestCase):
         self.assertEqual(self.reminder.medication, self.medication)
         self.assertEqual(self.reminder.frequency, 'daily')
         self.assertTrue(self.reminder.is_active)
+        self.assertIsNotNone(self.reminder.next_fire_at)
+
+    def _aware(self, day, hour=9):
+        return timezone.make_aware(datetime.combine(day, time(hour, 0)))
+
+    def test_adherence_rollups_follow_logs_and_nightly_missed_pass(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .adherence import mark_missed_doses
+        from .models import MedicationAdherenceDay, MedicationLog
+
+        today = timezone.localdate()
+        first_day = today - timedelta(days=3)
+        MedicationReminder.objects.filter(pk=self.reminder.pk).update(
+            start_date=first_day, created_at=self._aware(first_day - timedelta(days=1))
+        )
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        log_url = f'/api/pharmacy/reminders/{self.reminder.id}/log/'
+
+        # Day 1 taken, day 2 skipped, day 3 never logged
+        response = client.post(log_url, {'status': 'taken', 'taken_at': self._aware(first_day).isoformat()}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        log = MedicationLog.objects.get(pk=response.data['id'])
+        self.assertEqual(log.scheduled_time, self._aware(first_day, hour=8))
+        client.post(log_url, {'status': 'skipped', 'taken_at': self._aware(first_day + timedelta(days=1)).isoformat()}, format='json')
+
+        missed_day = first_day + timedelta(days=2)
+        self.assertEqual(mark_missed_doses(missed_day), 1)
+        self.assertEqual(mark_missed_doses(missed_day), 0)  # Re-running does not double count
+        rollups = {r.day: (r.taken, r.missed, r.skipped) for r in MedicationAdherenceDay.objects.filter(reminder=self.reminder)}
+        self.assertEqual(rollups, {
+            first_day: (1, 0, 0),
+            first_day + timedelta(days=1): (0, 0, 1),
+            missed_day: (0, 1, 0),
+        })
+
+        # Correcting a log moves the counts
+        missed_log = MedicationLog.objects.get(reminder=self.reminder, status='missed')
+        missed_log.status = 'taken'
+        missed_log.save()
+        self.assertEqual(MedicationAdherenceDay.objects.get(reminder=self.reminder, day=missed_day).taken, 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/pharmacy/adherence/', {'from': (today - timedelta(days=365)).isoformat(), 'to': today.isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(response.data['series']), 3)
+        self.assertEqual(response.data['totals']['taken'], 2)
+        self.assertEqual(response.data['totals']['skipped'], 1)
+        self.assertEqual(response.data['totals']['adherence_rate'], round(2 / 3, 4))
+
+    def test_dose_logged_after_nightly_pass_replaces_missed_log(self):
+        from .adherence import mark_missed_doses
+        from .models import MedicationAdherenceDay, MedicationLog
+
+        day = timezone.localdate() - timedelta(days=1)
+        MedicationReminder.objects.filter(pk=self.reminder.pk).update(
+            start_date=day, created_at=self._aware(day - timedelta(days=1))
+        )
+        self.assertEqual(mark_missed_doses(day), 1)
+
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.post(
+            f'/api/pharmacy/reminders/{self.reminder.id}/log/',
+            {'status': 'taken', 'taken_at': self._aware(day, hour=22).isoformat()}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(list(MedicationLog.objects.filter(reminder=self.reminder).values_list('status', flat=True)), ['taken'])
+        rollup = MedicationAdherenceDay.objects.get(reminder=self.reminder, day=day)
+        self.assertEqual((rollup.taken, rollup.missed, rollup.skipped), (1, 0, 0))
+
+    def test_next_fire_at_for_each_frequency(self):
+        """next_fire_at is the first occurrence strictly after the reference time"""
+        start = date(2025, 1, 31)  # a Friday, and a day missing from shorter months
+        reminder = MedicationReminder(
+            user=self.user, medication=self.medication, dosage="1 tablet",
+            time_of_day=time(9, 0), start_date=start, is_active=True
+        )
+        after = self._aware(date(2025, 2, 3), hour=10)
+
+        reminder.frequency = 'daily'
+        self.assertEqual(reminder.compute_next_fire_at(after), self._aware(date(2025, 2, 4)))
+        reminder.frequency = 'weekly'
+        self.assertEqual(reminder.compute_next_fire_at(after), self._aware(date(2025, 2, 7)))
+        reminder.frequency = 'monthly'
+        self.assertEqual(reminder.compute_next_fire_at(after), self._aware(date(2025, 3, 31)))
+        reminder.frequency, reminder.custom_frequency = 'custom', '3'
+        self.assertEqual(reminder.compute_next_fire_at(after), self._aware(date(2025, 2, 6)))
+        reminder.custom_frequency = 'often'
+        self.assertIsNone(reminder.compute_next_fire_at(after))
+
+        reminder.frequency, reminder.end_date = 'weekly', date(2025, 2, 6)
+        self.assertIsNone(reminder.compute_next_fire_at(after))
+
+    def test_editing_reminder_recomputes_next_fire_at(self):
+        self.reminder.is_active = False
+        self.reminder.save()
+        self.assertIsNone(self.reminder.next_fire_at)
+
+        self.reminder.is_active = True
+        self.reminder.time_of_day = time(23, 59)
+        self.reminder.save(update_fields=['is_active', 'time_of_day'])
+        self.reminder.refresh_from_db()
+        self.assertEqual(timezone.localtime(self.reminder.next_fire_at).time(), time(23, 59))
     
     @patch('pharmacy.tasks.send_app_email')
-    @patch('pharmacy.tasks.create_notification')
-    @patch('pharmacy.tasks.is_reminder_due')
-    @patch('pharmacy.tasks.MedicationReminder.objects.filter')
-    def test_send_daily_medication_reminder(self, mock_filter, mock_is_due, mock_notification, mock_send_email):
-        """Test sending daily medication reminder at scheduled time"""
+    def test_send_due_reminder_and_advance_schedule(self, mock_send_email):
+        """Test sending a due reminder moves next_fire_at to the following occurrence"""
         from pharmacy.tasks import send_medication_reminders_task
         
-        # Create a mock queryset
-        mock_queryset = MagicMock()
-        mock_queryset.exists.return_value = True
-        mock_queryset.count.return_value = 1
-        mock_queryset.__iter__.return_value = iter([self.reminder])
-        
-        # Setup mock filter chain
-        mock_filter.return_value.filter.return_value.select_related.return_value.prefetch_related.return_value = mock_queryset
-        
-        mock_is_due.return_value = True
+        fire_at = timezone.now() - timedelta(minutes=1)
+        MedicationReminder.objects.filter(pk=self.reminder.pk).update(next_fire_at=fire_at)
         mock_send_email.return_value = True
-        mock_notification.return_value = None
         
-        # Run the task
         result = send_medication_reminders_task()
         
-        # Verify email was sent
         self.assertTrue(mock_send_email.called)
-        
-        # Verify notification was created
-        self.assertTrue(mock_notification.called)
-        
-        # Verify result indicates processing
-        self.assertIn('Processed', result)
+        self.assertTrue(Notification.objects.filter(recipient=self.user, category='medication').exists())
+        self.assertIn('sent 1', result)
+        self.reminder.refresh_from_db()
+        self.assertGreater(self.reminder.next_fire_at, timezone.now())
+
+        # Already advanced, so an immediate second run sends nothing
+        mock_send_email.reset_mock()
+        self.assertIn('No reminders', send_medication_reminders_task())
+        self.assertFalse(mock_send_email.called)
     
-    @patch('pharmacy.tasks.MedicationReminder.objects.filter')
-    def test_no_reminders_sent_at_wrong_time(self, mock_filter):
-        """Test that reminders are not sent at wrong time"""
+    @patch('pharmacy.tasks.send_app_email')
+    def test_no_reminders_sent_before_next_fire_at(self, mock_send_email):
+        """Test that reminders are not sent before their scheduled time"""
         from pharmacy.tasks import send_medication_reminders_task
         
-        # Create mock empty queryset
-        mock_queryset = MagicMock()
-        mock_queryset.exists.return_value = False
-        
-        # Setup mock filter chain to return empty queryset
-        mock_filter.return_value.filter.return_value.select_related.return_value.prefetch_related.return_value = mock_queryset
+        MedicationReminder.objects.filter(pk=self.reminder.pk).update(next_fire_at=timezone.now() + timedelta(hours=2))
         
-        # Run the task
         result = send_medication_reminders_task()
         
-        # Should return no reminders message
         self.assertIn('No reminders', result)
-    
+        self.assertFalse(mock_send_email.called)
+
     @patch('pharmacy.tasks.send_app_email')
-    @patch('pharmacy.tasks.is_reminder_due')
-    @patch('pharmacy.tasks.MedicationReminder.objects.filter')
-    def test_weekly_reminder_on_correct_day(self, mock_filter, mock_is_due, mock_send_email):
-        """Test weekly reminder is sent only on the correct day"""
+    def test_stale_occurrence_is_skipped_not_sent_late(self, mock_send_email):
         from pharmacy.tasks import send_medication_reminders_task
-        
-        # Create weekly reminder
-        weekly_reminder = MedicationReminder.objects.create(
-            user=self.user,
-            medication=self.medication,
-            dosage="1 tablet",
-            frequency='weekly',
-            time_of_day=time(9, 0),
-            start_date=timezone.now().date(),
-            is_active=True
-        )
-        
-        # Create mock queryset with the weekly reminder
-        mock_queryset = MagicMock()
-        mock_queryset.exists.return_value = True
-        mock_queryset.count.return_value = 1
-        mock_queryset.__iter__.return_value = iter([weekly_reminder])
-        
-        mock_filter.return_value.filter.return_value.select_related.return_value.prefetch_related.return_value = mock_queryset
-        mock_is_due.return_value = True
-        mock_send_email.return_value = True
-        
-        # Run the task
+
+        MedicationReminder.objects.filter(pk=self.reminder.pk).update(next_fire_at=timezone.now() - timedelta(hours=5))
+
         send_medication_reminders_task()
-        
-        # Email should be sent if day matches
-        self.assertTrue(mock_send_email.called)
-        self.assertTrue(weekly_reminder.is_active)
+
+        self.assertFalse(mock_send_email.called)
+        self.reminder.refresh_from_db()
+        self.assertGreater(self.reminder.next_fire_at, timezone.now())
     
-    @patch('pharmacy.tasks.is_reminder_due')
-    @patch('pharmacy.tasks.MedicationReminder.objects.filter')
-    def test_reminder_not_sent_to_users_with_disabled_notifications(self, mock_filter, mock_is_due):
+    @patch('pharmacy.tasks.send_app_email')
+    def test_reminder_not_sent_to_users_with_disabled_notifications(self, mock_send_email):
         """Test reminders are not sent when user has disabled email notifications"""
         from pharmacy.tasks import send_medication_reminders_task
         
         # Disable email notifications for user
         self.user.notify_refill_reminder_email = False
         self.user.save()
+        MedicationReminder.objects.filter(pk=self.reminder.pk).update(next_fire_at=timezone.now() - timedelta(minutes=1))
         
-        # Create mock queryset
-        mock_queryset = MagicMock()
-        mock_queryset.exists.return_value = True
-        mock_queryset.count.return_value = 1
-        mock_queryset.__iter__.return_value = iter([self.reminder])
-        
-        mock_filter.return_value.filter.return_value.select_related.return_value.prefetch_related.return_value = mock_queryset
-        mock_is_due.return_value = True
-        
-        # Run the task
         result = send_medication_reminders_task()
         
         # Should skip because user has disabled notifications
         self.assertIn('sent 0', result)
+        self.assertFalse(mock_send_email.called)
     
-    @patch('pharmacy.tasks.is_reminder_due')
-    @patch('pharmacy.tasks.MedicationReminder.objects.filter')
-    def test_reminder_not_sent_for_inactive_reminders(self, mock_filter, mock_is_due):
+    @patch('pharmacy.tasks.send_app_email')
+    def test_reminder_not_sent_for_inactive_reminders(self, mock_send_email):
         """Test that inactive reminders are not sent"""
         from pharmacy.tasks import send_medication_reminders_task
         
@@ -350,92 +500,28 @@ class MedicationReminderTest(TestCase):
         self.reminder.is_active = False
         self.reminder.save()
         
-        # Create mock empty queryset (because filter for is_active=True will find nothing)
-        mock_queryset = MagicMock()
-        mock_queryset.exists.return_value = False
-        
-        mock_filter.return_value.filter.return_value.select_related.return_value.prefetch_related.return_value = mock_queryset
-        
-        # Run the task
         result = send_medication_reminders_task()
         
         # Should return no reminders
         self.assertIn('No reminders', result)
+        self.assertIsNone(self.reminder.next_fire_at)
     
-    @patch('pharmacy.tasks.is_reminder_due')
-    @patch('pharmacy.tasks.MedicationReminder.objects.filter')
-    def test_reminder_not_sent_after_end_date(self, mock_filter, mock_is_due):
-        """Test that reminders are not sent after end date"""
-        from pharmacy.tasks import send_medication_reminders_task
-        
+    def test_reminder_not_scheduled_after_end_date(self):
+        """Test that reminders stop firing after end date"""
         # Set end date to yesterday
+        self.reminder.start_date = (timezone.now() - timedelta(days=5)).date()
         self.reminder.end_date = (timezone.now() - timedelta(days=1)).date()
         self.reminder.save()
         
-        # Create mock empty queryset (because filter for end_date check will exclude it)
-        mock_queryset = MagicMock()
-        mock_queryset.exists.return_value = False
-        
-        mock_filter.return_value.filter.return_value.select_related.return_value.prefetch_related.return_value = mock_queryset
-        
-        # Run the task
-        result = send_medication_reminders_task()
-        
-        # Should return no reminders
-        self.assertIn('No reminders', result)
-    
-    @patch('pharmacy.tasks.send_app_email')
-    @patch('pharmacy.tasks.is_reminder_due')
-    @patch('pharmacy.tasks.MedicationReminder.objects.filter')
-    def test_monthly_reminder_on_correct_day(self, mock_filter, mock_is_due, mock_send_email):
-        """Test monthly reminder is sent on correct day of month"""
-        from pharmacy.tasks import send_medication_reminders_task
-        
-        # Create monthly reminder starting on 15th
-        start_date = timezone.now().replace(day=15).date()
-        monthly_reminder = MedicationReminder.objects.create(
-            user=self.user,
-            medication=self.medication,
-            dosage="1 tablet",
-            frequency='monthly',
-            time_of_day=time(9, 0),
-            start_date=start_date,
-            is_active=True
-        )
-        
-        # Create mock queryset
-        mock_queryset = MagicMock()
-        mock_queryset.exists.return_value = True
-        mock_queryset.count.return_value = 1
-        mock_queryset.__iter__.return_value = iter([monthly_reminder])
-        
-        mock_filter.return_value.filter.return_value.select_related.return_value.prefetch_related.return_value = mock_queryset
-        mock_is_due.return_value = True
-        mock_send_email.return_value = True
-        
-        # Run the task
-        send_medication_reminders_task()
-        
-        # Verify reminder was processed
-        self.assertTrue(mock_send_email.called)
-        self.assertTrue(monthly_reminder.is_active)
+        self.assertIsNone(self.reminder.next_fire_at)
     
     @patch('pharmacy.tasks.logger')
     @patch('pharmacy.tasks.send_app_email')
-    @patch('pharmacy.tasks.is_reminder_due')
-    @patch('pharmacy.tasks.MedicationReminder.objects.filter')
-    def test_task_handles_email_send_failure_gracefully(self, mock_filter, mock_is_due, mock_send_email, mock_logger):
+    def test_task_handles_email_send_failure_gracefully(self, mock_send_email, mock_logger):
         """Test that task handles email send failures gracefully"""
         from pharmacy.tasks import send_medication_reminders_task
         
-        # Create mock queryset
-        mock_queryset = MagicMock()
-        mock_queryset.exists.return_value = True
-        mock_queryset.count.return_value = 1
-        mock_queryset.__iter__.return_value = iter([self.reminder])
-        
-        mock_filter.return_value.filter.return_value.select_related.return_value.prefetch_related.return_value = mock_queryset
-        mock_is_due.return_value = True
+        MedicationReminder.objects.filter(pk=self.reminder.pk).update(next_fire_at=timezone.now() - timedelta(minutes=1))
         
         # Mock email send to raise exception
         mock_send_email.side_effect = Exception('Email service unavailable')
@@ -450,6 +536,270 @@ class MedicationReminderTest(TestCase):
         self.assertIsNotNone(result)
 
 
+class StockReservationTest(TestCase):
+    """Order holds on inventory across the order lifecycle"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='patient', email='patient@test.com', password='testpass123')
+        doctor = Doctor.objects.create(
+            first_name="Sarah", last_name="Johnson", gender="F", years_of_experience=8,
+            education="MD", bio="General practitioner", languages_spoken="English"
+        )
+        self.pharmacy = Pharmacy.objects.create(
+            name="TestPharm", address="123 Test St", phone_number="+1234567890",
+            location=Point(3.3792, 6.5244), operating_hours="9-5", is_active=True
+        )
+        self.medication = Medication.objects.create(
+            name="Amoxicillin", description="Antibiotic", dosage_form="Capsule", strength="500mg"
+        )
+        appointment = Appointment.objects.create(
+            user=self.user, doctor=doctor, date=timezone.now().date(), start_time=time(10, 0), end_time=time(11, 0),
+            appointment_type=Appointment.TypeChoices.IN_PERSON, status=Appointment.StatusChoices.COMPLETED,
+            reason="Medical consultation"
+        )
+        self.prescription = Prescription.objects.create(
+            appointment=appointment, user=self.user, doctor=doctor, diagnosis="Bacterial infection"
+        )
+        PrescriptionItem.objects.create(
+            prescription=self.prescription, medication=self.medication, medication_name=self.medication.name,
+            dosage="500mg", frequency="Twice daily", duration="7 days"
+        )
+
+    def test_stock_reservation_lifecycle(self):
+        from .orders import create_medication_order
+        from .reservations import InsufficientStockError, release_expired_reservations
+
+        inventory = PharmacyInventory.objects.create(
+            pharmacy=self.pharmacy, medication=self.medication, in_stock=True, quantity=2, price=10
+        )
+        cancelled = create_medication_order(self.user, self.pharmacy, prescription=self.prescription)
+        completed = create_medication_order(self.user, self.pharmacy, prescription=self.prescription)
+        inventory.refresh_from_db()
+        self.assertEqual((inventory.quantity, inventory.reserved_quantity), (2, 2))
+
+        # Nothing left to hold: the order is not created
+        orders_before = MedicationOrder.objects.count()
+        with self.assertRaises(InsufficientStockError):
+            create_medication_order(self.user, self.pharmacy, prescription=self.prescription)
+        self.assertEqual(MedicationOrder.objects.count(), orders_before)
+
+        cancelled.status = 'cancelled'
+        cancelled.save()
+        completed.status = 'completed'
+        completed.save()
+        inventory.refresh_from_db()
+        self.assertEqual((inventory.quantity, inventory.reserved_quantity), (1, 0))
+        self.assertEqual(cancelled.reservations.get().status, StockReservation.StatusChoices.RELEASED)
+        self.assertEqual(completed.reservations.get().status, StockReservation.StatusChoices.COMMITTED)
+
+        # An untouched pending order gives its hold back once the TTL passes
+        pending = create_medication_order(self.user, self.pharmacy, prescription=self.prescription)
+        self.assertEqual(release_expired_reservations(now=timezone.now()), 0)
+        self.assertEqual(release_expired_reservations(now=timezone.now() + timedelta(days=1)), 1)
+        inventory.refresh_from_db()
+        self.assertEqual(inventory.reserved_quantity, 0)
+        self.assertEqual(pending.reservations.get().status, StockReservation.StatusChoices.RELEASED)
+
+    def test_order_completed_after_its_hold_lapsed_takes_the_stock_again(self):
+        from .orders import create_medication_order
+        from .reservations import InsufficientStockError, release_expired_reservations
+
+        inventory = PharmacyInventory.objects.create(
+            pharmacy=self.pharmacy, medication=self.medication, in_stock=True, quantity=2, price=10
+        )
+        order = create_medication_order(self.user, self.pharmacy, prescription=self.prescription)
+        self.assertEqual(release_expired_reservations(now=timezone.now() + timedelta(days=1)), 1)
+        rival = create_medication_order(self.user, self.pharmacy, prescription=self.prescription)
+        create_medication_order(self.user, self.pharmacy, prescription=self.prescription)
+
+        # Both units are held by other orders now: completing is refused and nothing changes
+        order.status = 'completed'
+        with self.assertRaises(InsufficientStockError):
+            order.save()
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'pending')
+
+        rival.status = 'cancelled'
+        rival.save()
+        order.status = 'completed'
+        order.save()
+        inventory.refresh_from_db()
+        self.assertEqual((inventory.quantity, inventory.reserved_quantity), (1, 1))
+        self.assertEqual(
+            sorted(order.reservations.values_list('status', flat=True)),
+            sorted([StockReservation.StatusChoices.RELEASED, StockReservation.StatusChoices.COMMITTED])
+        )
+
+
+class StockReservationConcurrencyTest(TransactionTestCase):
+    """Concurrent orders for the same SKU must never hold more than is on the shelf"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='patient', email='patient@test.com', password='testpass123')
+        doctor = Doctor.objects.create(
+            first_name="Sarah", last_name="Johnson", gender="F", years_of_experience=8,
+            education="MD", bio="General practitioner", languages_spoken="English"
+        )
+        self.pharmacy = Pharmacy.objects.create(
+            name="TestPharm", address="123 Test St", phone_number="+1234567890",
+            location=Point(3.3792, 6.5244), operating_hours="9-5", is_active=True
+        )
+        medication = Medication.objects.create(
+            name="Amoxicillin", description="Antibiotic", dosage_form="Capsule", strength="500mg"
+        )
+        self.inventory = PharmacyInventory.objects.create(
+            pharmacy=self.pharmacy, medication=medication, in_stock=True, quantity=3, price=10
+        )
+        appointment = Appointment.objects.create(
+            user=self.user, doctor=doctor, date=timezone.now().date(), start_time=time(10, 0), end_time=time(11, 0),
+            appointment_type=Appointment.TypeChoices.IN_PERSON, status=Appointment.StatusChoices.COMPLETED,
+            reason="Medical consultation"
+        )
+        self.prescription = Prescription.objects.create(
+            appointment=appointment, user=self.user, doctor=doctor, diagnosis="Bacterial infection"
+        )
+        PrescriptionItem.objects.create(
+            prescription=self.prescription, medication=medication, medication_name=medication.name,
+            dosage="500mg", frequency="Twice daily", duration="7 days"
+        )
+
+    @patch('pharmacy.order_events.publish_order_event')
+    def test_concurrent_orders_do_not_oversell(self, mock_publish):
+        import threading
+        from django.db import connection
+        from .orders import create_medication_order
+        from .reservations import InsufficientStockError
+
+        workers = 8
+        barrier = threading.Barrier(workers)
+        outcomes = []
+
+        def place_order():
+            try:
+                barrier.wait()
+                create_medication_order(self.user, self.pharmacy, prescription=self.prescription)
+                outcomes.append('created')
+            except InsufficientStockError:
+                outcomes.append('short')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=place_order) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(outcomes.count('created'), 3)
+        self.assertEqual(outcomes.count('short'), workers - 3)
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.reserved_quantity, 3)
+        self.assertEqual(StockReservation.objects.filter(status=StockReservation.StatusChoices.HELD).count(), 3)
+        self.assertEqual(MedicationOrder.objects.count(), 3)
+
+
+class InventoryChangeFeedVisibilityTest(TransactionTestCase):
+    """A change still uncommitted when the feed is read must not be skipped once it commits"""
+
+    def test_open_transaction_holds_back_later_commits(self):
+        import threading
+        from django.db import connection, transaction
+        from .inventory_feed import decode_cursor, get_inventory_changes
+
+        pharmacy = Pharmacy.objects.create(
+            name="TestPharm", address="123 Test St", phone_number="+1234567890",
+            location=Point(3.3792, 6.5244), operating_hours="9-5", is_active=True
+        )
+        slow_med, fast_med = (
+            Medication.objects.create(name=name, description="Test", dosage_form="Tablet", strength="10mg")
+            for name in ("Slowmed", "Fastmed")
+        )
+        baseline = get_inventory_changes(pharmacy.pk)['cursor']
+        written, release = threading.Event(), threading.Event()
+
+        def long_import():
+            try:
+                with transaction.atomic():
+                    PharmacyInventory.objects.create(pharmacy=pharmacy, medication=slow_med, quantity=1, price=2)
+                    written.set()
+                    release.wait(timeout=10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=long_import)
+        thread.start()
+        try:
+            self.assertTrue(written.wait(timeout=10))
+            fast = PharmacyInventory.objects.create(pharmacy=pharmacy, medication=fast_med, quantity=1, price=2)
+            held_back = get_inventory_changes(pharmacy.pk, cursor=baseline)
+            self.assertEqual(held_back['changes'], [])
+            self.assertEqual(decode_cursor(held_back['cursor'])[:2], decode_cursor(baseline)[:2])
+        finally:
+            release.set()
+            thread.join()
+
+        feed = get_inventory_changes(pharmacy.pk, cursor=held_back['cursor'])
+        self.assertEqual(
+            {row.medication_id for row in feed['changes']}, {slow_med.pk, fast.medication_id}
+        )
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class OrderEventOrderingTest(TransactionTestCase):
+    """An order event must not commit ahead of one for the same pharmacy that is still being written"""
+
+    def test_later_event_waits_for_the_open_one(self):
+        import threading
+        from django.db import connection, transaction
+        from .order_events import events_since, publish_order_event
+
+        user = User.objects.create_user(username='patient', email='patient@test.com', password='testpass123')
+        pharmacy = Pharmacy.objects.create(
+            name="TestPharm", address="123 Test St", phone_number="+1234567890",
+            location=Point(3.3792, 6.5244), operating_hours="9-5", is_active=True
+        )
+        with patch('pharmacy.order_events.publish_order_event'):
+            slow_order = MedicationOrder.objects.create(user=user, pharmacy=pharmacy, status='pending')
+            fast_order = MedicationOrder.objects.create(user=user, pharmacy=pharmacy, status='pending')
+        written, release = threading.Event(), threading.Event()
+        published = {}
+
+        def slow_publish():
+            try:
+                with transaction.atomic():
+                    published['slow'] = publish_order_event(slow_order.pk, 'created')
+                    written.set()
+                    release.wait(timeout=10)
+            finally:
+                connection.close()
+
+        def fast_publish():
+            try:
+                published['fast'] = publish_order_event(fast_order.pk, 'created')
+            finally:
+                connection.close()
+
+        slow = threading.Thread(target=slow_publish)
+        fast = threading.Thread(target=fast_publish)
+        slow.start()
+        try:
+            self.assertTrue(written.wait(timeout=10))
+            fast.start()
+            fast.join(timeout=1)
+            # Still queued behind the open event, so no replay can hand out its id
+            self.assertTrue(fast.is_alive())
+            self.assertEqual(events_since(pharmacy.pk, 0), [])
+        finally:
+            release.set()
+            slow.join()
+            if fast.is_alive():
+                fast.join()
+
+        self.assertLess(published['slow'].id, published['fast'].id)
+        replay = events_since(pharmacy.pk, published['slow'].id - 1)
+        self.assertEqual([e['id'] for e in replay], [published['slow'].id, published['fast'].id])
+
+
 class MedicationOrderTest(APITestCase):
     """Test medication order functionality"""
     
@@ -502,6 +852,31 @@ class MedicationOrderTest(APITestCase):
         self.assertEqual(order.pharmacy, self.pharmacy)
         self.assertTrue(order.is_delivery)
     
+    @override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+    def test_order_events_recorded_for_pharmacy_and_replayable(self):
+        from .models import PharmacyOrderEvent
+        from .order_events import events_since
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order = MedicationOrder.objects.create(user=self.user, pharmacy=self.pharmacy, status='pending')
+        first_id = PharmacyOrderEvent.objects.get(order=order).id
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.payment_status = 'paid'
+            order.status = 'processing'
+            order.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            order.notes = 'No change to status'
+            order.save()
+
+        self.assertEqual(
+            list(PharmacyOrderEvent.objects.filter(order=order).order_by('id').values_list('event', flat=True)),
+            ['created', 'paid', 'status_changed']
+        )
+        replay = events_since(self.pharmacy.id, first_id)
+        self.assertEqual([e['event'] for e in replay], ['paid', 'status_changed'])
+        self.assertEqual(replay[-1]['order']['status'], 'processing')
+
     def test_order_status_workflow(self):
         """Test medication order status transitions"""
         order = MedicationOrder.objects.create(
@@ -3,10 +3,10 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     PharmacyListView, PharmacyOrderListView, PharmacyOrderDetailView,
-    MedicationListView, PharmacyInventoryListView, MedicationOrderListCreateView,
+    MedicationListView, MedicationAutocompleteView, MedicationPriceComparisonView, PharmacyInventoryListView, PharmacyInventoryChangesView, MedicationOrderListCreateView,
     MedicationOrderDetailView, ConfirmPickupView, MedicationReminderListCreateView, MedicationReminderDetailView,
-    CreateOrderFromPrescriptionView, PharmacyDetailView,
-    MedicationLogListCreateView, LogMedicationIntakeView,
+    CreateOrderFromPrescriptionView, PrescriptionPharmacyMatchView, PharmacyDetailView,
+    MedicationLogListCreateView, LogMedicationIntakeView, MedicationAdherenceView,
     PharmacyInventoryPortalViewSet, PharmacyBankDetailsView, VerifyBankAccountView
 )
 
@@ -17,11 +17,15 @@ urlpatterns = [
     path('', PharmacyListView.as_view(), name='pharmacy-list'),
     path('<int:pk>/', PharmacyDetailView.as_view(), name='pharmacy-detail'),
     path('medications/', MedicationListView.as_view(), name='medication-list'),
+    path('medications/autocomplete/', MedicationAutocompleteView.as_view(), name='medication-autocomplete'),
+    path('medications/<int:pk>/prices/', MedicationPriceComparisonView.as_view(), name='medication-price-comparison'),
     path('<int:pharmacy_id>/inventory/', PharmacyInventoryListView.as_view(), name='pharmacy-inventory'),
+    path('<int:pharmacy_id>/inventory/changes/', PharmacyInventoryChangesView.as_view(), name='pharmacy-inventory-changes'),
     path('portal/orders/', PharmacyOrderListView.as_view(), name='pharmacy-order-list'),
     path('portal/orders/<int:pk>/', PharmacyOrderDetailView.as_view(), name='pharmacy-order-detail'),
     path('portal/onboarding/bank/', PharmacyBankDetailsView.as_view(), name='pharmacy-bank-details'),
     path('portal/verify-account/', VerifyBankAccountView.as_view(), name='pharmacy-verify-account'),
+    path('prescriptions/<int:prescription_id>/pharmacy_matches/', PrescriptionPharmacyMatchView.as_view(), name='prescription-pharmacy-matches'),
     path('prescriptions/<int:prescription_id>/create_order/', CreateOrderFromPrescriptionView.as_view(), name='prescription-create-order'),
     path('orders/', MedicationOrderListCreateView.as_view(), name='medication-order-list'),
     path('orders/<int:pk>/', MedicationOrderDetailView.as_view(), name='medication-order-detail'),
@@ -30,5 +34,7 @@ urlpatterns = [
     path('reminders/<int:pk>/', MedicationReminderDetailView.as_view(), name='medication-reminder-detail'),
     path('logs/', MedicationLogListCreateView.as_view(), name='medication-log-list'),
     path('reminders/<int:reminder_id>/log/', LogMedicationIntakeView.as_view(), name='medication-log-intake'),
+    path('adherence/', MedicationAdherenceView.as_view(), name='medication-adherence'),
+    path('reminders/<int:reminder_id>/adherence/', MedicationAdherenceView.as_view(), name='medication-reminder-adherence'),
     path('', include(router.urls)),  # Include router URLs for portal inventory
 ]
\ No newline at end of file
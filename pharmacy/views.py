@@ -4,27 +4,70 @@ from rest_framework.routers import DefaultRouter
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.serializers import ValidationError
 from rest_framework.response import Response
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.parsers import MultiPartParser
 from notifications.utils import create_notification
-from pharmacy.models import Pharmacy, Medication, PharmacyInventory, MedicationOrder, MedicationOrderItem, MedicationReminder, MedicationLog
+from pharmacy.models import Pharmacy, PharmacyOpeningInterval, Medication, PharmacyInventory, MedicationPriceSummary, MedicationOrder, MedicationOrderItem, MedicationReminder, MedicationLog
 from pharmacy.serializers import (
     PharmacySerializer, PharmacyOrderListSerializer,
     PharmacyOrderDetailSerializer, PharmacyOrderUpdateSerializer,
     MedicationSerializer, PharmacyInventorySerializer,
     MedicationOrderSerializer, MedicationReminderSerializer,
-    MedicationLogSerializer
+    MedicationLogSerializer, PharmacyMatchSerializer,
+    PharmacyInventoryChangeSerializer, PharmacyInventoryTombstoneSerializer,
+    MedicationPriceSummarySerializer
 )
+from .inventory_feed import get_inventory_changes, DEFAULT_LIMIT as FEED_DEFAULT_LIMIT, MAX_LIMIT as FEED_MAX_LIMIT
+from .inventory_import import import_inventory, detect_format, FORMATS as IMPORT_FORMATS
+from .orders import create_medication_order
+from .reservations import InsufficientStockError
+from .medication_search import (
+    autocomplete_medications, search_medications, find_or_create_medication, AUTOCOMPLETE_LIMIT
+)
+from .matching import match_pharmacies, DEFAULT_RADIUS_KM, MAX_RADIUS_KM, DEFAULT_LIMIT as DEFAULT_MATCH_LIMIT
+from .price_index import nearby_cheapest
+from .adherence import adherence_history, GRANULARITIES as ADHERENCE_GRANULARITIES, MAX_HISTORY_DAYS as MAX_ADHERENCE_DAYS
 from .permissions import IsPharmacyStaffOfOrderPharmacy
+from vitanips.core.operating_hours import open_at_filter, requested_open_time
 from doctors.models import Prescription, PrescriptionItem, Appointment
 from django.shortcuts import get_object_or_404
 from django.db import transaction
 from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.contrib.gis.geos import Point
 from django.contrib.gis.measure import D
 from django.contrib.gis.db.models.functions import Distance
+from datetime import timedelta
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Fields for medications created on the fly from a free-text name
+PLACEHOLDER_MEDICATION_DEFAULTS = {
+    'description': 'Medication details to be updated.',
+    'dosage_form': 'Unknown',
+    'strength': 'N/A',
+}
+
+
+def parse_point(query_params):
+    """Point for the lat/lon query params, or None if they are missing or invalid."""
+    latitude = query_params.get('lat')
+    longitude = query_params.get('lon')
+    if not (latitude and longitude):
+        return None
+    try:
+        lat_float = float(latitude)
+        lon_float = float(longitude)
+        if not (-90 <= lat_float <= 90 and -180 <= lon_float <= 180):
+            raise ValueError("Latitude or longitude out of valid range.")
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Invalid location parameters for proximity search: lat='{latitude}', lon='{longitude}'. Error: {e}")
+        return None
+    return Point(lon_float, lat_float, srid=4326) # Lon, Lat order for Point
+
 
 class PharmacyDetailView(generics.RetrieveAPIView):
     queryset = Pharmacy.objects.all()
@@ -37,50 +80,34 @@ class PharmacyListView(generics.ListAPIView):
     permission_classes = [permissions.AllowAny]
     filter_backends = [filters.SearchFilter]
     search_fields = ['name', 'address']
+    max_nearest = 50
+
+    def get_user_location(self):
+        return parse_point(self.request.query_params)
+
+    def get_nearest_limit(self):
+        """Number of results requested with ?nearest=N, capped at max_nearest."""
+        nearest = self.request.query_params.get('nearest')
+        if nearest is None:
+            return None
+        try:
+            limit = int(nearest)
+            if limit <= 0:
+                raise ValueError("nearest must be positive.")
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Invalid nearest parameter for proximity search: nearest='{nearest}'. Error: {e}")
+            return None
+        return min(limit, self.max_nearest)
 
     def get_queryset(self):
         """
         Filter pharmacies by proximity using GeoDjango if lat, lon, and radius params are provided.
+        ?open_now=true or ?open_at=<ISO datetime> keeps pharmacies open at that time.
+        With ?nearest=N the radius is ignored; the N closest pharmacies are
+        selected in filter_queryset once the other filters have been applied.
         """
         queryset = Pharmacy.objects.all()
 
-        # --- Proximity Filtering ---
-        latitude = self.request.query_params.get('lat')
-        longitude = self.request.query_params.get('lon')
-        radius_km_str = self.request.query_params.get('radius', default=5)  # Default radius 5km
-
-        if latitude and longitude:
-            try:
-                lat_float = float(latitude)
-                lon_float = float(longitude)
-                radius_km_float = float(radius_km_str)
-
-                if not (-90 <= lat_float <= 90 and -180 <= lon_float <= 180):
-                    raise ValueError("Latitude or longitude out of valid range.")
-                if not (0 < radius_km_float <= 200): # Example: Max radius 200km
-                    raise ValueError("Search radius out of valid range.")
-
-                user_location = Point(lon_float, lat_float, srid=4326) # Lon, Lat order for Point
-                queryset = queryset.filter(
-                    location__distance_lte=(user_location, D(km=radius_km_float))
-                ).annotate(distance=Distance('location', user_location)).order_by('distance') # Optionally order by distance
-                # Note: .order_by('distance') might override your default .order_by('name')
-                # You might want to apply distance ordering only if location filter is active.
-
-            except (ValueError, TypeError) as e:
-                logger.warning(
-                    f"Invalid location parameters for proximity search: "
-                    f"lat='{latitude}', lon='{longitude}', radius='{radius_km_str}'. Error: {e}"
-                )
-                # Option: Silently ignore and don't filter by location (as it currently does by falling through)
-                # Option: If you want to inform the frontend, you'd typically raise an APIException
-                # from rest_framework.exceptions import ParseError
-                # raise ParseError("Invalid location or radius parameters provided for proximity search.")
-                # For now, we'll log and proceed without location filtering if params are bad.
-                pass
-        # --- End Proximity Filtering ---
-
-        # Add other filters here if needed (e.g., offers_delivery, is_24_hours)
         offers_delivery = self.request.query_params.get('offers_delivery')
         if offers_delivery is not None:
             queryset = queryset.filter(offers_delivery=str(offers_delivery).lower() in ['true', '1'])
@@ -89,7 +116,39 @@ class PharmacyListView(generics.ListAPIView):
         if is_24_hours is not None:
             queryset = queryset.filter(is_24_hours=str(is_24_hours).lower() in ['true', '1'])
 
-        return queryset.order_by('name')
+        try:
+            open_time = requested_open_time(self.request.query_params)
+        except ValueError:
+            raise ValidationError({'open_at': 'Must be an ISO 8601 datetime.'})
+        if open_time is not None:
+            queryset = queryset.filter(open_at_filter(PharmacyOpeningInterval, 'pharmacy', open_time))
+
+        user_location = self.get_user_location()
+        if user_location is None or self.get_nearest_limit() is not None:
+            return queryset.order_by('name')
+
+        # --- Proximity Filtering ---
+        radius_km_str = self.request.query_params.get('radius', default=5)  # Default radius 5km
+        try:
+            radius_km_float = float(radius_km_str)
+            if not (0 < radius_km_float <= 200): # Example: Max radius 200km
+                raise ValueError("Search radius out of valid range.")
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Invalid radius parameter for proximity search: radius='{radius_km_str}'. Error: {e}")
+            # For now, we'll log and proceed without location filtering if params are bad.
+            return queryset.order_by('name')
+
+        return queryset.filter(
+            location__distance_lte=(user_location, D(km=radius_km_float))
+        ).annotate(distance=Distance('location', user_location)).order_by('distance', 'name')
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        user_location = self.get_user_location()
+        limit = self.get_nearest_limit()
+        if user_location is not None and limit is not None:
+            queryset = queryset.nearest(user_location, limit)
+        return queryset
     
 class PharmacyOrderListView(generics.ListAPIView):
     """Lists orders for the logged-in pharmacy staff's pharmacy."""
@@ -126,7 +185,15 @@ class PharmacyOrderDetailView(generics.RetrieveUpdateAPIView):
         payment_reference = serializer.validated_data.pop('payment_reference', None)
         old_payment_status = old_instance.payment_status
         
-        new_instance = serializer.save()
+        try:
+            new_instance = serializer.save()
+        except InsufficientStockError as e:
+            # The order's stock hold lapsed while pending and the stock has since gone
+            from rest_framework.exceptions import ValidationError
+            raise ValidationError({
+                'status': 'This pharmacy no longer has enough stock for some of the ordered medications.',
+                'unavailable_medication_ids': sorted(e.shortages),
+            })
         
         # Update payment fields if payment_reference is provided
         payment_status_changed = False
@@ -315,11 +382,69 @@ class PharmacyOrderDetailView(generics.RetrieveUpdateAPIView):
                 traceback.print_exc()
 
 class MedicationListView(generics.ListAPIView):
-    queryset = Medication.objects.all()
     serializer_class = MedicationSerializer
     permission_classes = [permissions.AllowAny]
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['name', 'generic_name']
+
+    def get_queryset(self):
+        # ?search= matches name/generic_name substrings via the trigram indexes
+        queryset = Medication.objects.all()
+        search = self.request.query_params.get('search')
+        if search:
+            queryset = search_medications(queryset, search)
+        return queryset.order_by('name', 'id')
+
+
+class MedicationAutocompleteView(views.APIView):
+    """
+    GET ?q=<partial name>[&limit=]: medications whose name or generic name
+    starts with the text typed so far, followed by close (typo-tolerant)
+    matches.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = int(request.query_params.get('limit', AUTOCOMPLETE_LIMIT))
+        except (TypeError, ValueError):
+            limit = AUTOCOMPLETE_LIMIT
+        results = autocomplete_medications(request.query_params.get('q', ''), limit=limit)
+        return Response({'results': results})
+
+class MedicationPriceComparisonView(views.APIView):
+    """
+    GET: Price range and the cheapest pharmacies stocking a medication, read
+    from its MedicationPriceSummary. With lat/lon (and optional radius in
+    km), only those of the cheapest pharmacies near the caller are listed,
+    each with its distance.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, pk, *args, **kwargs):
+        summary = MedicationPriceSummary.objects.select_related('medication').filter(pk=pk).first()
+        if summary is None:
+            medication = get_object_or_404(Medication, pk=pk)
+            return Response({
+                'medication_id': medication.id,
+                'medication_name': medication.name,
+                'medication_strength': medication.strength,
+                'pharmacy_count': 0,
+                'pharmacies': [],
+            })
+
+        pharmacies = summary.cheapest
+        point = parse_point(request.query_params)
+        if point is not None:
+            try:
+                radius_km = float(request.query_params.get('radius', DEFAULT_RADIUS_KM))
+                if not 0 < radius_km <= MAX_RADIUS_KM:
+                    raise ValueError
+            except (ValueError, TypeError):
+                return Response(
+                    {"error": f"radius must be between 0 and {MAX_RADIUS_KM} km."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            pharmacies = nearby_cheapest(summary, point, radius_km)
+        return Response({**MedicationPriceSummarySerializer(summary).data, 'pharmacies': pharmacies})
 
 class PharmacyInventoryListView(generics.ListAPIView):
     serializer_class = PharmacyInventorySerializer
@@ -329,6 +454,36 @@ class PharmacyInventoryListView(generics.ListAPIView):
         return PharmacyInventory.objects.filter(pharmacy_id=self.kwargs['pharmacy_id'], in_stock=True)
 
 
+class PharmacyInventoryChangesView(views.APIView):
+    """
+    GET: Inventory rows changed and deleted since `cursor` for one pharmacy.
+    Omit the cursor for a full sync; pass back the returned cursor on the next
+    call and keep paging while `has_more`. On `reset` the client should drop
+    its local copy and apply the response as a full sync.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, pharmacy_id, *args, **kwargs):
+        get_object_or_404(Pharmacy, pk=pharmacy_id)
+        try:
+            limit = min(int(request.query_params.get('limit', FEED_DEFAULT_LIMIT)), FEED_MAX_LIMIT)
+            if limit <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            return Response({"error": "limit must be a positive integer."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            feed = get_inventory_changes(pharmacy_id, cursor=request.query_params.get('cursor'), limit=limit)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'changes': PharmacyInventoryChangeSerializer(feed['changes'], many=True).data,
+            'deleted': PharmacyInventoryTombstoneSerializer(feed['deleted'], many=True).data,
+            'cursor': feed['cursor'],
+            'has_more': feed['has_more'],
+            'reset': feed['reset'],
+        })
+
+
 class PharmacyInventoryPortalViewSet(viewsets.ModelViewSet):
     """
     ViewSet for pharmacy staff to manage their own pharmacy's inventory.
@@ -355,6 +510,67 @@ class PharmacyInventoryPortalViewSet(viewsets.ModelViewSet):
         else:
             raise permissions.PermissionDenied("You must be assigned to a pharmacy to manage inventory.")
 
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def bulk_import(self, request):
+        """
+        Upsert inventory from an uploaded CSV or NDJSON price list (`file`).
+        The format comes from `format` or the file extension. Returns row
+        counts and row-level errors.
+        """
+        pharmacy = getattr(request.user, 'works_at_pharmacy', None)
+        if not pharmacy:
+            raise PermissionDenied("You must be assigned to a pharmacy to manage inventory.")
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({"error": "A 'file' upload is required."}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.data.get('format') or detect_format(upload.name)
+        if fmt not in IMPORT_FORMATS:
+            return Response(
+                {"error": f"Unsupported format '{fmt}'. Use one of: {', '.join(IMPORT_FORMATS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        report = import_inventory(pharmacy, upload, fmt)
+        logger.info(f"Inventory import for pharmacy {pharmacy.id}: {report.upserted} upserted, {report.error_count} errors")
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
+
+class PrescriptionPharmacyMatchView(views.APIView):
+    """
+    GET: Nearby pharmacies ranked by how many items of the prescription they
+    can fill from stock, then by total price. Requires lat/lon; optional
+    radius (km) and limit.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, prescription_id, *args, **kwargs):
+        prescription = get_object_or_404(Prescription, pk=prescription_id, user=request.user)
+
+        point = parse_point(request.query_params)
+        if point is None:
+            return Response(
+                {"error": "Valid lat and lon query parameters are required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            radius_km = float(request.query_params.get('radius', DEFAULT_RADIUS_KM))
+            limit = int(request.query_params.get('limit', DEFAULT_MATCH_LIMIT))
+            if not (0 < radius_km <= MAX_RADIUS_KM) or limit <= 0:
+                raise ValueError
+        except (ValueError, TypeError):
+            return Response(
+                {"error": f"radius must be between 0 and {MAX_RADIUS_KM} km and limit must be positive."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        total_items = prescription.items.count()
+        matches = match_pharmacies(prescription, point, radius_km=radius_km, limit=min(limit, 50))
+        serializer = PharmacyMatchSerializer(matches, many=True, context={'total_items': total_items})
+        return Response({
+            'prescription_id': prescription.id,
+            'total_items': total_items,
+            'results': serializer.data,
+        })
+
+
 class CreateOrderFromPrescriptionView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -460,8 +676,8 @@ class CreateOrderFromPrescriptionView(views.APIView):
 
 
         # --- Validation 5: Check if Prescription Has Items ---
-        prescription_items = PrescriptionItem.objects.filter(prescription=prescription)
-        if not prescription_items.exists():
+        prescription_items = list(PrescriptionItem.objects.filter(prescription=prescription))
+        if not prescription_items:
             return Response(
                 {"error": "Prescription has no items to order."},
                 status=status.HTTP_400_BAD_REQUEST
@@ -469,16 +685,6 @@ class CreateOrderFromPrescriptionView(views.APIView):
         # --- End Validation 5 ---
 
 
-        # --- Handle Insurance if provided ---
-        user_insurance = None
-        user_insurance_id = request.data.get('user_insurance_id')
-        if user_insurance_id:
-            from insurance.models import UserInsurance
-            try:
-                user_insurance = UserInsurance.objects.get(id=user_insurance_id, user=request.user)
-            except UserInsurance.DoesNotExist:
-                pass  # Continue without insurance if invalid
-        
         # --- Handle Payment if no insurance ---
         payment_reference = request.data.get('payment_reference', None)
         
@@ -488,64 +694,31 @@ class CreateOrderFromPrescriptionView(views.APIView):
         if payment_reference:
             payment_status = 'paid'
         
-        # --- Create Order and Items (If all validations pass) ---
-        order = MedicationOrder.objects.create(
-            user=request.user,
-            pharmacy=pharmacy,
-            prescription=prescription,
-            status='pending', # Default status for new orders
-            user_insurance=user_insurance,
-            payment_reference=payment_reference,
-            payment_status=payment_status,
-            # is_delivery, delivery_address, total_amount, notes would be set later by user/pharmacy
-        )
-
-        # Create order items one by one to ensure IDs are set (bulk_create doesn't return IDs on all databases)
-        for p_item in prescription_items:
-            MedicationOrderItem.objects.create(
-                order=order,
-                prescription_item=p_item,
-                medication_name_text=p_item.medication_name,
-                dosage_text=p_item.dosage,
-                quantity=1, # Default quantity, pharmacy might adjust
-                # price_per_unit will be filled by pharmacy later
+        # --- Create Order, Items and Staff Notifications (If all validations pass) ---
+        try:
+            order = create_medication_order(
+                request.user,
+                pharmacy,
+                prescription=prescription,
+                prescription_items=prescription_items,
+                status='pending', # Default status for new orders
+                user_insurance=user_insurance,
+                payment_reference=payment_reference,
+                payment_status=payment_status,
+                # is_delivery, delivery_address, total_amount, notes would be set later by user/pharmacy
+            )
+        except InsufficientStockError as e:
+            return Response(
+                {
+                    "error": "This pharmacy does not have enough stock for some of the prescribed medications.",
+                    "unavailable_medication_ids": sorted(e.shortages),
+                },
+                status=status.HTTP_409_CONFLICT
             )
 
-        # Refresh the order from database to ensure items are accessible
-        order.refresh_from_db()
-        
         # Prefetch related items for serialization
         order = MedicationOrder.objects.prefetch_related('items__prescription_item').get(pk=order.pk)
 
-        # Send notifications to all pharmacy staff members
-        try:
-            from users.models import User
-            pharmacy_staff = User.objects.filter(
-                is_pharmacy_staff=True,
-                works_at_pharmacy=pharmacy,
-                is_active=True
-            )
-            
-            patient_name = f"{request.user.first_name} {request.user.last_name}".strip() or request.user.email
-            prescription_items_count = prescription_items.count()
-            
-            for staff_member in pharmacy_staff:
-                create_notification(
-                    recipient=staff_member,
-                    verb=f"New medication order #{order.id} received from {patient_name}. Prescription includes {prescription_items_count} medication(s).",
-                    title=f"New Order #{order.id}",
-                    level='info',
-                    category='order',
-                    actor=request.user,
-                    action_url=f"/portal/orders/{order.id}",
-                    action_text="View Order"
-                )
-            logger.info(f"Created notifications for {pharmacy_staff.count()} pharmacy staff members for order {order.id}")
-        except Exception as e:
-            logger.error(f"Error creating notifications for pharmacy staff for order {order.id}: {e}")
-            import traceback
-            traceback.print_exc()
-
         # Serialize the newly created order
         try:
             serializer = MedicationOrderSerializer(order)
@@ -588,53 +761,9 @@ class MedicationOrderListCreateView(generics.ListCreateAPIView):
             except UserInsurance.DoesNotExist:
                 pass  # Continue without insurance if invalid
         
-        order = serializer.save(user=self.request.user, user_insurance=user_insurance)
-        
-        # Send notifications to all pharmacy staff members
-        if order.pharmacy:
-            try:
-                from users.models import User
-                pharmacy_staff = User.objects.filter(
-                    is_pharmacy_staff=True,
-                    works_at_pharmacy=order.pharmacy,
-                    is_active=True
-                )
-                
-                patient_name = f"{self.request.user.first_name} {self.request.user.last_name}".strip() or self.request.user.email
-                items_count = order.items.count() if hasattr(order, 'items') else 0
-                
-                for staff_member in pharmacy_staff:
-                    create_notification(
-                        recipient=staff_member,
-                        verb=f"New medication order #{order.id} received from {patient_name}. Order includes {items_count} medication(s).",
-                        title=f"New Order #{order.id}",
-                        level='info',
-                        category='order',
-                        actor=self.request.user,
-                        action_url=f"/portal/orders/{order.id}",
-                        action_text="View Order"
-                    )
-                logger.info(f"Created notifications for {pharmacy_staff.count()} pharmacy staff members for order {order.id}")
-            except Exception as e:
-                logger.error(f"Error creating notifications for pharmacy staff for order {order.id}: {e}")
-                import traceback
-                traceback.print_exc()
-        
-        # Calculate insurance coverage if insurance is selected and total_amount is set
-        if user_insurance and order.total_amount:
-            from insurance.utils import calculate_insurance_coverage
-            from decimal import Decimal
-            
-            total_amount = Decimal(str(order.total_amount))
-            coverage = calculate_insurance_coverage(
-                user_insurance,
-                total_amount,
-                service_type='medication'
-            )
-            
-            order.insurance_covered_amount = coverage['covered_amount']
-            order.patient_copay = coverage['patient_copay']
-            order.save()
+        # Items, insurance coverage and staff notifications are handled by
+        # pharmacy.orders.create_medication_order via the serializer
+        serializer.save(user=self.request.user, user_insurance=user_insurance)
 
 
 class PharmacyBankDetailsView(views.APIView):
@@ -894,23 +1023,13 @@ class MedicationOrderDetailView(generics.RetrieveUpdateDestroyAPIView):
             logger.info(f"Order {new_instance.id} current payment_status before update: {new_instance.payment_status}")
             logger.info(f"Order {new_instance.id} current payment_reference before update: {new_instance.payment_reference}")
             
-            # Use update() to ensure atomic update
-            from pharmacy.models import MedicationOrder
-            updated_count = MedicationOrder.objects.filter(pk=new_instance.id).update(
-                payment_reference=payment_reference,
-                payment_status='paid'
-            )
-            
-            if updated_count > 0:
-                logger.info(f"✓ Order {new_instance.id} payment fields updated successfully via QuerySet.update()")
-                # Refresh the instance to get updated values
-                new_instance.refresh_from_db(fields=['payment_reference', 'payment_status'])
-                logger.info(f"Order {new_instance.id} payment_status after refresh: {new_instance.payment_status}")
-                logger.info(f"Order {new_instance.id} payment_reference after refresh: {new_instance.payment_reference}")
-                payment_status_changed = (old_payment_status != 'paid' and new_instance.payment_status == 'paid')
-            else:
-                logger.error(f"❌ Failed to update order {new_instance.id} - no rows affected")
-        
+            # save() rather than QuerySet.update() so the PAID order event is published
+            new_instance.payment_reference = payment_reference
+            new_instance.payment_status = 'paid'
+            new_instance.save(update_fields=['payment_reference', 'payment_status'])
+            logger.info(f"✓ Order {new_instance.id} payment fields updated successfully")
+            payment_status_changed = (old_payment_status != 'paid' and new_instance.payment_status == 'paid')
+
         # Send notification when payment is confirmed
         if payment_status_changed:
             try:
@@ -985,14 +1104,7 @@ class MedicationReminderListCreateView(generics.ListCreateAPIView):
         medication_name = self.request.data.get('medication_name')
         medication_instance = None
         if medication_name:
-            medication_instance, _ = Medication.objects.get_or_create(
-                name__iexact=medication_name,
-                defaults={
-                    'description': 'Medication details to be updated.',
-                    'dosage_form': 'Unknown',
-                    'strength': 'N/A',
-                }
-            )
+            medication_instance = find_or_create_medication(medication_name, PLACEHOLDER_MEDICATION_DEFAULTS)
         if medication_instance:
             serializer.save(user=self.request.user, medication=medication_instance)
         else:
@@ -1012,14 +1124,7 @@ class MedicationReminderDetailView(generics.RetrieveUpdateDestroyAPIView):
         medication_instance = None
         
         if medication_name:
-            medication_instance, _ = Medication.objects.get_or_create(
-                name__iexact=medication_name,
-                defaults={
-                    'description': 'Medication details to be updated.',
-                    'dosage_form': 'Unknown',
-                    'strength': 'N/A',
-                }
-            )
+            medication_instance = find_or_create_medication(medication_name, PLACEHOLDER_MEDICATION_DEFAULTS)
         
         if medication_instance:
             serializer.save(medication=medication_instance)
@@ -1052,37 +1157,71 @@ class LogMedicationIntakeView(views.APIView):
         reminder = get_object_or_404(MedicationReminder, pk=reminder_id, user=request.user)
         
         status_value = request.data.get('status', 'taken')
+        if status_value not in dict(MedicationLog.STATUS_CHOICES):
+            return Response({"error": "status must be one of taken, missed or skipped."}, status=status.HTTP_400_BAD_REQUEST)
         taken_at = request.data.get('taken_at') # Optional override
+        if taken_at:
+            taken_at = parse_datetime(str(taken_at))
+            if taken_at is None:
+                return Response({"error": "taken_at must be an ISO 8601 datetime."}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(taken_at):
+                taken_at = timezone.make_aware(taken_at)
         notes = request.data.get('notes', '')
         
+        now = timezone.now()
         if not taken_at and status_value == 'taken':
-            from django.utils import timezone
-            taken_at = timezone.now()
-            
+            taken_at = now
+
+        # Attribute the log to that day's scheduled dose so adherence rollups
+        # and the nightly missed-dose pass agree on which dose it covers
+        logged_at = taken_at or now
+        scheduled_time = reminder.occurrence_on(timezone.localtime(logged_at).date()) or logged_at
+
         # Create the log entry
         log = MedicationLog.objects.create(
             reminder=reminder,
-            scheduled_time=taken_at or timezone.now(), # Simplified logic; ideally match to next schedule
+            scheduled_time=scheduled_time,
             taken_at=taken_at,
             status=status_value,
             notes=notes
         )
         
         return Response(MedicationLogSerializer(log).data, status=status.HTTP_201_CREATED)
-        taken_at = request.data.get('taken_at') # Optional override
-        notes = request.data.get('notes', '')
-        
-        if not taken_at and status_value == 'taken':
-            from django.utils import timezone
-            taken_at = timezone.now()
-            
-        # Create the log entry
-        log = MedicationLog.objects.create(
-            reminder=reminder,
-            scheduled_time=taken_at or timezone.now(), # Simplified logic; ideally match to next schedule
-            taken_at=taken_at,
-            status=status_value,
-            notes=notes
-        )
-        
-        return Response(MedicationLogSerializer(log).data, status=status.HTTP_201_CREATED)
\ No newline at end of file
+
+
+class MedicationAdherenceView(views.APIView):
+    """
+    GET: Adherence over time for the user's reminders (or one reminder when
+    reached through reminders/<id>/adherence/), read from the daily rollups.
+    Query params: from / to (YYYY-MM-DD, default the last 30 days) and
+    granularity (day, week or month).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, reminder_id=None, *args, **kwargs):
+        today = timezone.localdate()
+        try:
+            end = parse_date(request.query_params['to']) if request.query_params.get('to') else today
+            start = parse_date(request.query_params['from']) if request.query_params.get('from') else end - timedelta(days=29)
+            if start is None or end is None:
+                raise ValueError
+        except (ValueError, TypeError):
+            return Response({"error": "from and to must be dates (YYYY-MM-DD)."}, status=status.HTTP_400_BAD_REQUEST)
+        if start > end or (end - start).days > MAX_ADHERENCE_DAYS:
+            return Response(
+                {"error": f"from must not be after to, and the range may span at most {MAX_ADHERENCE_DAYS} days."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        granularity = request.query_params.get('granularity', 'day')
+        if granularity not in ADHERENCE_GRANULARITIES:
+            return Response({"error": "granularity must be day, week or month."}, status=status.HTTP_400_BAD_REQUEST)
+
+        series, totals = adherence_history(request.user, start, end, granularity=granularity, reminder_id=reminder_id)
+        return Response({
+            'reminder_id': reminder_id,
+            'from': start,
+            'to': end,
+            'granularity': granularity,
+            'totals': totals,
+            'series': series,
+        })
@@ -20,7 +20,8 @@ try:
     from channels.routing import ProtocolTypeRouter, URLRouter
     from channels.auth import AuthMiddlewareStack
     from channels.security.websocket import AllowedHostsOriginValidator
-    from notifications.routing import websocket_urlpatterns
+    from notifications.routing import websocket_urlpatterns as notification_urlpatterns
+    from pharmacy.routing import websocket_urlpatterns as pharmacy_urlpatterns
     
     # Use ASGI with WebSocket support
     application = ProtocolTypeRouter({
@@ -28,7 +29,7 @@ try:
         "websocket": AllowedHostsOriginValidator(
             AuthMiddlewareStack(
                 URLRouter(
-                    websocket_urlpatterns
+                    notification_urlpatterns + pharmacy_urlpatterns
                 )
             )
         ),
@@ -12,13 +12,37 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 app.conf.beat_schedule = {
-    'send-appointment-reminders-every-15-mins': {
-        'task': 'doctors.tasks.send_appointment_reminders_task',
-        'schedule': crontab(minute='*/15'),
+    'dispatch-appointment-reminders-every-minute': {
+        'task': 'notifications.tasks.dispatch_appointment_reminders',
+        'schedule': crontab(minute='*'),
     },
-    'send-medication-reminders-daily': {
+    'send-medication-reminders-every-minute': {
         'task': 'pharmacy.tasks.send_medication_reminders_task',
-        'schedule': crontab(hour=8, minute=0),
+        'schedule': crontab(minute='*'),
+    },
+    'prune-inventory-tombstones-daily': {
+        'task': 'pharmacy.tasks.prune_inventory_tombstones_task',
+        'schedule': crontab(hour=3, minute=30),
+    },
+    'prune-pharmacy-order-events-daily': {
+        'task': 'pharmacy.tasks.prune_order_events_task',
+        'schedule': crontab(hour=3, minute=45),
+    },
+    'geocode-missing-pharmacy-locations': {
+        'task': 'pharmacy.tasks.geocode_missing_pharmacy_locations',
+        'schedule': crontab(minute='*/5'),
+    },
+    'release-expired-stock-reservations-every-minute': {
+        'task': 'pharmacy.tasks.release_expired_reservations_task',
+        'schedule': crontab(minute='*'),
+    },
+    'rebuild-medication-price-index-daily': {
+        'task': 'pharmacy.tasks.rebuild_price_index_task',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'mark-missed-medication-doses-daily': {
+        'task': 'pharmacy.tasks.mark_missed_doses_task',
+        'schedule': crontab(hour=0, minute=30),
     },
 }
 
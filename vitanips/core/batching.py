@@ -0,0 +1,62 @@
+# vitanips/core/batching.py
+"""
+Batched relation loading for DRF serializers.
+
+SerializerMethodFields that hit the database once per row turn a page of N
+objects into N (or k*N) queries. Serializers using BatchLoadingMixin declare
+named loaders instead; when serialized with many=True, BatchedListSerializer
+hands the whole page to every loader up front (one query per relation), and
+method fields read the results with get_batched(). Single-object
+serialization falls back to running the loader for just that object.
+"""
+from django.db import models
+from rest_framework import serializers
+
+_MISSING = object()
+
+
+class BatchedListSerializer(serializers.ListSerializer):
+    """ListSerializer that primes the child's batch loaders with the full page before serializing rows."""
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        instances = list(iterable)
+        if hasattr(self.child, 'prime_batches'):
+            self.child.prime_batches(instances)
+        return [self.child.to_representation(item) for item in instances]
+
+
+class BatchLoadingMixin:
+    """
+    Mixin for serializers whose method fields need related rows.
+
+    `batch_loaders` lists loader names; each name maps to a `load_<name>(instances)`
+    method returning a dict keyed by instance pk. Loaders run in declaration
+    order, so a later loader may call get_batched() on an earlier one.
+    """
+    batch_loaders = ()
+
+    def _get_batch_cache(self):
+        cache = getattr(self, '_batch_cache', None)
+        if cache is None:
+            cache = self._batch_cache = {}
+        return cache
+
+    def prime_batches(self, instances):
+        instances = [instance for instance in instances if instance is not None]
+        cache = self._get_batch_cache()
+        for name in self.batch_loaders:
+            loaded = getattr(self, f'load_{name}')(instances) if instances else {}
+            results = cache.setdefault(name, {})
+            for instance in instances:
+                results[instance.pk] = loaded.get(instance.pk, _MISSING)
+
+    def get_batched(self, name, obj, default=None):
+        results = self._get_batch_cache().get(name)
+        if results is None or obj.pk not in results:
+            # Not part of a primed page (e.g. a detail view): load just this object
+            loaded = getattr(self, f'load_{name}')([obj])
+            results = self._get_batch_cache().setdefault(name, {})
+            results[obj.pk] = loaded.get(obj.pk, _MISSING)
+        value = results[obj.pk]
+        return default if value is _MISSING else value
@@ -0,0 +1,135 @@
+# vitanips/core/geocoding.py
+"""
+Address geocoding with a shared cache, rate limiting and pluggable providers.
+
+The provider is chosen by settings.GEOCODING_PROVIDER (a dotted path):
+GoogleGeocoder calls the Google Geocoding API; StaticGeocoder answers from
+settings.GEOCODING_STATIC_RESULTS and is meant for tests and local
+development. Results, including "not found", are cached by normalized
+address so repeated addresses never hit the provider twice. The cache and
+the GEOCODING_RATE_LIMIT counter live in the default cache, which is Redis
+(see CACHES in settings), so both are shared by every web and Celery worker
+process; with a per-process cache backend the limit would apply to each
+process separately.
+"""
+import hashlib
+import logging
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+FOUND_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+NOT_FOUND_CACHE_TIMEOUT = 60 * 60 * 24
+_NOT_FOUND = 'not_found'
+
+
+class GeocodingError(Exception):
+    """The provider failed permanently for this request (bad key, malformed request)."""
+
+
+class TransientGeocodingError(GeocodingError):
+    """Timeouts, rate limiting and server errors; worth retrying later."""
+
+
+class BaseGeocoder:
+    def geocode(self, address):
+        """(latitude, longitude) for the address, or None if it cannot be located."""
+        raise NotImplementedError
+
+
+class GoogleGeocoder(BaseGeocoder):
+    url = 'https://maps.googleapis.com/maps/api/geocode/json'
+
+    def __init__(self):
+        self.api_key = getattr(settings, 'GOOGLE_MAPS_API_KEY', None)
+        self.timeout = getattr(settings, 'GEOCODING_TIMEOUT', 5)
+
+    def geocode(self, address):
+        if not self.api_key:
+            raise GeocodingError("GOOGLE_MAPS_API_KEY not found in settings.")
+        try:
+            response = requests.get(self.url, params={'address': address, 'key': self.api_key}, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise TransientGeocodingError(str(e))
+        if response.status_code >= 500:
+            raise TransientGeocodingError(f"Geocoding API returned HTTP {response.status_code}")
+        data = response.json()
+        status = data.get('status')
+        if status == 'OK' and data.get('results'):
+            location = data['results'][0]['geometry']['location']
+            return location['lat'], location['lng']
+        if status == 'ZERO_RESULTS':
+            return None
+        if status in ('OVER_QUERY_LIMIT', 'UNKNOWN_ERROR'):
+            raise TransientGeocodingError(f"Geocoding API status {status}")
+        raise GeocodingError(f"Geocoding API status {status}: {data.get('error_message', '')}")
+
+
+class StaticGeocoder(BaseGeocoder):
+    """Answers from settings.GEOCODING_STATIC_RESULTS ({address: (lat, lng)}); unknown addresses are not found."""
+
+    def geocode(self, address):
+        results = {
+            normalize_address(key): value
+            for key, value in getattr(settings, 'GEOCODING_STATIC_RESULTS', {}).items()
+        }
+        return results.get(normalize_address(address))
+
+
+def get_geocoder():
+    path = getattr(settings, 'GEOCODING_PROVIDER', 'vitanips.core.geocoding.GoogleGeocoder')
+    return import_string(path)()
+
+
+def normalize_address(address):
+    return ' '.join((address or '').lower().replace(',', ' ').split())
+
+
+def _cache_key(address):
+    digest = hashlib.sha1(normalize_address(address).encode()).hexdigest()
+    return f'geocode:{digest}'
+
+
+def _wait_for_rate_limit():
+    """Block until a provider call fits in the GEOCODING_RATE_LIMIT requests/second budget."""
+    limit = getattr(settings, 'GEOCODING_RATE_LIMIT', 10)
+    if not limit:
+        return
+    while True:
+        window = int(time.time())
+        key = f'geocode:rate:{window}'
+        cache.add(key, 0, timeout=2)
+        try:
+            used = cache.incr(key)
+        except ValueError:
+            used = 1
+        if used <= limit:
+            return
+        time.sleep(max(0.0, window + 1 - time.time()))
+
+
+def geocode_address(address, geocoder=None):
+    """
+    Cached geocoding: (latitude, longitude), or None if the address cannot
+    be located. Raises TransientGeocodingError when the caller should retry.
+    """
+    key = _cache_key(address)
+    cached = cache.get(key)
+    if cached == _NOT_FOUND:
+        return None
+    if cached is not None:
+        return tuple(cached)
+
+    geocoder = geocoder or get_geocoder()
+    _wait_for_rate_limit()
+    result = geocoder.geocode(address)
+    if result is None:
+        cache.set(key, _NOT_FOUND, NOT_FOUND_CACHE_TIMEOUT)
+        return None
+    cache.set(key, tuple(result), FOUND_CACHE_TIMEOUT)
+    return tuple(result)
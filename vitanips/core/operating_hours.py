@@ -0,0 +1,234 @@
+# vitanips/core/operating_hours.py
+"""
+Structured weekly opening hours parsed from free-text `operating_hours`.
+
+Hours are stored as intervals of minutes since Monday 00:00 local time
+(settings.OPERATING_HOURS_TIME_ZONE; [start_minute, end_minute), 0..10080) in a per-model interval table, so
+"open at <datetime>" is an indexed range lookup instead of parsing text on
+the client. The parser understands the forms found in the data, e.g.
+"24/7", "9am-5pm", "9:00 AM - 9:00 PM", "9-5",
+"Mon-Fri: 9AM-8PM, Sat-Sun: 10AM-6PM", "Daily 8-22; Sun closed" and, with
+the days after the hours, "9:00-17:00 Monday to Friday". Text it cannot make
+sense of, including any words left over between the entries it recognises,
+yields no intervals, and such places are never reported open (unless
+flagged is_24_hours).
+"""
+import re
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+_DAY_NAMES = {
+    'mon': 0, 'monday': 0,
+    'tue': 1, 'tues': 1, 'tuesday': 1,
+    'wed': 2, 'weds': 2, 'wednesday': 2,
+    'thu': 3, 'thur': 3, 'thurs': 3, 'thursday': 3,
+    'fri': 4, 'friday': 4,
+    'sat': 5, 'saturday': 5,
+    'sun': 6, 'sunday': 6,
+}
+_DAY = r'(?:' + '|'.join(sorted(_DAY_NAMES, key=len, reverse=True)) + r')\.?'
+_DAY_SPAN = rf'{_DAY}(?:\s*(?:-|–|to)\s*{_DAY})?'
+_DAYS = rf'(?:daily|every\s*day|everyday|weekdays|weekends|{_DAY_SPAN}(?:\s*(?:,|&|and|/)\s*{_DAY_SPAN})*)'
+_TIME = r'(?:noon|midnight|\d{1,2}(?:[:.]\d{2})?\s*(?:[ap]\.?m\.?)?)'
+_HOURS = rf'(?:closed|{_TIME}\s*(?:-|–|to)\s*{_TIME})'
+# Days either lead ("Mon-Fri: 9-5") or trail ("9-5 Mon-Fri"); trailing days
+# followed by hours of their own lead the next entry instead (taken whole, so
+# "Sat-Sun: 10-6" is not split into a trailing "Sat" and a stray "-Sun")
+_ENTRY = re.compile(
+    rf'(?:(?P<days>{_DAYS})\s*:?\s*)?(?P<hours>closed|(?P<open>{_TIME})\s*(?:-|–|to)\s*(?P<close>{_TIME}))'
+    rf'(?:\s*,?\s*(?:on\s+)?(?P<days_after>(?>{_DAYS}))(?!\s*:?\s*{_HOURS}))?'
+)
+# What may separate (or surround) entries without making the text unreadable
+_FILLER = re.compile(r'(?:[\s,;|&/.]|\band\b|\bopen\b|(?:closed\s+)?(?:on\s+)?(?:public\s+|bank\s+)?holidays?)*')
+_ALWAYS_OPEN = re.compile(r'24\s*/\s*7|24\s*hours?|open\s*24|always\s*open|round\s*the\s*clock')
+_TIME_PARTS = re.compile(r'(\d{1,2})(?:[:.](\d{2}))?\s*([ap])?')
+
+
+class OpeningIntervalBase(models.Model):
+    """One weekly opening interval; subclasses add the foreign key to their owner."""
+    start_minute = models.PositiveIntegerField(help_text="Minutes since Monday 00:00, inclusive")
+    end_minute = models.PositiveIntegerField(help_text="Minutes since Monday 00:00, exclusive")
+
+    class Meta:
+        abstract = True
+
+
+def _expand_days(spec):
+    if spec is None or re.fullmatch(r'daily|every\s*day|everyday', spec):
+        return list(range(7))
+    if spec == 'weekdays':
+        return list(range(5))
+    if spec == 'weekends':
+        return [5, 6]
+    days = []
+    for part in re.split(r'\s*(?:,|&|and|/)\s*', spec):
+        bounds = [_DAY_NAMES[name.rstrip('.')] for name in re.split(r'\s*(?:-|–|to)\s*', part) if name]
+        first, last = bounds[0], bounds[-1]
+        day = first
+        days.append(day)
+        while day != last:
+            day = (day + 1) % 7
+            days.append(day)
+    return days
+
+
+def _parse_time(text):
+    """(minute of day, meridiem or None)."""
+    text = text.replace('.', ':') if re.fullmatch(r'\d{1,2}\.\d{2}.*', text) else text.replace('.', '')
+    if text == 'noon':
+        return 12 * 60, 'p'
+    if text == 'midnight':
+        return 0, 'a'
+    hour, minute, meridiem = _TIME_PARTS.match(text).groups()
+    hour, minute = int(hour), int(minute or 0)
+    if meridiem == 'p' and hour < 12:
+        hour += 12
+    elif meridiem == 'a' and hour == 12:
+        hour = 0
+    if hour > 24 or minute > 59:
+        raise ValueError(text)
+    return hour * 60 + minute, meridiem
+
+
+def _daily_span(open_text, close_text):
+    start, _ = _parse_time(open_text)
+    end, close_meridiem = _parse_time(close_text)
+    # "9-5" means 9:00-17:00
+    if end <= start and close_meridiem is None and end < 12 * 60:
+        end += 12 * 60
+    if end <= start:
+        # Past midnight, e.g. "8pm-2am"
+        end += MINUTES_PER_DAY
+    return start, end
+
+
+def _merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+
+def parse_operating_hours(text):
+    """
+    Weekly opening intervals for free-text hours, as sorted, non-overlapping
+    (start_minute, end_minute) pairs; None if the text cannot be understood.
+    """
+    text = ' '.join((text or '').lower().split())
+    if not text:
+        return None
+    if _ALWAYS_OPEN.search(text):
+        return [(0, MINUTES_PER_WEEK)]
+
+    schedule = {}
+    explicit = set()
+    position = 0
+    for match in _ENTRY.finditer(text):
+        if not _FILLER.fullmatch(text, position, match.start()):
+            return None
+        position = match.end()
+        if match.group('days') and match.group('days_after'):
+            # e.g. "Mon 9-5 Tue": which entry "Tue" belongs to is anyone's guess
+            return None
+        named = match.group('days') or match.group('days_after')
+        days = _expand_days(named)
+        if match.group('hours') == 'closed':
+            if not named:
+                # e.g. "closed on public holidays"
+                continue
+            for day in days:
+                schedule[day] = []
+                explicit.add(day)
+            continue
+        try:
+            span = _daily_span(match.group('open'), match.group('close'))
+        except ValueError:
+            continue
+        for day in days:
+            # A day named on its own replaces what "daily" gave it; naming it again adds a shift
+            if named and day not in explicit:
+                schedule[day] = []
+                explicit.add(day)
+            schedule.setdefault(day, []).append(span)
+    if not schedule or not _FILLER.fullmatch(text, position):
+        return None
+
+    intervals = []
+    for day, spans in schedule.items():
+        for start, end in spans:
+            start, end = day * MINUTES_PER_DAY + start, day * MINUTES_PER_DAY + end
+            if end > MINUTES_PER_WEEK:
+                # Sunday night into Monday morning
+                intervals.append((0, end - MINUTES_PER_WEEK))
+                end = MINUTES_PER_WEEK
+            intervals.append((start, end))
+    return _merge(intervals)
+
+
+def operating_hours_zone():
+    return ZoneInfo(getattr(settings, 'OPERATING_HOURS_TIME_ZONE', 'Africa/Lagos'))
+
+
+def minute_of_week(value):
+    value = timezone.localtime(value, operating_hours_zone())
+    return value.weekday() * MINUTES_PER_DAY + value.hour * 60 + value.minute
+
+
+def requested_open_time(query_params):
+    """
+    The time an `open_now=true` or `open_at=<ISO datetime>` query asks
+    about, or None if neither is given. Raises ValueError for a bad open_at.
+    """
+    open_at = query_params.get('open_at')
+    if open_at:
+        when = parse_datetime(open_at)
+        if when is None:
+            raise ValueError(f"Invalid open_at '{open_at}'.")
+        # A time without an offset is read on the same clock as the hours
+        return timezone.make_aware(when, operating_hours_zone()) if timezone.is_naive(when) else when
+    if str(query_params.get('open_now', '')).lower() in ('true', '1'):
+        return timezone.now()
+    return None
+
+
+def open_at_filter(interval_model, owner_field, when):
+    """Q matching owners (with an is_24_hours flag) open at `when`."""
+    minute = minute_of_week(when)
+    return Q(is_24_hours=True) | Q(Exists(
+        interval_model.objects.filter(
+            **{owner_field: OuterRef('pk')}, start_minute__lte=minute, end_minute__gt=minute
+        )
+    ))
+
+
+def sync_opening_intervals(owners, interval_model, owner_field):
+    """
+    Replace the stored intervals of `owners` with those parsed from their
+    operating_hours, in one delete and one bulk insert. Returns how many
+    owners had text that could not be parsed.
+    """
+    rows, unparsed = [], 0
+    for owner in owners:
+        intervals = parse_operating_hours(owner.operating_hours)
+        if intervals is None:
+            unparsed += bool((owner.operating_hours or '').strip())
+            continue
+        rows.extend(
+            interval_model(**{owner_field: owner}, start_minute=start, end_minute=end)
+            for start, end in intervals
+        )
+    with transaction.atomic():
+        interval_model.objects.filter(**{f'{owner_field}__in': owners}).delete()
+        interval_model.objects.bulk_create(rows)
+    return unparsed
@@ -1,4 +1,5 @@
 # vitanips/core/tests.py
+from django.test import SimpleTestCase
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
@@ -49,3 +50,57 @@ class AdminViewsTestCase(APITestCase):
         url = reverse('admin-stats')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ParseOperatingHoursTestCase(SimpleTestCase):
+    def weekdays(self, start, end):
+        from vitanips.core.operating_hours import MINUTES_PER_DAY
+        return [(day * MINUTES_PER_DAY + start, day * MINUTES_PER_DAY + end) for day in range(5)]
+
+    def test_days_before_or_after_the_hours(self):
+        """
+        Ensure the days apply whether they are written before or after the hours.
+        """
+        from vitanips.core.operating_hours import parse_operating_hours
+        expected = self.weekdays(9 * 60, 17 * 60)
+        self.assertEqual(parse_operating_hours('Mon-Fri: 9:00-17:00'), expected)
+        self.assertEqual(parse_operating_hours('9:00-17:00 Monday to Friday'), expected)
+        self.assertEqual(parse_operating_hours('9am-5pm on weekdays'), expected)
+        self.assertEqual(
+            parse_operating_hours('9-5 Mon-Fri, 10-2 Sat'),
+            parse_operating_hours('Mon-Fri 9-5, Sat 10-2'),
+        )
+        self.assertEqual(
+            parse_operating_hours('Mon-Fri: 9AM-8PM, Sat-Sun: 10AM-6PM'),
+            parse_operating_hours('9AM-8PM Mon-Fri, 10AM-6PM Sat-Sun'),
+        )
+
+    def test_unrecognised_text_is_not_parsed(self):
+        """
+        Ensure leftover words make the whole text unparsed rather than quietly dropped.
+        """
+        from vitanips.core.operating_hours import parse_operating_hours
+        self.assertIsNone(parse_operating_hours('9-5 except Tuesdays'))
+        self.assertIsNone(parse_operating_hours('Mon 9-5 Tue'))
+        self.assertIsNone(parse_operating_hours('by appointment'))
+        self.assertEqual(
+            parse_operating_hours('Mon-Fri 9-5, closed on public holidays'), self.weekdays(9 * 60, 17 * 60)
+        )
+
+    def test_minute_of_week_uses_operating_hours_zone(self):
+        """
+        Ensure the hours are read on the configured local clock, not UTC, across the week boundary.
+        """
+        from datetime import datetime, timezone as dt_timezone
+        from django.test import override_settings
+        from vitanips.core.operating_hours import MINUTES_PER_WEEK, minute_of_week, requested_open_time
+
+        # Sunday 23:30 UTC is already Monday 00:30 in Lagos (UTC+1)
+        sunday_late = datetime(2026, 1, 4, 23, 30, tzinfo=dt_timezone.utc)
+        with override_settings(OPERATING_HOURS_TIME_ZONE='Africa/Lagos'):
+            self.assertEqual(minute_of_week(sunday_late), 30)
+            # 08:30 UTC is 09:30 on the pharmacy's clock: inside "Mon-Fri 9-5"
+            self.assertEqual(minute_of_week(datetime(2026, 1, 5, 8, 30, tzinfo=dt_timezone.utc)), 9 * 60 + 30)
+            self.assertEqual(minute_of_week(requested_open_time({'open_at': '2026-01-05T08:59'})), 8 * 60 + 59)
+        with override_settings(OPERATING_HOURS_TIME_ZONE='UTC'):
+            self.assertEqual(minute_of_week(sunday_late), MINUTES_PER_WEEK - 30)
@@ -1,5 +1,6 @@
 # vitanips/settings.py
 import os
+import sys
 from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
@@ -64,6 +65,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.gis',
+    'django.contrib.postgres',
     
     # Third-party apps
     'rest_framework',
@@ -139,6 +141,28 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Cache: shared by every web and worker process (entitlement counters,
+# geocoding rate limit and results), so it must not be per-process memory
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": config(
+            'REDIS_CACHE_URL',
+            default=f"redis://{config('REDIS_HOST', default='localhost')}:{config('REDIS_PORT', default=6379, cast=int)}/1",
+        ),
+        "KEY_PREFIX": "vitanips",
+    },
+}
+
+# Test runs (manage.py test or pytest) get a local cache so they need no Redis
+TESTING = 'test' in sys.argv[1:2] or 'pytest' in sys.modules
+if TESTING:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    }
+
 # Database
 database_url = config('DATABASE_URL', default=None)
 is_production_db = database_url and 'localhost' not in database_url.lower() and '127.0.0.1' not in database_url.lower()
@@ -211,6 +235,8 @@ LOCALE_PATHS = [
 USE_I18N = True
 USE_L10N = True
 USE_TZ = True
+# Wall-clock zone that pharmacy and clinic operating_hours text is written in
+OPERATING_HOURS_TIME_ZONE = config('OPERATING_HOURS_TIME_ZONE', default='Africa/Lagos')
 
 # Static files (CSS, JavaScript, Images)
 logger = logging.getLogger(__name__)
@@ -369,9 +395,9 @@ CELERY_CACHE_BACKEND = 'default'
 from celery.schedules import crontab
 
 CELERY_BEAT_SCHEDULE = {
-    'check-appointment-reminders': {
-        'task': 'notifications.tasks.check_appointment_reminders',
-        'schedule': crontab(minute='*/15'),  # Every 15 minutes
+    'dispatch-appointment-reminders': {
+        'task': 'notifications.tasks.dispatch_appointment_reminders',
+        'schedule': crontab(minute='*'),  # Every minute; only claims jobs whose fire_at has passed
     },
     'check-medication-refill-reminders': {
         'task': 'notifications.tasks.check_medication_refill_reminders',
@@ -389,8 +415,41 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'notifications.tasks.cleanup_old_notifications',
         'schedule': crontab(hour='2', minute='0'),  # Daily at 2 AM
     },
+    'prune-inventory-tombstones': {
+        'task': 'pharmacy.tasks.prune_inventory_tombstones_task',
+        'schedule': crontab(hour='3', minute='30'),  # Daily at 3:30 AM
+    },
+    'prune-pharmacy-order-events': {
+        'task': 'pharmacy.tasks.prune_order_events_task',
+        'schedule': crontab(hour='3', minute='45'),  # Daily at 3:45 AM
+    },
+    'geocode-missing-pharmacy-locations': {
+        'task': 'pharmacy.tasks.geocode_missing_pharmacy_locations',
+        'schedule': crontab(minute='*/5'),  # Every 5 minutes
+    },
+    'release-expired-stock-reservations': {
+        'task': 'pharmacy.tasks.release_expired_reservations_task',
+        'schedule': crontab(minute='*'),  # Every minute
+    },
+    'rebuild-medication-price-index': {
+        'task': 'pharmacy.tasks.rebuild_price_index_task',
+        'schedule': crontab(hour='4', minute='0'),  # Daily at 4 AM
+    },
+    'mark-missed-medication-doses': {
+        'task': 'pharmacy.tasks.mark_missed_doses_task',
+        'schedule': crontab(hour='0', minute='30'),  # Daily at 12:30 AM, for the previous day
+    },
 }
 
+# Stock held for a pending medication order is released after this many minutes
+STOCK_RESERVATION_TTL_MINUTES = config('STOCK_RESERVATION_TTL_MINUTES', default=30, cast=int)
+
+# --- Geocoding (pharmacy locations are filled in by a background task) ---
+GOOGLE_MAPS_API_KEY = config('GOOGLE_MAPS_API_KEY', default='')
+GEOCODING_PROVIDER = config('GEOCODING_PROVIDER', default='vitanips.core.geocoding.GoogleGeocoder')
+GEOCODING_RATE_LIMIT = config('GEOCODING_RATE_LIMIT', default=10, cast=int)  # Provider requests per second
+GEOCODING_TIMEOUT = config('GEOCODING_TIMEOUT', default=5, cast=int)
+
 # --- Email Configuration ---
 # Intelligently select email backend based on environment and available credentials
 EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')